@@ -6,25 +6,49 @@ A minimal demo app for the LangFlow-based apartment matching workflow
 from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 import os
 import json
 import requests
 import re
+import html
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
 import imaplib
 import email
 from email.header import decode_header
-from email.utils import parsedate_to_datetime
-from bs4 import BeautifulSoup
+from email.message import EmailMessage
+from email.utils import getaddresses, parsedate_to_datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from storage import Storage, create_storage
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 import asyncio
 import logging
+import base64
+import bisect
+import uuid
+import hashlib
+import hmac
+import weakref
+import time
+import unicodedata
+import random
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+
+# Pillow (requirements.txt) enables perceptual-hash dedupe and local downscaling of listing photos before
+# vision calls; without it only exact duplicates are dropped
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 # Load environment variables
 load_dotenv()
@@ -64,6 +88,16 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+# Compress JSON/HTML responses (analysis reports are large markdown blobs).
+# Brotli is used when the optional brotli-asgi package is installed; it falls back to gzip for older clients.
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True)
+    logger.info("Response compression: brotli (gzip fallback)")
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+    logger.info("Response compression: gzip")
+
 # Initialize Supabase client (optional at boot; required for auth/db features)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -84,6 +118,18 @@ if SUPABASE_URL and SUPABASE_KEY:
 else:
     logger.warning("Supabase not configured (SUPABASE_URL / SUPABASE_KEY missing). App will run, but auth/db features are disabled.")
 
+# Storage for user criteria, processed emails/analyses and listing facts: the Supabase tables, or an embedded
+# SQLite database (STORAGE_BACKEND=sqlite) for single-node deployments and offline development. Auth (register/
+# login) and the optional tables (fingerprints, tracking redirects, listing changes) still need Supabase.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "repa.db")
+storage: Optional[Storage] = create_storage(STORAGE_BACKEND, supabase_admin, SQLITE_PATH)
+if storage:
+    logger.info(f"Storage backend: {storage.name}" + (f" ({SQLITE_PATH})" if storage.name == "sqlite" else ""))
+
+# OpenAI-compatible API base URL (override for a proxy or the local batch stand-in, see openai_batch_standin.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
 # JWT settings (optional at boot; required for auth-protected endpoints)
 JWT_SECRET = os.getenv("JWT_SECRET") or SUPABASE_KEY
 JWT_ALGORITHM = "HS256"
@@ -106,13 +152,64 @@ def _require_supabase() -> None:
         )
 
 
+def _require_storage() -> None:
+    """Guard for endpoints that read or write user data (Supabase or the embedded SQLite storage)."""
+    if not storage:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server database is not configured (missing Supabase environment variables; or set STORAGE_BACKEND=sqlite).",
+        )
+
+
+def _make_etag(content: bytes) -> str:
+    """Weak content-hash ETag (weak because compression changes the bytes on the wire)."""
+    return f'W/"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header matches the ETag (weak comparison)."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _conditional_response(request: Request, content: bytes, media_type: str, cache_control: str = "private, no-cache") -> Response:
+    """Return 304 if the client already has this exact content, otherwise the content with its ETag."""
+    etag = _make_etag(content)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+def _conditional_json_response(request: Request, payload: dict) -> Response:
+    """JSON response with ETag / If-None-Match handling."""
+    content = json.dumps(payload, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _conditional_response(request, content, "application/json")
+
+
 class ChatRequest(BaseModel):
     message: str
 
 
+class BatchAnalyzeRequest(BaseModel):
+    urls: List[str]
+
+
 class ChatResponse(BaseModel):
     response: str
     status: str = "success"
+    degraded: List[str] = []  # stages shortened to stay within the latency budget, e.g. "images_skipped"
 
 
 class RegisterRequest(BaseModel):
@@ -251,7 +348,164 @@ def extract_url_from_message(message: str) -> tuple[str, str]:
     return message, ""
 
 
-def call_firecrawl_scraper(url: str) -> dict:
+# Circuit breakers for upstream APIs: after BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls failed
+# (at least BREAKER_MIN_CALLS), calls are refused for BREAKER_OPEN_SECONDS, then one probe call decides
+# whether to close again (half-open). Transient errors (429/5xx, timeouts) are retried with jittered backoff.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "60"))
+BREAKER_PROBE_TIMEOUT_SECONDS = float(os.getenv("BREAKER_PROBE_TIMEOUT_SECONDS", "120"))  # a probe that never reports back
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_RETRY_BASE_SECONDS = 1.0
+UPSTREAM_RETRY_MAX_SECONDS = 8.0
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker (closed -> open -> half-open -> closed); thread-safe."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)  # True = success
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_started_at = 0.0
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "closed":
+                return True
+            # A probe that has not reported back in time is considered lost; let another one through
+            if self.state == "half_open" and (
+                not self.probe_in_flight or time.monotonic() - self.probe_started_at >= BREAKER_PROBE_TIMEOUT_SECONDS
+            ):
+                self.probe_in_flight = True
+                self.probe_started_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, success: Optional[bool]) -> None:
+        """Outcome of one logical call; None (e.g. rate limited) only settles a half-open probe."""
+        with self.lock:
+            if self.state == "half_open":
+                self.probe_in_flight = False
+                if success:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                    logger.info(f"Circuit breaker '{self.name}' closed")
+                elif success is False:
+                    self._open()
+                return
+            if success is None:
+                return
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if self.state == "closed" and len(self.outcomes) >= BREAKER_MIN_CALLS and failures / len(self.outcomes) >= BREAKER_FAILURE_RATE:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(f"Circuit breaker '{self.name}' opened for {BREAKER_OPEN_SECONDS:.0f}s")
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "recent_calls": len(self.outcomes),
+                "recent_failures": self.outcomes.count(False),
+                "times_opened": self.times_opened,
+                "retry_in_seconds": round(max(0.0, BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1) if self.state == "open" else None,
+            }
+
+
+_circuit_breakers = {name: CircuitBreaker(name) for name in ("firecrawl", "openai")}
+
+
+def upstream_request(upstream: str, method: str, url: str, timeout: float = 30, **kwargs) -> requests.Response:
+    """
+    HTTP request to an upstream API through its circuit breaker. Transient failures (429/5xx, connection
+    errors, timeouts) are retried up to UPSTREAM_MAX_ATTEMPTS times with jittered exponential backoff, all
+    within `timeout` seconds overall. The breaker sees one outcome per call, that of the last attempt; a 429
+    is not a failure (the upstream is up, only throttling us). A half-open probe makes a single attempt.
+    Returns the last response (callers still raise_for_status); raises CircuitOpenError if the breaker
+    refuses the call.
+    """
+    breaker = _circuit_breakers[upstream]
+    if not breaker.allow():
+        raise CircuitOpenError(f"{upstream} is temporarily unavailable (circuit breaker open)")
+    attempts = 1 if breaker.state == "half_open" else UPSTREAM_MAX_ATTEMPTS
+    deadline = time.monotonic() + timeout
+    for attempt in range(attempts):
+        retry_after = None
+        try:
+            response = requests.request(method, url, timeout=max(1.0, deadline - time.monotonic()), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error, success = e, False
+        except BaseException:
+            # Any other failure (TLS, invalid URL, broken stream, cancellation) must still settle a half-open probe
+            breaker.record(False)
+            raise
+        else:
+            if response.status_code not in TRANSIENT_STATUS_CODES:
+                breaker.record(True)
+                return response
+            error, success = None, (None if response.status_code == 429 else False)
+            retry_after = response.headers.get("Retry-After")
+
+        delay = min(UPSTREAM_RETRY_MAX_SECONDS, UPSTREAM_RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), UPSTREAM_RETRY_MAX_SECONDS))
+        if attempt == attempts - 1 or time.monotonic() + delay + 1.0 > deadline:
+            breaker.record(success)
+            if error is not None:
+                raise error
+            return response
+        _pipeline_stats[f"{upstream}_retries"] += 1
+        logger.info(f"Retrying {upstream} request in {delay:.1f}s (attempt {attempt + 1} failed: {error or response.status_code})")
+        time.sleep(delay)
+
+
+# End-to-end latency budget for /api/chat. Each stage gets what is left of it; optional stages
+# (photo analysis, remaining photos, the full narrative) are cut first so the report still arrives in time.
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "45"))
+CHAT_REPORT_RESERVE_SECONDS = float(os.getenv("CHAT_REPORT_RESERVE_SECONDS", "15"))  # kept free for the report
+CHAT_FULL_REPORT_MIN_SECONDS = float(os.getenv("CHAT_FULL_REPORT_MIN_SECONDS", "12"))  # else compact verdict
+VISION_MIN_SECONDS = 6.0  # do not start a vision request with less time left
+
+
+# Shown under a report when a stage was shortened (ChatResponse.degraded)
+DEGRADED_STAGE_NOTES = {
+    "images_skipped": "photo analysis skipped",
+    "images_truncated": "only some photos analyzed",
+    "report_compact": "short verdict instead of the full report",
+}
+
+
+def _budget(deadline: Optional[float], cap: float) -> float:
+    """Timeout for a stage: cap, or the time left before the deadline (time.monotonic()) if shorter"""
+    if deadline is None:
+        return cap
+    return max(1.0, min(cap, deadline - time.monotonic()))
+
+
+def _time_left(deadline: Optional[float]) -> float:
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+
+def call_firecrawl_scraper(url: str, timeout: float = 30) -> dict:
     """Scrape the listing URL using Firecrawl API"""
     api_key = os.getenv("FIRECRAWL_API_KEY")
     if not api_key:
@@ -268,11 +522,13 @@ def call_firecrawl_scraper(url: str) -> dict:
     }
     
     try:
-        response = requests.post(
+        response = upstream_request(
+            "firecrawl",
+            "POST",
             "https://api.firecrawl.dev/v1/scrape",
             json=payload,
             headers=headers,
-            timeout=30
+            timeout=timeout
         )
         response.raise_for_status()
         result = response.json()
@@ -289,11 +545,206 @@ def call_firecrawl_scraper(url: str) -> dict:
         else:
             return {"error": result.get("error", "Unknown error")}
     
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
 
-def extract_criteria_with_openai(user_message: str) -> dict:
+# Model routing per LLM stage. "model" is the cheap, fast default; "escalation_model" handles inputs above
+# escalate_above_chars (user-message characters) and retries low-confidence results (see openai_chat_parsed).
+MODEL_ROUTES = {
+    "criteria": {
+        "model": os.getenv("CRITERIA_MODEL", "gpt-4o-mini"),
+        "escalation_model": os.getenv("CRITERIA_ESCALATION_MODEL", "gpt-4o"),
+        "escalate_above_chars": int(os.getenv("CRITERIA_ESCALATE_ABOVE_CHARS", "1500")),
+    },
+    "facts": {
+        "model": os.getenv("LISTING_FACTS_MODEL", "gpt-4o-mini"),
+        "escalation_model": os.getenv("LISTING_FACTS_ESCALATION_MODEL", "gpt-4o"),
+        "escalate_above_chars": int(os.getenv("LISTING_FACTS_ESCALATE_ABOVE_CHARS", "40000")),
+    },
+    "vision": {
+        "model": os.getenv("VISION_MODEL", "gpt-4o-mini"),
+        "escalation_model": os.getenv("VISION_ESCALATION_MODEL", "gpt-4o-mini"),
+        "escalate_above_chars": None,
+    },
+    "report": {
+        "model": os.getenv("REPORT_MODEL", "gpt-4o-mini"),
+        "escalation_model": os.getenv("REPORT_ESCALATION_MODEL", "gpt-4o"),
+        "escalate_above_chars": int(os.getenv("REPORT_ESCALATE_ABOVE_CHARS", "12000")),
+    },
+}
+
+# USD per 1M tokens (input, cached input, output) for the cost estimate in the model statistics
+MODEL_PRICING_USD_PER_1M = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+# Per "stage/model" call statistics (calls, errors, escalations, tokens, latency, cost), reported on /health
+_model_stats: Dict[str, Counter] = {}
+
+
+class LowConfidenceResult(Exception):
+    """Raised by an openai_chat_parsed parser for a usable but doubtful result; carries the value."""
+
+    def __init__(self, value, reason: str):
+        super().__init__(reason)
+        self.value = value
+
+
+def _prompt_chars(payload: dict) -> int:
+    """Size of the variable input of a chat-completions request: characters of the user messages"""
+    chars = 0
+    for message in payload.get("messages", []):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return chars
+
+
+def route_model(stage: str, input_chars: int = 0, escalate: bool = False) -> str:
+    """Model for an LLM stage: the escalation model for large inputs or when escalating, else the default"""
+    route = MODEL_ROUTES[stage]
+    threshold = route["escalate_above_chars"]
+    if escalate or (threshold is not None and input_chars > threshold):
+        return route["escalation_model"]
+    return route["model"]
+
+
+def record_model_call(stage: str, model: str, input_chars: int, latency_ms: Optional[float], result: Optional[dict] = None, error: bool = False) -> None:
+    """Add one LLM call to the per stage/model statistics (latency_ms is None for batch results)"""
+    stats = _model_stats.setdefault(f"{stage}/{model}", Counter())
+    stats["calls"] += 1
+    stats["input_chars"] += input_chars
+    if error:
+        stats["errors"] += 1
+    if latency_ms is not None:
+        stats["timed_calls"] += 1
+        stats["latency_ms_total"] += int(latency_ms)
+        stats["latency_ms_max"] = max(stats["latency_ms_max"], int(latency_ms))
+    usage = (result or {}).get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    stats["prompt_tokens"] += prompt_tokens
+    stats["cached_tokens"] += cached_tokens
+    stats["completion_tokens"] += completion_tokens
+    pricing = MODEL_PRICING_USD_PER_1M.get(model)
+    if pricing:
+        # Batch API requests are billed at half price
+        discount = 0.5 if latency_ms is None else 1.0
+        stats["cost_usd_micros"] += int(discount * (
+            (prompt_tokens - cached_tokens) * pricing[0] + cached_tokens * pricing[1] + completion_tokens * pricing[2]
+        ))
+
+
+def model_stats_summary() -> dict:
+    """Per stage/model statistics with averages, for tuning MODEL_ROUTES thresholds"""
+    summary = {}
+    for key, stats in _model_stats.items():
+        calls = stats["calls"] or 1
+        summary[key] = {
+            **stats,
+            "avg_latency_ms": round(stats["latency_ms_total"] / stats["timed_calls"]) if stats["timed_calls"] else None,
+            "avg_input_chars": round(stats["input_chars"] / calls),
+            "avg_prompt_tokens": round(stats["prompt_tokens"] / calls),
+            "avg_completion_tokens": round(stats["completion_tokens"] / calls),
+            "cached_token_ratio": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else None,
+            "avg_cost_usd": round(stats["cost_usd_micros"] / calls / 1_000_000, 6) if stats["cost_usd_micros"] else None,
+        }
+    return summary
+
+
+def openai_chat(stage: str, payload: dict, timeout: float = 30, escalate: bool = False) -> dict:
+    """
+    POST a chat-completions request for an LLM stage. The model is chosen by route_model (overriding
+    payload["model"]) and latency/tokens are recorded per stage and model. Returns the response body;
+    raises on HTTP errors.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment")
+
+    input_chars = _prompt_chars(payload)
+    model = route_model(stage, input_chars, escalate)
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    started = time.monotonic()
+    try:
+        response = upstream_request(
+            "openai",
+            "POST",
+            f"{OPENAI_BASE_URL}/chat/completions",
+            json={**payload, "model": model},
+            headers=headers,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        result = response.json()
+    except CircuitOpenError:
+        raise
+    except Exception:
+        record_model_call(stage, model, input_chars, (time.monotonic() - started) * 1000, error=True)
+        raise
+    record_model_call(stage, model, input_chars, (time.monotonic() - started) * 1000, result)
+    return result
+
+
+def openai_chat_parsed(stage: str, payload: dict, parse, timeout: float = 30, deadline: Optional[float] = None):
+    """
+    openai_chat + parse(response body). If parsing fails or the parser raises LowConfidenceResult, the call
+    is retried once on the stage's escalation model (if the deadline leaves time for it); a low-confidence
+    value is returned if nothing better comes back.
+    """
+    input_chars = _prompt_chars(payload)
+    try:
+        return parse(openai_chat(stage, payload, timeout))
+    except (LowConfidenceResult, ValueError, KeyError, IndexError) as e:
+        first_error = e
+    escalation_model = route_model(stage, escalate=True)
+    if route_model(stage, input_chars) == escalation_model or _time_left(deadline) < VISION_MIN_SECONDS:
+        if isinstance(first_error, LowConfidenceResult):
+            return first_error.value
+        raise first_error
+    _model_stats.setdefault(f"{stage}/{escalation_model}", Counter())["escalations"] += 1
+    logger.info(f"Escalating {stage} to {escalation_model}: {first_error}")
+    try:
+        return parse(openai_chat(stage, payload, _budget(deadline, timeout), escalate=True))
+    except LowConfidenceResult as e:
+        return e.value
+    except Exception:
+        if isinstance(first_error, LowConfidenceResult):
+            return first_error.value
+        raise
+
+
+def _parse_criteria(result: dict) -> dict:
+    """Criteria JSON from an extraction response; an empty object is low confidence"""
+    criteria_text = result['choices'][0]['message']['content']
+    try:
+        criteria = json.loads(criteria_text)
+    except json.JSONDecodeError:
+        # Try to extract JSON from markdown code blocks
+        json_match = re.search(r'```json\s*(.*?)\s*```', criteria_text, re.DOTALL)
+        if not json_match:
+            raise ValueError("Failed to parse criteria as JSON")
+        criteria = json.loads(json_match.group(1))
+    if not isinstance(criteria, dict):
+        raise ValueError("Criteria are not a JSON object")
+    if not criteria:
+        raise LowConfidenceResult(criteria, "no criteria extracted")
+    return criteria
+
+
+def extract_criteria_with_openai(user_message: str, deadline: Optional[float] = None) -> dict:
     """Extract apartment criteria from user message using OpenAI"""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -391,18 +842,13 @@ Output:
 
 Now extract the criteria:"""
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
     user_prompt = f"""Now extract the criteria from the User's Request:
 <user_request>
 {user_message}
 </user_request>"""
     
     payload = {
-        "model": "gpt-4o-mini",
+        "model": route_model("criteria", len(user_prompt)),
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -411,38 +857,23 @@ Now extract the criteria:"""
     }
     
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-        result = response.json()
-        
-        criteria_text = result['choices'][0]['message']['content']
-        # Try to parse as JSON
-        try:
-            criteria = json.loads(criteria_text)
-            return criteria
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks
-            json_match = re.search(r'```json\s*(.*?)\s*```', criteria_text, re.DOTALL)
-            if json_match:
-                criteria = json.loads(json_match.group(1))
-                return criteria
-            return {"error": "Failed to parse criteria as JSON"}
-    
+        return openai_chat_parsed("criteria", payload, _parse_criteria, _budget(deadline, 30), deadline)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
 
-def analyze_images(listing_content: str, max_images: int = 5) -> str:
-    """Analyze listing images using OpenAI Vision API"""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "Image analysis skipped (no API key)"
-    
+# Image preprocessing before vision calls (see prepare_listing_images)
+IMAGE_CANDIDATES_MAX = int(os.getenv("IMAGE_CANDIDATES_MAX", "12"))  # photos fetched per listing
+IMAGE_FETCH_MAX_BYTES = 8 * 1024 * 1024
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "512"))  # vision "low" detail works on 512px anyway
+IMAGE_JPEG_QUALITY = 80
+IMAGE_DHASH_MAX_DISTANCE = int(os.getenv("IMAGE_DHASH_MAX_DISTANCE", "6"))  # bits; closer photos are near-duplicates
+
+
+def extract_image_urls(listing_content: str) -> List[str]:
+    """Listing photo URLs in page order (markdown images, else raw image URLs), without repeats"""
     # Extract image URLs from markdown - support multiple image formats
     pattern = r'!\[.*?\]\((https://[^\)]+\.(?:jpg|jpeg|png|webp))\)'
     urls = re.findall(pattern, listing_content, re.IGNORECASE)
@@ -451,332 +882,1679 @@ def analyze_images(listing_content: str, max_images: int = 5) -> str:
     if not urls:
         pattern_raw = r'https://[^\s<>"]+\.(?:jpg|jpeg|png|webp)'
         urls = re.findall(pattern_raw, listing_content, re.IGNORECASE)
-    
-    if not urls:
-        return "No images found to analyze"
-    
-    # Limit images
-    urls = list(set(urls))[:max_images]
-    
-    print(f"[Image Analysis] Found {len(urls)} unique images to analyze")
-    
-    analyses = []
-    for idx, url in enumerate(urls):
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Analyze this apartment/property image. Identify:
-1. Room type (living room, bedroom, kitchen, bathroom, exterior, view, etc.)
-2. Key features and condition (modern, renovated, spacious, natural light, etc.)
-3. Furnishing status (furnished, unfurnished, partially furnished)
-4. Notable amenities or highlights
-5. Overall impression (scale 1-10)
+    return list(dict.fromkeys(urls))
 
-Be concise but specific. Focus on details that would matter to a renter."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": url,
-                                "detail": "low"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 300
-        }
-        
-        try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            analysis = result['choices'][0]['message']['content']
-            # IMPORTANT: Include the URL so the LLM can extract it and display the image
-            analyses.append(f"### Image {idx + 1}\n**Image URL:** {url}\n\n{analysis}\n\n---\n\n")
-        except Exception as e:
-            analyses.append(f"### Image {idx + 1}\n**Image URL:** {url}\n❌ Analysis failed: {str(e)}\n\n---\n\n")
-    
-    summary = "\n".join(analyses)
-    print(f"[Image Analysis] Completed. Sample output: {summary[:300]}...")
-    return summary
 
+def _fetch_image(url: str) -> Optional[bytes]:
+    """Download one photo (None if it fails or is too large)"""
+    try:
+        response = requests.get(url, timeout=10, stream=True)
+        response.raise_for_status()
+        content = response.raw.read(IMAGE_FETCH_MAX_BYTES + 1, decode_content=True)
+        return content if len(content) <= IMAGE_FETCH_MAX_BYTES else None
+    except Exception as e:
+        logging.info(f"Could not fetch image {url}: {str(e)}")
+        return None
 
-def generate_match_report(criteria: dict, listing_data: dict, image_analysis: str = "") -> str:
-    """Generate the final match report using OpenAI"""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not found in environment")
-    
-    # Debug: Check what we're receiving
-    print(f"[Debug generate_match_report] image_analysis length: {len(image_analysis) if image_analysis else 0}")
-    print(f"[Debug generate_match_report] Has valid image analysis: {bool(image_analysis and image_analysis not in ['No images found to analyze', 'Image analysis skipped (no API key)'])}")
-    
-    system_prompt = """You are a helpful apartment rental/purchase advisor for the Swiss market. Your job is to analyze apartment listings and help users determine if they're a good match for their needs.
 
-## Your Approach:
-- Be friendly, conversational, and encouraging
-- Extract all relevant details accurately from listings
-- Compare listings objectively against the user's specific criteria
-- **CRITICAL:** If user specified property_type (rent/buy), ONLY recommend listings that match. If listing is for rent but user wants to buy (or vice versa), mark as NOT A GOOD FIT immediately.
-- Only evaluate criteria the user explicitly mentioned - don't penalize for unspecified requirements
-- Be realistic about "close enough" matches (e.g., 95m² ≈ 100m², Zürich City ≈ 8008 Zürich)
-- Distinguish between deal-breakers and nice-to-haves
-- Provide honest, actionable recommendations
+def _dhash(image) -> int:
+    """64-bit difference hash: robust to resizing/recompression, so size variants of a photo collide"""
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
 
-## Swiss Rental/Purchase Context:
-- Understand Swiss room counting (e.g., 3.5 rooms = 2 bedrooms + living room + half room)
-- Know typical Zürich pricing and neighborhoods (rental prices vs purchase prices)
-- Recognize common Swiss rental/purchase terms and amenities
-- Consider public transport accessibility and local area quality
-- Rental listings show monthly rent (CHF/month), purchase listings show total price (CHF)
 
-## Tone:
-- Professional yet warm
-- Clear and direct
-- Helpful and supportive
-- Honest about both positives and concerns
+def _image_data_url(image) -> str:
+    """Downscaled JPEG data URL for a vision request"""
+    image = image.convert("RGB")
+    image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
 
-Follow the exact output format provided in the user's request."""
 
-    # Determine if we have images to display
-    has_images = image_analysis and image_analysis not in ["No images found to analyze", "Image analysis skipped (no API key)"]
-    
-    image_analysis_section = ""
-    if has_images:
-        image_analysis_section = f"""## Image Analysis Results:
-{image_analysis}
-"""
-    
-    image_gallery_section = ""
-    if has_images:
-        image_gallery_section = """## 📸 Photo Analysis
+def prepare_listing_images(urls: List[str], max_images: int) -> List[dict]:
+    """
+    Pick the listing photos worth a vision call: fetches up to IMAGE_CANDIDATES_MAX candidates concurrently,
+    drops exact duplicates (same bytes) and near-duplicates (dHash within IMAGE_DHASH_MAX_DISTANCE, keeping the
+    larger one), then picks the largest photo first and each next one by distance to those already picked.
+    Returns [{"url": original URL, "upload_url": downscaled data URL}]. Without Pillow, only exact duplicates are
+    dropped and the original URLs are sent. Photos the server cannot fetch (hotlink protection, 403) fill the
+    remaining slots with their original URL, for the vision API to fetch itself.
+    """
+    candidates = urls[:IMAGE_CANDIDATES_MAX]
+    with ThreadPoolExecutor(max_workers=min(8, len(candidates) or 1)) as executor:
+        contents = list(executor.map(_fetch_image, candidates))
+    _pipeline_stats["images_fetched"] += sum(1 for content in contents if content)
+
+    seen_digests = set()
+    images = []
+    unfetched = [{"url": url, "upload_url": url} for url, content in zip(candidates, contents) if content is None]
+    for url, content in zip(candidates, contents):
+        if content is None:
+            continue
+        digest = hashlib.sha256(content).hexdigest()
+        if digest in seen_digests:
+            _pipeline_stats["images_duplicates_dropped"] += 1
+            continue
+        seen_digests.add(digest)
+        if Image is None:
+            images.append({"url": url, "upload_url": url})
+            continue
+        try:
+            image = Image.open(io.BytesIO(content))
+            image.load()
+        except Exception as e:
+            logging.info(f"Skipping unreadable image {url}: {str(e)}")
+            continue
+        images.append({"url": url, "image": image, "pixels": image.width * image.height, "hash": _dhash(image)})
 
-**INSTRUCTION:** Extract all image URLs from the Image Analysis section and create a beautiful photo gallery here. For each analyzed image:
-1. Display the image using: ![Room Name](image_url)
-2. Add a brief caption based on the analysis
+    if Image is None:
+        return (images + unfetched)[:max_images]
 
-Example format:
-### Living Room
-![Living Room](https://media2.homegate.ch/.../image1.jpg)
-*Modern, spacious living area with natural light and contemporary furnishing.*
+    # Near-duplicates: keep the highest-resolution variant of each photo
+    images.sort(key=lambda item: item["pixels"], reverse=True)
+    distinct = []
+    for item in images:
+        if any(bin(item["hash"] ^ kept["hash"]).count("1") <= IMAGE_DHASH_MAX_DISTANCE for kept in distinct):
+            _pipeline_stats["images_duplicates_dropped"] += 1
+            continue
+        distinct.append(item)
+
+    # Diversity: largest photo first, then the one least similar to everything already picked (ties: larger)
+    selected = distinct[:1]
+    remaining = distinct[1:]
+    while remaining and len(selected) < max_images:
+        best = max(remaining, key=lambda item: (
+            min(bin(item["hash"] ^ picked["hash"]).count("1") for picked in selected),
+            item["pixels"],
+        ))
+        remaining.remove(best)
+        selected.append(best)
+
+    prepared = []
+    for item in selected:
+        data_url = _image_data_url(item["image"])
+        _pipeline_stats["image_upload_bytes"] += len(data_url)
+        prepared.append({"url": item["url"], "upload_url": data_url})
+    return (prepared + unfetched)[:max_images]
+
+
+IMAGE_ANALYSIS_PROMPT = """Analyze this apartment/property image. Identify:
+1. Room type (living room, bedroom, kitchen, bathroom, exterior, view, etc.)
+2. Key features and condition (modern, renovated, spacious, natural light, etc.)
+3. Furnishing status (furnished, unfurnished, partially furnished)
+4. Notable amenities or highlights
+5. Overall impression (scale 1-10)
 
-### Kitchen
-![Kitchen](https://media2.homegate.ch/.../image2.jpg)
-*Fully equipped kitchen with modern appliances and ample counter space.*
+Be concise but specific. Focus on details that would matter to a renter."""
 
-Continue for all analyzed images..."""
-    
-    with_images = " with photo gallery" if has_images else ""
+# Multi-image vision: all selected photos in one request, bounded by count and payload size
+VISION_MULTI_IMAGE = os.getenv("VISION_MULTI_IMAGE", "true").lower() == "true"
+VISION_MULTI_IMAGE_MAX_IMAGES = int(os.getenv("VISION_MULTI_IMAGE_MAX_IMAGES", "6"))
+VISION_MULTI_IMAGE_MAX_BYTES = int(os.getenv("VISION_MULTI_IMAGE_MAX_BYTES", str(2 * 1024 * 1024)))
 
-    # Build the user prompt
-    property_type_note = ""
-    if criteria.get('property_type'):
-        property_type_note = f"\n**IMPORTANT:** User is looking to {criteria.get('property_type')} (not {'buy' if criteria.get('property_type') == 'rent' else 'rent'}). Only recommend listings that match this property type."
-    
-    prompt = f"""User's criteria:
-```json
-{json.dumps(criteria, indent=2)}
-```
-{property_type_note}
+MULTI_IMAGE_ANALYSIS_PROMPT = """Analyze each of the following apartment/property images (numbered in order, starting at 1). For each image identify:
+1. Room type (living room, bedroom, kitchen, bathroom, exterior, view, etc.)
+2. Key features and condition (modern, renovated, spacious, natural light, etc.)
+3. Furnishing status (furnished, unfurnished, partially furnished)
+4. Notable amenities or highlights
+5. Overall impression (scale 1-10)
 
-Listing data:
-<listing>
-{listing_data.get('content', '')}
-</listing>
+Be concise but specific. Focus on details that would matter to a renter. Return one entry per image, in order."""
+
+IMAGE_ANALYSES_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["images"],
+    "properties": {
+        "images": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["image_number", "room_type", "features", "furnishing", "highlights", "impression"],
+                "properties": {
+                    "image_number": {"type": "integer"},
+                    "room_type": {"type": "string"},
+                    "features": {"type": "string", "description": "Key features and condition"},
+                    "furnishing": {"type": "string"},
+                    "highlights": {"type": "string", "description": "Notable amenities or highlights"},
+                    "impression": {"type": "integer", "description": "Overall impression, 1-10"},
+                },
+            },
+        },
+    },
+}
 
-{image_analysis_section}
 
----
+def _image_analysis_entry(idx: int, url: str, analysis: str) -> str:
+    # IMPORTANT: Include the URL so the LLM can extract it and display the image
+    return f"### Image {idx + 1}\n**Image URL:** {url}\n\n{analysis}\n\n---\n\n"
 
-## Your Task:
 
-Analyze this apartment listing and create a beautiful, user-friendly match report{with_images}.
+def _analyze_image(image: dict, timeout: float = 30) -> str:
+    """Vision analysis of one prepared image (one request)"""
+    payload = {
+        "model": route_model("vision"),
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": IMAGE_ANALYSIS_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image["upload_url"], "detail": "low"}},
+                ]
+            }
+        ],
+        "max_tokens": 300
+    }
+    result = openai_chat("vision", payload, timeout=timeout)
+    return result['choices'][0]['message']['content']
 
-**CRITICAL IMAGE INSTRUCTION:** 
-The listing data contains a **LISTING_IMAGE_URL:** field. You MUST extract the COMPLETE URL (do not truncate it) and insert it at the very top of your response using this EXACT format:
-![Apartment](COMPLETE_URL_HERE)
 
-Make sure to copy the entire URL exactly as provided, including all characters after the last slash.
+def _analyze_images_together(images: List[dict], timeout: float = 60) -> List[str]:
+    """Vision analysis of several prepared images in one request; raises if the answer does not cover every image"""
+    content = [{"type": "text", "text": MULTI_IMAGE_ANALYSIS_PROMPT}]
+    for idx, image in enumerate(images):
+        content.append({"type": "text", "text": f"Image {idx + 1}:"})
+        content.append({"type": "image_url", "image_url": {"url": image["upload_url"], "detail": "low"}})
+    payload = {
+        "model": route_model("vision"),
+        "messages": [{"role": "user", "content": content}],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "image_analyses", "strict": True, "schema": IMAGE_ANALYSES_SCHEMA}
+        },
+        "max_tokens": 200 + 150 * len(images)
+    }
+    result = openai_chat("vision", payload, timeout=timeout)
+    entries = json.loads(result['choices'][0]['message']['content'])["images"]
+    by_number = {entry["image_number"]: entry for entry in entries}
+    if sorted(by_number) != list(range(1, len(images) + 1)):
+        raise ValueError(f"Expected analyses for {len(images)} images, got {sorted(by_number)}")
+    return [
+        f"**Room type:** {entry['room_type']}\n"
+        f"**Features and condition:** {entry['features']}\n"
+        f"**Furnishing:** {entry['furnishing']}\n"
+        f"**Highlights:** {entry['highlights']}\n"
+        f"**Overall impression:** {entry['impression']}/10"
+        for entry in (by_number[number] for number in range(1, len(images) + 1))
+    ]
 
-### Output Format (use emojis and clear formatting):
 
-```
-# 🏠 Apartment Match Analysis
+def _multi_image_groups(images: List[dict]) -> List[List[dict]]:
+    """Split images into request groups within VISION_MULTI_IMAGE_MAX_IMAGES / VISION_MULTI_IMAGE_MAX_BYTES"""
+    groups = []
+    group, group_bytes = [], 0
+    for image in images:
+        size = len(image["upload_url"])
+        if group and (len(group) >= VISION_MULTI_IMAGE_MAX_IMAGES or group_bytes + size > VISION_MULTI_IMAGE_MAX_BYTES):
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(image)
+        group_bytes += size
+    if group:
+        groups.append(group)
+    return groups
 
-![Apartment](INSERT_COMPLETE_LISTING_IMAGE_URL_HERE)
 
-## 📋 Listing Summary
-**Title:** [listing title]
-**Location:** [full address/area]
-**Type:** [Rent/Buy - indicate if listing is for rent or purchase]
-**Price:** CHF [amount]/month [for rent] or CHF [amount] [for purchase]
-**Rooms:** [number] rooms
-**Living Space:** [size] m²
-**Available:** [date or immediately]
+def analyze_images(listing_content: str, max_images: int = 5, deadline: Optional[float] = None, degraded: Optional[List[str]] = None) -> str:
+    """
+    Analyze listing images using OpenAI Vision API.
+    With a deadline, no vision request starts with less than VISION_MIN_SECONDS left; the photos not analyzed
+    are left out and "images_truncated" is added to degraded.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return "Image analysis skipped (no API key)"
+    
+    urls = extract_image_urls(listing_content)
+    if not urls:
+        return "No images found to analyze"
+    
+    images = prepare_listing_images(urls, max_images)
+    if not images:
+        return "No images found to analyze"
+    
+    print(f"[Image Analysis] Selected {len(images)} distinct images of {len(urls)} to analyze")
+    
+    analyses = [None] * len(images)
+    if VISION_MULTI_IMAGE and len(images) > 1:
+        offset = 0
+        for group in _multi_image_groups(images):
+            if len(group) > 1 and _time_left(deadline) >= VISION_MIN_SECONDS:
+                try:
+                    for idx, analysis in enumerate(_analyze_images_together(group, _budget(deadline, 60))):
+                        analyses[offset + idx] = analysis
+                    _pipeline_stats["vision_calls_saved"] += len(group) - 1
+                except CircuitOpenError:
+                    raise
+                except Exception as e:
+                    # Fall back to one request per image for this group
+                    logging.warning(f"Multi-image vision call failed, analyzing {len(group)} images separately: {str(e)}")
+                    _pipeline_stats["vision_multi_image_fallbacks"] += 1
+            offset += len(group)
+    
+    entries = []
+    for idx, image in enumerate(images):
+        if analyses[idx] is None:
+            if _time_left(deadline) < VISION_MIN_SECONDS:
+                if degraded is not None and "images_truncated" not in degraded:
+                    degraded.append("images_truncated")
+                continue
+            try:
+                analyses[idx] = _analyze_image(image, _budget(deadline, 30))
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                entries.append(f"### Image {idx + 1}\n**Image URL:** {image['url']}\n❌ Analysis failed: {str(e)}\n\n---\n\n")
+                continue
+        entries.append(_image_analysis_entry(idx, image["url"], analyses[idx]))
+    
+    summary = "\n".join(entries)
+    print(f"[Image Analysis] Completed. Sample output: {summary[:300]}...")
+    return summary
 
----
 
-## 🎯 Match Score: [X]% 
+LISTING_FACTS_PROMPT = """You extract structured, user-independent facts from Swiss real estate listings (rent or purchase).
+
+Return ONLY a valid JSON object with these fields (use null when a value is not stated in the listing):
+- title: listing title (string)
+- listing_type: "rent" or "buy" (string)
+- address: street address as written in the listing (string)
+- postal_code: 4-digit Swiss postal code (string)
+- city: city or municipality (string)
+- price_chf: monthly gross rent for rentals, total price for purchases, in CHF (number)
+- additional_costs_chf: monthly additional/utility costs in CHF if listed separately (number)
+- rooms: number of rooms using Swiss counting, e.g. 3.5 (number)
+- living_space_m2: living space in square meters (number)
+- floor: floor as written, e.g. "2nd floor", "ground floor" (string)
+- available_from: availability date or "immediately" (string)
+- features: amenities stated in the listing, e.g. "balcony", "elevator", "parking", "dishwasher", "pets allowed" (array of strings)
+- highlights: the 3-5 most attractive aspects of the listing (array of strings)
+- concerns: potential drawbacks stated or clearly implied by the listing (array of strings)
+- summary: 2-3 sentence neutral description of the property and area (string)
+
+Only report facts found in the listing. Do not judge the listing against any particular person's needs."""
+
+
+def _parse_listing_facts(result: dict) -> dict:
+    """Facts JSON from an extraction response; no price, rooms or living space at all is low confidence"""
+    facts = json.loads(result['choices'][0]['message']['content'])
+    if not isinstance(facts, dict):
+        raise ValueError("Listing facts are not a JSON object")
+    if all(facts.get(key) is None for key in ("price_chf", "rooms", "living_space_m2")):
+        raise LowConfidenceResult(facts, "no price, rooms or living space extracted")
+    return facts
+
+
+def extract_listing_facts(listing_data: dict, deadline: Optional[float] = None) -> dict:
+    """Extract user-independent structured facts from a scraped listing using OpenAI"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment")
 
-[One sentence overall assessment]
+    user_prompt = f"""Listing title: {listing_data.get('title', '')}
+Listing URL: {listing_data.get('url', '')}
 
----
+<listing>
+{listing_data.get('content', '')}
+</listing>"""
 
-## ✅ What Matches Your Criteria
+    payload = {
+        "model": route_model("facts", len(user_prompt)),
+        "messages": [
+            {"role": "system", "content": LISTING_FACTS_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "response_format": {"type": "json_object"},
+        "temperature": 0
+    }
 
-[For EACH criterion that matches, use this format:]
-**✓ [Criterion Name]**
-• Your requirement: [what user asked for]
-• Listing offers: [what listing has]
-• Assessment: [brief positive note]
+    try:
+        return openai_chat_parsed("facts", payload, _parse_listing_facts, _budget(deadline, 30), deadline)
+    except CircuitOpenError:
+        # Never store fallback facts just because OpenAI is down; the caller defers the analysis
+        raise
+    except Exception as e:
+        logger.warning(f"Listing facts extraction failed for {listing_data.get('url')}: {str(e)}")
+        # Fall back to what the scraper already gave us; the report step still works from the summary.
+        # facts_error keeps the fallback out of the listing_facts table and cache (see get_listing_facts)
+        return {
+            "title": listing_data.get('title') or None,
+            "summary": listing_data.get('description') or None,
+            "features": [],
+            "highlights": [],
+            "concerns": [],
+            "facts_error": str(e) or type(e).__name__,
+        }
 
----
 
-## ⚠️ Points to Consider
+def _listing_image_url(listing_data: dict) -> Optional[str]:
+    """Main listing photo: the page's og:image, else the first image in the scraped content."""
+    metadata = listing_data.get('metadata') or {}
+    og_image = metadata.get('ogImage') or metadata.get('og:image')
+    if isinstance(og_image, list):
+        og_image = og_image[0] if og_image else None
+    if og_image:
+        return og_image
+    match = re.search(r'https://[^\s<>")\]]+\.(?:jpg|jpeg|png|webp)', listing_data.get('content', ''), re.IGNORECASE)
+    return match.group(0) if match else None
 
-[For EACH criterion that doesn't match or is unclear:]
-**⚠ [Criterion Name]**
-• Your requirement: [what user asked for]
-• Listing offers: [what listing has]
-• Impact: [why this matters - deal-breaker or negotiable?]
 
-[If no concerns: *No significant concerns - all criteria met!*]
+def compute_listing_facts(listing_url: str, deadline: Optional[float] = None) -> dict:
+    """
+    Stage 1 of the analysis pipeline: scrape a listing and compute its user-independent facts
+    (structured fields, highlights/concerns). Runs once per listing, not once per user.
+    Image summaries are added separately (get_listing_facts) so hard-constraint mismatches never pay for vision.
+    """
+    listing_data = call_firecrawl_scraper(listing_url, timeout=_budget(deadline, 30))
+    if "error" in listing_data:
+        return {"error": listing_data.get("error"), "listing_url": listing_url}
 
----
+    facts = extract_listing_facts(listing_data, deadline)
+    facts["listing_image_url"] = facts.get("listing_image_url") or _listing_image_url(listing_data)
+    return _listing_facts_record(listing_url, listing_data, facts)
 
-## 💡 Key Highlights
 
-• [Standout feature 1]
-• [Standout feature 2]
-• [Standout feature 3]
-• [Other notable amenities]
+def _listing_facts_record(listing_url: str, listing_data: dict, facts: dict) -> dict:
+    """listing_facts row for a scraped listing and its extracted facts (no image summaries yet)"""
+    return {
+        "listing_url": listing_url,
+        "title": listing_data.get('title', ''),
+        "content": listing_data.get('content', ''),
+        "metadata": listing_data.get('metadata', {}),
+        "facts": facts,
+        "image_analysis": None,
+        "computed_at": datetime.utcnow().isoformat(),
+    }
 
----
 
-{image_gallery_section}
+# Facts records by listing URL. The listing_facts table is the shared store; this avoids re-reading it within a process.
+LISTING_FACTS_CACHE_SIZE = 256
+_listing_facts_cache: "OrderedDict[str, dict]" = OrderedDict()
+# Per-listing locks, dropped automatically once no coroutine holds or waits on them
+_listing_facts_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
 
----
 
-## 🤔 Our Recommendation
+def _cache_listing_facts(record: dict) -> None:
+    """Remember a facts record in the in-process LRU cache."""
+    _listing_facts_cache[record["listing_url"]] = record
+    _listing_facts_cache.move_to_end(record["listing_url"])
+    while len(_listing_facts_cache) > LISTING_FACTS_CACHE_SIZE:
+        _listing_facts_cache.popitem(last=False)
 
-**[HIGHLY RECOMMENDED / WORTH CONSIDERING / NOT A GOOD FIT]**
 
-[2-3 sentences explaining why, considering the user's priorities and the listing's strengths/weaknesses. Be honest and helpful.]
+def _load_listing_facts(listing_url: str) -> Optional[dict]:
+    """Read a stored facts record from the listing_facts table."""
+    if not storage:
+        return None
+    return storage.get_listing_facts(listing_url)
 
----
 
-## 📌 Next Steps
+def _listing_facts_columns(facts: dict) -> dict:
+    """
+    Typed, indexed listing_facts columns derived from the facts JSON (see supabase_schema_listing_search.sql).
+    Written together with the facts so searches never parse JSON.
+    """
+    features = facts.get('features') if isinstance(facts.get('features'), list) else []
+    listing_type = facts.get('listing_type')
+    return {
+        'listing_type': listing_type.lower() if isinstance(listing_type, str) else None,
+        'price_chf': _as_number(facts.get('price_chf')),
+        'additional_costs_chf': _as_number(facts.get('additional_costs_chf')),
+        'rooms': _as_number(facts.get('rooms')),
+        'living_space_m2': _as_number(facts.get('living_space_m2')),
+        'postal_code': str(facts['postal_code']).strip() if facts.get('postal_code') else None,
+        'city': facts.get('city') or None,
+        'features': sorted({str(feature).strip().lower() for feature in features if str(feature).strip()}),
+    }
 
-[If recommended: Suggest they contact the landlord, schedule viewing, etc.]
-[If not recommended: Suggest what to look for instead]
 
----
+def _save_listing_facts(record: dict) -> None:
+    """Upsert a facts record (with its typed search columns) into the listing_facts table."""
+    if not storage:
+        return
+    storage.save_listing_facts({**record, **_listing_facts_columns(record.get('facts') or {})})
+
 
-[ONLY IF HIGHLY RECOMMENDED OR WORTH CONSIDERING:]
+async def get_listing_facts(
+    listing_url: str,
+    max_images: int = 3,
+    include_images: bool = True,
+    deadline: Optional[float] = None,
+    degraded: Optional[List[str]] = None,
+) -> dict:
+    """
+    Return the facts record for a listing: in-process cache, then the listing_facts table, then compute.
+    With include_images, the image summaries are computed too if the record does not have them yet.
+    Concurrent requests for the same listing (e.g. several users' alert emails) share one computation.
+    With a deadline (time.monotonic()), photos are skipped or truncated when time runs short; the stage is
+    added to degraded and partial image summaries are returned but not stored.
+    Fallback facts from a failed extraction (facts_error) are returned for this request only, never stored or
+    cached, so the next access extracts them again.
+    """
+    record = _listing_facts_cache.get(listing_url)
+    if record and (not include_images or record.get('image_analysis') is not None):
+        return record
+
+    lock = _listing_facts_locks.get(listing_url)
+    if lock is None:
+        lock = asyncio.Lock()
+        _listing_facts_locks[listing_url] = lock
+    try:
+        # Another request is computing this listing: wait for it only as long as our own budget allows
+        await asyncio.wait_for(lock.acquire(), None if deadline is None else max(_time_left(deadline), 0))
+    except asyncio.TimeoutError:
+        if record:
+            # Cached facts without photo summaries: answer without them
+            if degraded is not None:
+                degraded.append("images_skipped")
+            return record
+        return {"error": "This listing is still being analysed for another request, please try again shortly", "listing_url": listing_url}
+    try:
+        changed = False
+        record = _listing_facts_cache.get(listing_url)
+        if not record:
+            try:
+                record = await asyncio.to_thread(_load_listing_facts, listing_url)
+            except Exception as e:
+                logger.warning(f"Could not read listing facts for {listing_url}: {str(e)}")
+                record = None
+            if record:
+                logger.info(f"Reusing stored listing facts for {listing_url}")
+            else:
+                logger.info(f"Computing listing facts for {listing_url}")
+                record = await asyncio.to_thread(compute_listing_facts, listing_url, deadline)
+                if "error" in record:
+                    return record
+                changed = True
+
+        partial = None
+        if include_images and record.get('image_analysis') is None:
+            if _time_left(deadline) < VISION_MIN_SECONDS:
+                if degraded is not None:
+                    degraded.append("images_skipped")
+            else:
+                stages = []
+                image_analysis = await asyncio.to_thread(analyze_images, record.get('content') or '', max_images, deadline, stages)
+                if stages:
+                    # Truncated by the deadline: use it for this response only
+                    partial = {**record, 'image_analysis': image_analysis}
+                    if degraded is not None:
+                        degraded.extend(stages)
+                else:
+                    record = {**record, 'image_analysis': image_analysis}
+                    changed = True
 
-## ✉️ Personalized Contact Message
+        if (record.get('facts') or {}).get('facts_error'):
+            _pipeline_stats["listing_facts_failed"] += 1
+            return partial or record
+        if changed:
+            try:
+                await asyncio.to_thread(_save_listing_facts, record)
+            except Exception as e:
+                logger.warning(f"Could not store listing facts for {listing_url}: {str(e)}")
+        _cache_listing_facts(record)
+    finally:
+        lock.release()
+    return partial or record
+
+
+# Pipeline counters, exposed on /health (process-local, reset on restart)
+_pipeline_stats: Counter = Counter()
+
+# Relative/absolute slack before a numeric criterion counts as a deal-breaker
+# (the report prompt treats 95m² as "close enough" to 100m², so the prefilter must not be stricter)
+PREFILTER_PRICE_TOLERANCE = 0.10
+PREFILTER_SPACE_TOLERANCE = 0.10
+PREFILTER_ROOMS_TOLERANCE = 0.5
+
+
+def _as_number(value) -> Optional[float]:
+    """Parse numbers as they appear in listings/criteria: 3.5, "3'450", "CHF 2,500.-", "95 m²"."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace("'", "").replace("’", "").replace(" ", "")
+    match = re.search(r"\d+(?:[.,]\d+)*", text)
+    if not match:
+        return None
+    number = match.group(0)
+    # "2,500" / "2,500.50" use comma as thousands separator; "3,5" is a decimal comma
+    if "," in number and "." in number:
+        number = number.replace(",", "")
+    elif "," in number:
+        whole, _, frac = number.rpartition(",")
+        number = number.replace(",", "") if len(frac) == 3 else f"{whole.replace(',', '')}.{frac}"
+    try:
+        return float(number)
+    except ValueError:
+        return None
 
-Ready to send! Copy this message for the "Contact Advertiser" form on the property website:
 
----
-**Subject:** Interest in [Room count]-Room Apartment at [Location]
+def evaluate_hard_constraints(criteria: dict, facts: dict) -> List[dict]:
+    """
+    Deterministic check of the structured criteria against structured listing facts.
+    Returns the deal-breakers found (empty list = plausible candidate). Unknown values never fail a check.
+    """
+    reasons = []
+
+    wanted_type = (criteria.get('property_type') or "").lower()
+    listing_type = (facts.get('listing_type') or "").lower()
+    if wanted_type in ("rent", "buy") and listing_type in ("rent", "buy") and wanted_type != listing_type:
+        reasons.append({
+            "criterion": "Property type",
+            "requirement": wanted_type,
+            "listing": listing_type,
+        })
 
-Dear Sir/Madam,
+    price = _as_number(facts.get('price_chf'))
+    max_rent = _as_number(criteria.get('max_rent'))
+    if price is not None and max_rent and price > max_rent * (1 + PREFILTER_PRICE_TOLERANCE):
+        reasons.append({
+            "criterion": "Max price" if wanted_type == "buy" else "Max rent",
+            "requirement": f"CHF {max_rent:,.0f}",
+            "listing": f"CHF {price:,.0f}",
+        })
 
-I am writing to express my strong interest in the [room count]-room apartment at [address/location] listed for CHF [price]/month.
+    rooms = _as_number(facts.get('rooms'))
+    min_rooms = _as_number(criteria.get('min_rooms'))
+    max_rooms = _as_number(criteria.get('max_rooms'))
+    if rooms is not None and min_rooms and rooms < min_rooms - PREFILTER_ROOMS_TOLERANCE:
+        reasons.append({"criterion": "Min rooms", "requirement": f"{min_rooms:g}+", "listing": f"{rooms:g}"})
+    if rooms is not None and max_rooms and rooms > max_rooms + PREFILTER_ROOMS_TOLERANCE:
+        reasons.append({"criterion": "Max rooms", "requirement": f"up to {max_rooms:g}", "listing": f"{rooms:g}"})
+
+    space = _as_number(facts.get('living_space_m2'))
+    min_space = _as_number(criteria.get('min_living_space'))
+    max_space = _as_number(criteria.get('max_living_space'))
+    if space is not None and min_space and space < min_space * (1 - PREFILTER_SPACE_TOLERANCE):
+        reasons.append({"criterion": "Min living space", "requirement": f"{min_space:g} m²+", "listing": f"{space:g} m²"})
+    if space is not None and max_space and space > max_space * (1 + PREFILTER_SPACE_TOLERANCE):
+        reasons.append({"criterion": "Max living space", "requirement": f"up to {max_space:g} m²", "listing": f"{space:g} m²"})
+
+    return reasons
+
+
+def _listing_summary_fields(listing_facts: dict) -> dict:
+    """Listing summary fields of MATCH_REPORT_SCHEMA, filled deterministically from the listing facts."""
+    facts = listing_facts.get('facts') or {}
+    price = _as_number(facts.get('price_chf'))
+    rooms = _as_number(facts.get('rooms'))
+    space = _as_number(facts.get('living_space_m2'))
+    listing_type = facts.get('listing_type') if facts.get('listing_type') in ("rent", "buy") else "unknown"
+    location = ", ".join(str(x) for x in (facts.get('address'), facts.get('postal_code'), facts.get('city')) if x)
+    return {
+        "title": facts.get('title') or listing_facts.get('title') or "Not specified",
+        "location": location or "Not specified",
+        "listing_type": listing_type,
+        "price": f"CHF {price:,.0f}{'/month' if listing_type == 'rent' else ''}" if price is not None else "Not specified",
+        "rooms": f"{rooms:g} rooms" if rooms is not None else "Not specified",
+        "living_space": f"{space:g} m²" if space is not None else "Not specified",
+        "available": facts.get('available_from') or "Not specified",
+        "listing_image_url": facts.get('listing_image_url'),
+    }
 
-[Include 2-3 sentences about why this apartment is perfect for them based on their criteria - be specific! Reference actual matches like "The 105m² living space and location in 8008 Zürich are exactly what I've been searching for."]
 
-About me:
-• [Infer likely tenant profile based on their search - e.g., "Professional working in Zürich" or "Small family" based on room requirements]
-• Reliable, non-smoking tenant with excellent references
-• Available to move in [reference availability date from listing or say "immediately"]
-• Long-term rental desired
+def prefilter_report(listing_facts: dict, reasons: List[dict]) -> dict:
+    """Structured "not a fit" report (MATCH_REPORT_SCHEMA) for listings rejected by the prefilter (no LLM call)."""
+    facts = listing_facts.get('facts') or {}
+    return {
+        **_listing_summary_fields(listing_facts),
+        "match_score": 0,
+        "assessment": "This listing fails one or more of your hard criteria, so no detailed analysis was generated.",
+        "criteria": [
+            {
+                "criterion": reason['criterion'],
+                "requirement": reason['requirement'],
+                "listing_offers": reason['listing'],
+                "passed": False,
+                "note": "Deal-breaker",
+            }
+            for reason in reasons
+        ],
+        "highlights": facts.get('highlights') or [],
+        "concerns": [],
+        "gallery": [],
+        "verdict": "NOT A GOOD FIT",
+        "recommendation": "This listing is outside your hard criteria. Adjust your criteria in your Profile if you would like listings like this one to be analysed.",
+        "next_steps": "",
+        "contact_message": None,
+    }
 
-I am very interested in scheduling a viewing at your earliest convenience. I am flexible with timing and can meet this week if possible.
 
-I have prepared all necessary documents (employment contract, salary statements, references) and am ready to proceed quickly given the competitive Zürich rental market.
+# Cross-portal duplicates: the same apartment on Homegate, ImmoScout24 and Flatfox. Listings at the same
+# normalized address and with the same room count match when their other numbers agree within these
+# tolerances (portals round differently).
+FINGERPRINT_PRICE_TOLERANCE = 0.05
+FINGERPRINT_SPACE_TOLERANCE = 0.05
+# Street-type spellings that differ between portals ("Seestr. 12" / "Seestrasse 12" / "See-Straße 12")
+ADDRESS_ABBREVIATIONS = (
+    (r"stra(?:ss|s)e\b|str\b\.?", "str"),
+    (r"\bavenue\b|\bav\b\.?", "av"),
+    (r"\bchemin\b|\bch\b\.?", "ch"),
+    (r"\broute\b|\brte\b\.?", "rte"),
+    (r"\bplatz\b|\bpl\b\.?", "pl"),
+)
 
-Looking forward to hearing from you.
 
-Best regards,
-[Your Name]
-[Your Phone]
-[Your Email]
----
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().replace("ß", "ss"))
+    return "".join(char for char in text if not unicodedata.combining(char))
 
-**Tip:** Personalize further by adding:
-- Your current situation (relocating, growing family, etc.)
-- Why you chose this specific listing
-- Your move-in timeline
-- Any relevant lifestyle details (quiet, respectful neighbor, etc.)
 
-Good apartments in Zürich get many applications - send this today! ⚡
-```
+def _address_key(facts: dict) -> Optional[str]:
+    """
+    Normalized "postal code:street+number" key, e.g. "8002:seestr12". None without a street address
+    with house number: a city or district alone is not specific enough to call two listings the same.
+    """
+    address = facts.get('address')
+    if not address:
+        return None
+    text = _strip_accents(str(address))
+    # Some portals put "8002 Zürich" into the address field
+    suffix = re.search(r",?\s*\b(\d{4})\s+(\D.*)$", text)
+    if suffix:
+        text = text[:suffix.start()]
+    for pattern, replacement in ADDRESS_ABBREVIATIONS:
+        text = re.sub(pattern, replacement, text)
+    street = "".join(re.findall(r"[a-z]+|\d+", text))
+    if not re.search(r"[a-z]", street) or not re.search(r"\d", street):
+        return None
+    postal_code = re.sub(r"\D", "", str(facts.get('postal_code') or ""))
+    if len(postal_code) != 4 and suffix:
+        postal_code = suffix.group(1)
+    if len(postal_code) == 4:
+        return f"{postal_code}:{street}"
+    city = _strip_accents(str(facts.get('city') or ""))
+    area = "".join(LOCATION_ALIASES.get(word, word) for word in re.findall(r"[a-z]+", city))
+    return f"{area}:{street}"
+
+
+def listing_fingerprint(facts: dict) -> Optional[dict]:
+    """Fingerprint (address key, type, rooms, living space, price) of a listing; None if it is too vague to dedupe on."""
+    address_key = _address_key(facts)
+    if not address_key:
+        return None
+    fingerprint = {
+        "address_key": address_key,
+        "listing_type": (facts.get('listing_type') or "").lower() or None,
+        "rooms": _as_number(facts.get('rooms')),
+        "living_space_m2": _as_number(facts.get('living_space_m2')),
+        "price_chf": _as_number(facts.get('price_chf')),
+        "additional_costs_chf": _as_number(facts.get('additional_costs_chf')),
+    }
+    if sum(fingerprint[key] is not None for key in ("rooms", "living_space_m2", "price_chf")) < 2:
+        return None
+    return fingerprint
+
+
+def _within(a: float, b: float, tolerance: float) -> bool:
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+def _fingerprints_match(a: dict, b: dict) -> bool:
+    """
+    Same address key (checked by the caller), same room count and every other number both listings state
+    agrees within tolerance. Net rent is only compared with net rent and gross (rent + additional costs)
+    with gross: flats in one building often differ by a few percent, so net-vs-gross guessing merges them.
+    """
+    if a.get("listing_type") and b.get("listing_type") and a["listing_type"] != b["listing_type"]:
+        return False
+    compared = 0
+    if a.get("rooms") is not None and b.get("rooms") is not None:
+        if a["rooms"] != b["rooms"]:
+            return False
+        compared += 1
+    if a.get("living_space_m2") and b.get("living_space_m2"):
+        if not _within(a["living_space_m2"], b["living_space_m2"], FINGERPRINT_SPACE_TOLERANCE):
+            return False
+        compared += 1
+    if a.get("price_chf") and b.get("price_chf"):
+        if not _within(a["price_chf"], b["price_chf"], FINGERPRINT_PRICE_TOLERANCE):
+            return False
+        if a.get("additional_costs_chf") is not None and b.get("additional_costs_chf") is not None:
+            gross_a = a["price_chf"] + a["additional_costs_chf"]
+            gross_b = b["price_chf"] + b["additional_costs_chf"]
+            if not _within(gross_a, gross_b, FINGERPRINT_PRICE_TOLERANCE):
+                return False
+        compared += 1
+    return compared >= 2
+
+
+def _portal_host(url: Optional[str]) -> str:
+    host = urlsplit(url or "").netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def find_duplicate_listing(listing_url: str, facts: dict) -> Optional[str]:
+    """
+    Register a listing in the listing_fingerprints index and return the URL of the first listing seen with the
+    same fingerprint (the canonical listing), or None if this is the first one or it cannot be fingerprinted.
+    """
+    fingerprint = listing_fingerprint(facts)
+    if not fingerprint or not supabase_admin:
+        return None
+    rows = supabase_admin.table("listing_fingerprints").select("*").eq("address_key", fingerprint["address_key"]).order("created_at").limit(50).execute().data or []
+    own = next((row for row in rows if row["listing_url"] == listing_url), None)
+    if own:
+        return own.get("canonical_url")
+    # Two listings on the same portal are two listings (a portal does not list one flat twice)
+    host = _portal_host(listing_url)
+    candidates = [
+        row for row in rows
+        if _portal_host(row["listing_url"]) != host and _portal_host(row.get("canonical_url") or row["listing_url"]) != host
+    ]
+    match = next((row for row in candidates if _fingerprints_match(fingerprint, row)), None)
+    canonical_url = (match.get("canonical_url") or match["listing_url"]) if match else None
+    supabase_admin.table("listing_fingerprints").upsert(
+        {"listing_url": listing_url, **fingerprint, "canonical_url": canonical_url},
+        on_conflict="listing_url",
+    ).execute()
+    if canonical_url:
+        logger.info(f"{listing_url} is the same listing as {canonical_url}")
+    return canonical_url
+
+
+def reuse_duplicate_analysis(user_id: str, listing_url: str, canonical_url: str) -> bool:
+    """Copy the user's completed analysis of the canonical listing to a duplicate listing URL (linked via duplicate_of)."""
+    original = storage.find_analysis(user_id, canonical_url, status="completed")
+    if not original or not isinstance(original.get('analysis_result'), dict):
+        return False
+    analysis_result = {
+        **original['analysis_result'],
+        'url': listing_url,
+        'duplicate_of': {'id': str(original['id']), 'listing_url': canonical_url},
+    }
+    _update_analysis_result(user_id, listing_url, analysis_result)
+    return True
+
+
+# Reverse criteria index: which monitoring users could a listing fit? Users are bucketed by property type,
+# location key and room count (half-room steps); each bucket is sorted by the user's rent ceiling, so a
+# lookup is a few dict reads, a bisect per bucket and a scan of the users the price fits. Same tolerances
+# as the hard-constraint prefilter.
+CRITERIA_INDEX_MAX_ROOM_STEP = 30  # Half-room steps indexed (15 rooms); larger values share the last step
+# City names as written in criteria vs. as the portals write them (after lower-casing and stripping accents)
+LOCATION_ALIASES = {
+    "zuerich": "zurich", "geneva": "geneve", "genf": "geneve", "berne": "bern", "lucerne": "luzern",
+    "basle": "basel", "bale": "basel", "lausanne": "lausanne", "lugano": "lugano", "winterthur": "winterthur",
+    "bienne": "biel", "friburg": "fribourg", "freiburg": "fribourg", "neuenburg": "neuchatel", "sitten": "sion",
+    # Zürich quarters: portals give the city ("Zürich") and the postal code, not the quarter
+    "oerlikon": "zurich", "altstetten": "zurich", "wiedikon": "zurich", "seebach": "zurich", "wipkingen": "zurich",
+    "hongg": "zurich", "schwamendingen": "zurich", "wollishofen": "zurich", "enge": "zurich", "hottingen": "zurich",
+    "fluntern": "zurich", "riesbach": "zurich", "hirslanden": "zurich", "witikon": "zurich", "aussersihl": "zurich",
+}
+# Places the index recognises in users' locations (after aliases; one distinctive word per place). A user whose
+# location names none of these and no postal code is indexed for every location instead of an unknown word.
+KNOWN_PLACES = {
+    "zurich", "geneve", "basel", "lausanne", "bern", "winterthur", "luzern", "gallen", "lugano", "biel", "thun",
+    "koniz", "chaux", "fribourg", "schaffhausen", "chur", "vernier", "uster", "sion", "lancy", "emmen", "neuchatel",
+    "zug", "yverdon", "dubendorf", "dietikon", "montreux", "rapperswil", "jona", "frauenfeld", "wetzikon", "baar",
+    "riehen", "kriens", "renens", "wadenswil", "aarau", "onex", "wettingen", "allschwil", "bulach", "carouge",
+    "horgen", "reinach", "kreuzlingen", "baden", "nyon", "vevey", "olten", "grenchen", "solothurn", "burgdorf",
+    "morges", "gossau", "adliswil", "thalwil", "wil", "kloten", "opfikon", "regensdorf", "schlieren", "volketswil",
+    "wallisellen", "horw", "cham", "hinwil", "meilen", "kusnacht", "zollikon", "stafa", "muri", "ostermundigen",
+    "ittigen", "spiez", "steffisburg", "langenthal", "bellinzona", "locarno", "mendrisio", "chiasso", "monthey",
+    "martigny", "sierre", "visp", "brig", "davos", "pully", "prilly", "ecublens", "meyrin", "versoix", "thonex",
+    "bulle", "delemont", "porrentruy", "steinhausen", "einsiedeln", "schwyz", "altdorf", "sarnen", "stans", "glarus",
+    "herisau", "appenzell", "rorschach", "arbon", "amriswil", "weinfelden", "romanshorn", "liestal", "pratteln",
+    "muttenz", "binningen", "oberwil", "birsfelden", "lenzburg", "brugg", "zofingen", "wohlen", "rheinfelden",
+    "oftringen", "spreitenbach", "uzwil", "flawil", "buchs", "kilchberg", "ruschlikon", "richterswil", "pfaffikon",
+    "affoltern", "illnau", "effretikon", "maur", "fallanden", "wangen", "nussbaumen", "ebikon", "littau",
+}
+# Postal code ranges in users' locations ("8000-8050") are expanded up to this many codes; wider ones mean "anywhere"
+LOCATION_MAX_POSTAL_RANGE = 200
+LOCATION_POSTAL_RANGE_RE = re.compile(r"\b(\d{4})\s*(?:-|–|to|bis|a)\s*(\d{4})\b")
+# Words in free-text locations that are not places
+LOCATION_STOPWORDS = {
+    "and", "or", "the", "in", "near", "area", "around", "city", "center", "centre", "canton", "kanton",
+    "kreis", "district", "region", "stadt", "lake", "see", "of", "de", "la", "le", "du", "des", "bei", "und",
+    "nord", "sud", "west", "east", "north", "south", "ost",
+}
+
+
+def _location_keys(*values, known_only: bool = False) -> set:
+    """
+    Postal codes ("plz:8002") and normalized place names ("city:zurich") in free-text locations. With known_only
+    (users' locations), postal code ranges are expanded and only KNOWN_PLACES count, so a location the index
+    cannot interpret ("near ETH") yields no keys and matches every listing instead of none.
+    """
+    keys = set()
+    for value in values:
+        if value is None or value == "":
+            continue
+        text = unicodedata.normalize("NFKD", str(value).lower().replace("ß", "ss"))
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        if known_only:
+            for start, end in LOCATION_POSTAL_RANGE_RE.findall(text):
+                if 0 <= int(end) - int(start) <= LOCATION_MAX_POSTAL_RANGE:
+                    keys.update(f"plz:{code}" for code in range(int(start), int(end) + 1))
+            text = LOCATION_POSTAL_RANGE_RE.sub(" ", text)
+        keys.update(f"plz:{code}" for code in re.findall(r"\b\d{4}\b", text))
+        for word in re.findall(r"[a-z]{3,}", text):
+            place = LOCATION_ALIASES.get(word, word)
+            if word not in LOCATION_STOPWORDS and (not known_only or place in KNOWN_PLACES):
+                keys.add(f"city:{place}")
+    return keys
+
+
+def _room_step(rooms: float) -> int:
+    return max(0, min(int(rooms * 2), CRITERIA_INDEX_MAX_ROOM_STEP))
+
+
+class CriteriaIndex:
+    """
+    In-memory reverse index over monitoring users' criteria: given a listing's facts, return the users whose
+    criteria it plausibly fits (no hard-constraint deal-breaker and a matching location). Missing values on
+    either side never exclude a user, as in evaluate_hard_constraints. Thread-safe; updated on criteria writes.
+    """
+
+    def __init__(self):
+        # property type -> location key -> room step ("*": any, "?": all) -> [rent ceilings (ascending), entries]
+        self._buckets: Dict[str, Dict[str, Dict[object, list]]] = {}
+        self._placements: Dict[str, list] = {}  # user_id -> [(type, location key, room step, entry)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._placements)
+
+    @staticmethod
+    def _entry(user_criteria: dict) -> tuple:
+        """(user_id, rooms low/high, space low/high, rent ceiling) with the prefilter tolerances applied"""
+        min_rooms = _as_number(user_criteria.get('min_rooms'))
+        max_rooms = _as_number(user_criteria.get('max_rooms'))
+        min_space = _as_number(user_criteria.get('min_living_space'))
+        max_space = _as_number(user_criteria.get('max_living_space'))
+        max_rent = _as_number(user_criteria.get('max_rent'))
+        return (
+            str(user_criteria['user_id']),
+            min_rooms - PREFILTER_ROOMS_TOLERANCE if min_rooms else float("-inf"),
+            max_rooms + PREFILTER_ROOMS_TOLERANCE if max_rooms else float("inf"),
+            min_space * (1 - PREFILTER_SPACE_TOLERANCE) if min_space else float("-inf"),
+            max_space * (1 + PREFILTER_SPACE_TOLERANCE) if max_space else float("inf"),
+            max_rent * (1 + PREFILTER_PRICE_TOLERANCE) if max_rent else float("inf"),
+        )
+
+    def upsert(self, user_criteria: dict) -> None:
+        """Add or replace a user's criteria; users without email monitoring are removed"""
+        user_id = str(user_criteria['user_id'])
+        with self._lock:
+            self._remove(user_id)
+            if user_criteria.get('email_monitoring_enabled'):
+                self._add(user_criteria, sort=True)
+
+    def rebuild(self, rows: List[dict]) -> None:
+        """Replace the whole index (bulk load: one sort per bucket instead of one sorted insert per placement)"""
+        with self._lock:
+            self._buckets = {}
+            self._placements = {}
+            latest = {str(user_criteria['user_id']): user_criteria for user_criteria in rows}
+            for user_criteria in latest.values():
+                if user_criteria.get('email_monitoring_enabled'):
+                    self._add(user_criteria, sort=False)
+            for by_location in self._buckets.values():
+                for by_rooms in by_location.values():
+                    for bucket in by_rooms.values():
+                        bucket[1].sort(key=lambda entry: entry[5])
+                        bucket[0][:] = [entry[5] for entry in bucket[1]]
+
+    def _add(self, user_criteria: dict, sort: bool) -> None:
+        """Place a user in its buckets (sort=False appends; rebuild sorts the buckets afterwards)"""
+        entry = self._entry(user_criteria)
+        property_type = (user_criteria.get('property_type') or "").lower()
+        property_type = property_type if property_type in ("rent", "buy") else "*"
+        location_keys = _location_keys(user_criteria.get('location'), known_only=True) or {"*"}
+        if entry[1] == float("-inf") and entry[2] == float("inf"):
+            room_steps = ["*"]
+        else:
+            low = 0 if entry[1] == float("-inf") else _room_step(max(entry[1], 0))
+            high = CRITERIA_INDEX_MAX_ROOM_STEP if entry[2] == float("inf") else _room_step(entry[2])
+            # "?" holds every user once, for listings that do not state their room count
+            room_steps = list(range(low, high + 1)) + ["?"]
+        placements = []
+        for location_key in location_keys:
+            for room_step in room_steps:
+                bucket = self._buckets.setdefault(property_type, {}).setdefault(location_key, {}).setdefault(room_step, [[], []])
+                position = bisect.bisect_right(bucket[0], entry[5]) if sort else len(bucket[0])
+                bucket[0].insert(position, entry[5])
+                bucket[1].insert(position, entry)
+                placements.append((property_type, location_key, room_step, entry))
+        self._placements[entry[0]] = placements
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._remove(str(user_id))
+
+    def _remove(self, user_id: str) -> None:
+        for property_type, location_key, room_step, entry in self._placements.pop(user_id, []):
+            bucket = self._buckets[property_type][location_key][room_step]
+            position = bisect.bisect_left(bucket[0], entry[5])
+            while bucket[1][position] is not entry:
+                position += 1
+            del bucket[0][position]
+            del bucket[1][position]
+
+    def match(self, facts: dict) -> List[str]:
+        """User ids whose criteria the listing facts plausibly fit"""
+        listing_type = (facts.get('listing_type') or "").lower()
+        # Unknown values are NaN: every comparison with NaN is False, so "not (value < low or value > high)"
+        # passes for them, like evaluate_hard_constraints
+        price = _as_number(facts.get('price_chf'))
+        price = float("nan") if price is None else price
+        rooms = _as_number(facts.get('rooms'))
+        space = _as_number(facts.get('living_space_m2'))
+        space = float("nan") if space is None else space
+        location_keys = _location_keys(facts.get('postal_code'), facts.get('city'))
+        matches = set()
+        with self._lock:
+            types = [listing_type, "*"] if listing_type in ("rent", "buy") else list(self._buckets)
+            for property_type in types:
+                by_location = self._buckets.get(property_type)
+                if not by_location:
+                    continue
+                locations = [by_location[key] for key in location_keys | {"*"} if key in by_location] if location_keys else list(by_location.values())
+                for by_rooms in locations:
+                    if rooms is None:
+                        buckets = [by_rooms[key] for key in ("?", "*") if key in by_rooms]
+                    else:
+                        buckets = [by_rooms[key] for key in (_room_step(rooms), "*") if key in by_rooms]
+                    room_value = float("nan") if rooms is None else rooms
+                    for ceilings, entries in buckets:
+                        # Users whose rent ceiling is >= price (all of them if the price is unknown)
+                        start = bisect.bisect_left(ceilings, price) if price == price else 0
+                        candidates = entries[start:] if start else entries
+                        matches.update([
+                            e[0] for e in candidates
+                            if not (room_value < e[1] or room_value > e[2] or space < e[3] or space > e[4])
+                        ])
+        return list(matches)
+
+
+criteria_index = CriteriaIndex()
+
+
+def load_criteria_index() -> int:
+    """Fill the criteria index with every monitoring user's criteria; returns the number of users"""
+    criteria_index.rebuild(storage.monitoring_criteria())
+    return len(criteria_index)
+
+
+# Fan-out: when a listing from one user's alert is analysed, also analyse it for every other monitoring user
+# whose criteria it fits (found through criteria_index), reusing the same scrape and listing facts
+LISTING_FANOUT = os.getenv("LISTING_FANOUT", "false").lower() == "true"
+LISTING_FANOUT_MAX_USERS = int(os.getenv("LISTING_FANOUT_MAX_USERS", "200"))
+LISTING_FANOUT_CONCURRENCY = int(os.getenv("LISTING_FANOUT_CONCURRENCY", "4"))  # Fan-out analyses in flight, all listings
+_fanout_semaphore = asyncio.Semaphore(LISTING_FANOUT_CONCURRENCY)
+_fanned_out_listings: "OrderedDict[str, None]" = OrderedDict()
+
+
+async def fan_out_listing(listing_url: str, listing_facts: dict) -> None:
+    """Create pending analyses of a listing for the matching users that do not have it yet, and start them"""
+    user_ids = criteria_index.match(listing_facts.get('facts') or {})
+    if not user_ids:
+        return
+    existing = set(await asyncio.to_thread(storage.users_with_listing, listing_url, user_ids))
+    new_user_ids = [user_id for user_id in user_ids if user_id not in existing][:LISTING_FANOUT_MAX_USERS]
+    if not new_user_ids:
+        return
+    criteria_rows = await asyncio.to_thread(storage.criteria_for_users, new_user_ids)
+    message_id = f"fanout:{hashlib.sha256(listing_url.encode('utf-8')).hexdigest()[:32]}"
+    portal = next((domain for domain in PROPERTY_DOMAINS if domain in listing_url.lower()), None)
+
+    async def analyze(user_id: str, user_criteria: dict) -> None:
+        async with _fanout_semaphore:
+            await analyze_listing_from_email(user_id, listing_url, user_criteria)
+
+    tasks = []
+    for user_criteria in criteria_rows:
+        user_id = user_criteria['user_id']
+        try:
+            await asyncio.to_thread(storage.insert_processed_email, {
+                'user_id': user_id,
+                'email_message_id': message_id,
+                'email_subject': "New listing matching your criteria",
+                'email_from': portal,
+                'listing_url': listing_url,
+                'analysis_result': None,
+                'analysis_status': 'pending'
+            })
+        except Exception as e:
+            # Unique (user_id, email_message_id): another worker fanned this listing out already
+            logging.debug(f"Fan-out of {listing_url} to user {user_id} skipped: {str(e)}")
+            continue
+        _notify_analysis_change(user_id)
+        _pipeline_stats["fanout_analyses"] += 1
+        tasks.append(analyze(user_id, user_criteria))
+    logging.info(f"Fanned out {listing_url} to {len(tasks)} matching users")
+    await asyncio.gather(*tasks)
+
+
+# JSON schema for structured match reports (OpenAI structured outputs, strict mode)
+MATCH_REPORT_VERDICTS = ["HIGHLY RECOMMENDED", "WORTH CONSIDERING", "NOT A GOOD FIT"]
+MATCH_REPORT_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": [
+        "title", "location", "listing_type", "price", "rooms", "living_space", "available",
+        "match_score", "assessment", "criteria", "highlights", "concerns", "gallery",
+        "verdict", "recommendation", "next_steps", "contact_message",
+    ],
+    "properties": {
+        "title": {"type": "string"},
+        "location": {"type": "string"},
+        "listing_type": {"type": "string", "enum": ["rent", "buy", "unknown"]},
+        "price": {"type": "string", "description": "e.g. 'CHF 2,450/month' or 'CHF 1,250,000'"},
+        "rooms": {"type": "string"},
+        "living_space": {"type": "string"},
+        "available": {"type": "string"},
+        "match_score": {"type": "integer", "description": "0-100"},
+        "assessment": {"type": "string", "description": "One sentence overall assessment"},
+        "criteria": {
+            "type": "array",
+            "description": "One entry per criterion the user specified",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["criterion", "requirement", "listing_offers", "passed", "note"],
+                "properties": {
+                    "criterion": {"type": "string"},
+                    "requirement": {"type": "string"},
+                    "listing_offers": {"type": "string"},
+                    "passed": {"type": "boolean"},
+                    "note": {"type": "string", "description": "Assessment if passed, impact (deal-breaker or negotiable) if not"},
+                },
+            },
+        },
+        "highlights": {"type": "array", "items": {"type": "string"}},
+        "concerns": {"type": "array", "items": {"type": "string"}, "description": "Concerns not covered by a failed criterion"},
+        "gallery": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["room", "image_url", "caption"],
+                "properties": {
+                    "room": {"type": "string"},
+                    "image_url": {"type": "string"},
+                    "caption": {"type": "string"},
+                },
+            },
+        },
+        "verdict": {"type": "string", "enum": MATCH_REPORT_VERDICTS},
+        "recommendation": {"type": "string", "description": "2-3 sentences explaining the verdict"},
+        "next_steps": {"type": "string"},
+        "contact_message": {
+            "anyOf": [
+                {"type": "null"},
+                {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["subject", "body"],
+                    "properties": {"subject": {"type": "string"}, "body": {"type": "string"}},
+                },
+            ],
+        },
+    },
+}
+
+COMPACT_VERDICT_TASK = """**COMPACT VERDICT ONLY:** Return just the fields of the compact schema. Keep every string short:
+the assessment one sentence, each criterion note a few words, at most 3 highlights and 3 concerns, the
+recommendation one or two sentences. The full narrative report is generated later if the user opens it.
+
+"""
+
+# Compact verdict: the scoring part of MATCH_REPORT_SCHEMA only (summary comes from the facts, no gallery/contact message)
+MATCH_VERDICT_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["match_score", "assessment", "criteria", "highlights", "concerns", "verdict", "recommendation"],
+    "properties": {key: MATCH_REPORT_SCHEMA["properties"][key] for key in (
+        "match_score", "assessment", "criteria", "highlights", "concerns", "verdict", "recommendation",
+    )},
+}
+
+
+# Bump when the static report prompt changes; stored with each analysis (analysis_result['prompt_version'])
+MATCH_REPORT_PROMPT_VERSION = "match-report-2"
+
+# Static prefix of every report request (identical bytes across users and listings, so the provider's
+# prompt cache can reuse it). Everything user- or listing-specific goes in the user message after it.
+MATCH_REPORT_SYSTEM_PROMPT = """You are a helpful apartment rental/purchase advisor for the Swiss market. Your job is to analyze apartment listings and help users determine if they're a good match for their needs.
+
+## Your Approach:
+- Be friendly, conversational, and encouraging
+- Extract all relevant details accurately from listings
+- Compare listings objectively against the user's specific criteria
+- **CRITICAL:** If user specified property_type (rent/buy), ONLY recommend listings that match. If listing is for rent but user wants to buy (or vice versa), mark as NOT A GOOD FIT immediately.
+- Only evaluate criteria the user explicitly mentioned - don't penalize for unspecified requirements
+- Be realistic about "close enough" matches (e.g., 95m² ≈ 100m², Zürich City ≈ 8008 Zürich)
+- Distinguish between deal-breakers and nice-to-haves
+- Provide honest, actionable recommendations
+
+## Swiss Rental/Purchase Context:
+- Understand Swiss room counting (e.g., 3.5 rooms = 2 bedrooms + living room + half room)
+- Know typical Zürich pricing and neighborhoods (rental prices vs purchase prices)
+- Recognize common Swiss rental/purchase terms and amenities
+- Consider public transport accessibility and local area quality
+- Rental listings show monthly rent (CHF/month), purchase listings show total price (CHF)
+
+## Tone:
+- Professional yet warm
+- Clear and direct
+- Helpful and supportive
+- Honest about both positives and concerns
+
+## Match Report Format:
+
+Return the match report as JSON with these fields:
+
+- **title, location, listing_type, price, rooms, living_space, available:** listing summary. Price as "CHF [amount]/month" for rent or "CHF [amount]" for purchase. Use "Not specified" for unknown values.
+- **match_score:** 0-100, how well the listing fits the user's criteria.
+- **assessment:** one sentence overall assessment.
+- **criteria:** one entry for EACH criterion the user specified: what they asked for, what the listing offers, whether it passes, and a brief note (positive assessment if it passes; impact - deal-breaker or negotiable - if it doesn't).
+- **highlights:** 3-5 standout features of the listing.
+- **concerns:** other points to consider that are not already a failed criterion (empty if none).
+- **gallery:** one entry per analyzed image from the Image Analysis section (empty if there is none): room name, the COMPLETE image URL exactly as given, and a one-sentence caption.
+- **verdict:** HIGHLY RECOMMENDED, WORTH CONSIDERING or NOT A GOOD FIT.
+- **recommendation:** 2-3 sentences explaining the verdict, considering the user's priorities and the listing's strengths/weaknesses.
+- **next_steps:** if recommended, suggest contacting the landlord, scheduling a viewing, etc.; if not, what to look for instead.
+- **contact_message:** ONLY for HIGHLY RECOMMENDED or WORTH CONSIDERING (null for NOT A GOOD FIT). A ready-to-send message for the "Contact Advertiser" form:
+  - subject: "Interest in [Room count]-Room Apartment at [Location]"
+  - body: "Dear Sir/Madam," then interest in the [room count]-room apartment at [address] for CHF [price]; 2-3 sentences on why it fits, referencing actual matches (e.g. "The 105m² living space and location in 8008 Zürich are exactly what I've been searching for."); an "About me:" list inferred from the search (e.g. professional working in Zürich, small family), reliable non-smoking tenant with excellent references, move-in availability; a request for a viewing; documents ready (employment contract, salary statements, references); "Best regards,\\n[Your Name]\\n[Your Phone]\\n[Your Email]".
 
 ### Important Instructions:
 1. **Be conversational and friendly** - write like you're helping a friend
-2. **Use emojis** to make it visually appealing and scannable
-3. **Be honest** - if something doesn't match, say so clearly
-4. **Prioritize** - focus on what matters most (deal-breakers vs nice-to-haves)
-5. **Only compare specified criteria** - don't penalize for unspecified requirements
-6. **Extract all listing details** - even if not in criteria (they're useful to see)
-7. **Be realistic** - 95m² is close enough to 100m², Zürich City ≈ 8008 Zürich
-8. **Consider Swiss context** - room counting, pricing norms, etc.
-9. **Make it actionable** - give clear next steps
-10. **Generate contact message ONLY for recommended listings** - skip this section if "NOT A GOOD FIT"
-11. **Personalize the contact message** based on the user's actual criteria matches (be specific about what matched!)
-12. **Make the contact message professional yet warm** - increase their chances in competitive market
-
-Return ONLY the formatted match analysis, ready to display to the user."""
+2. **Be honest** - if something doesn't match, say so clearly
+3. **Prioritize** - focus on what matters most (deal-breakers vs nice-to-haves)
+4. **Only compare specified criteria** - don't penalize for unspecified requirements
+5. **Be realistic** - 95m² is close enough to 100m², Zürich City ≈ 8008 Zürich
+6. **Consider Swiss context** - room counting, pricing norms, etc.
+7. **Personalize the contact message** based on the user's actual criteria matches (be specific about what matched!)"""
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+
+def match_report_payload(criteria: dict, listing_facts: dict, detail: str = "full") -> dict:
+    """
+    Chat-completions request body for generate_match_report (also submitted as a batch line, see submit_batch_request).
+    The static MATCH_REPORT_SYSTEM_PROMPT comes first; criteria, listing facts and images follow in the user message.
+    """
+    image_analysis = listing_facts.get('image_analysis') or ""
+    facts = listing_facts.get('facts') or {}
+    
+    # Debug: Check what we're receiving
+    print(f"[Debug generate_match_report] image_analysis length: {len(image_analysis) if image_analysis else 0}")
+    print(f"[Debug generate_match_report] Has valid image analysis: {bool(image_analysis and image_analysis not in ['No images found to analyze', 'Image analysis skipped (no API key)'])}")
     
+    # Determine if we have images to display
+    has_images = image_analysis and image_analysis not in ["No images found to analyze", "Image analysis skipped (no API key)"]
+    
+    image_analysis_section = ""
+    if has_images and detail == "full":
+        image_analysis_section = f"""## Image Analysis Results:
+{image_analysis}
+"""
+
+    # Build the user prompt
+    property_type_note = ""
+    if criteria.get('property_type'):
+        property_type_note = f"\n**IMPORTANT:** User is looking to {criteria.get('property_type')} (not {'buy' if criteria.get('property_type') == 'rent' else 'rent'}). Only recommend listings that match this property type."
+    
+    prompt = f"""User's criteria:
+```json
+{json.dumps(criteria, indent=2, default=str)}
+```
+{property_type_note}
+
+Listing facts (extracted from the listing page):
+<listing>
+**LISTING_URL:** {listing_facts.get('listing_url', '')}
+
+```json
+{json.dumps(facts, indent=2, ensure_ascii=False, default=str)}
+```
+</listing>
+
+{image_analysis_section}
+
+---
+
+{COMPACT_VERDICT_TASK if detail == "compact" else ""}## Your Task:
+
+Analyze this apartment listing against the user's criteria and return the match report as JSON (see Match Report Format)."""
+
     payload = {
-        "model": "gpt-4o-mini",
+        "model": route_model("report", len(prompt)),
         "messages": [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": MATCH_REPORT_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": (
+                {"name": "match_verdict", "strict": True, "schema": MATCH_VERDICT_SCHEMA}
+                if detail == "compact" else
+                {"name": "match_report", "strict": True, "schema": MATCH_REPORT_SCHEMA}
+            )
+        },
         "temperature": 0.1
     }
+    if detail == "compact":
+        payload["max_tokens"] = 600
     
     # Debug: Print the prompt being sent (first 1000 chars)
     print(f"[Debug] Prompt being sent to LLM (first 1000 chars):\n{prompt[:1000]}")
+    return payload
+
+
+def parse_match_report(result: dict, listing_facts: dict, detail: str = "full") -> dict:
+    """Structured report from a chat-completions response body for match_report_payload"""
+    report = json.loads(result['choices'][0]['message']['content'])
+    report['match_score'] = max(0, min(100, int(report.get('match_score') or 0)))
+    if detail == "compact":
+        report = {
+            **_listing_summary_fields(listing_facts),
+            "gallery": [],
+            "next_steps": "",
+            "contact_message": None,
+            **report,
+        }
+    if not report.get('listing_image_url'):
+        report['listing_image_url'] = (listing_facts.get('facts') or {}).get('listing_image_url')
+    return report
+
+
+def generate_match_report(criteria: dict, listing_facts: dict, detail: str = "full", timeout: float = 60) -> dict:
+    """
+    Stage 2 of the analysis pipeline: score a listing for one user.
+    Consumes the precomputed listing facts (see compute_listing_facts) plus the user's criteria and returns
+    a structured report (MATCH_REPORT_SCHEMA); use render_match_report for the markdown version.
+    detail="compact" only asks for the verdict (score, criteria, a few bullets): no images, gallery or
+    contact message, a fraction of the output tokens. Missing fields are filled from the facts.
+    Returns {"error": ...} if the report could not be generated.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found in environment")
+    
+    payload = match_report_payload(criteria, listing_facts, detail)
     
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=60
-        )
-        response.raise_for_status()
-        result = response.json()
-        
-        return result['choices'][0]['message']['content']
+        return parse_match_report(openai_chat("report", payload, timeout=timeout), listing_facts, detail)
     
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        return {"error": f"Error generating match report: {str(e)}"}
+
+
+def render_match_report(report: dict) -> str:
+    """Render a structured match report (MATCH_REPORT_SCHEMA) as the markdown shown to users."""
+    lines = ["# 🏠 Apartment Match Analysis", ""]
+    if report.get('listing_image_url'):
+        lines += [f"![Apartment]({report['listing_image_url']})", ""]
+
+    listing_type = report.get('listing_type')
+    lines += [
+        "## 📋 Listing Summary",
+        f"**Title:** {report.get('title') or 'Not specified'}",
+        f"**Location:** {report.get('location') or 'Not specified'}",
+        f"**Type:** {'Rent' if listing_type == 'rent' else 'Buy' if listing_type == 'buy' else 'Not specified'}",
+        f"**Price:** {report.get('price') or 'Not specified'}",
+        f"**Rooms:** {report.get('rooms') or 'Not specified'}",
+        f"**Living Space:** {report.get('living_space') or 'Not specified'}",
+        f"**Available:** {report.get('available') or 'Not specified'}",
+        "", "---", "",
+        f"## 🎯 Match Score: {report.get('match_score', 0)}%",
+        "",
+        report.get('assessment') or "",
+        "", "---", "",
+    ]
+
+    criteria = report.get('criteria') or []
+    matched = [c for c in criteria if c.get('passed')]
+    unmatched = [c for c in criteria if not c.get('passed')]
+
+    lines += ["## ✅ What Matches Your Criteria", ""]
+    for c in matched:
+        lines += [
+            f"**✓ {c.get('criterion')}**",
+            f"• Your requirement: {c.get('requirement')}",
+            f"• Listing offers: {c.get('listing_offers')}",
+            f"• Assessment: {c.get('note')}",
+            "",
+        ]
+    if not matched:
+        lines += ["*None of your criteria are met.*", ""]
+    lines += ["---", "", "## ⚠️ Points to Consider", ""]
+    for c in unmatched:
+        lines += [
+            f"**⚠ {c.get('criterion')}**",
+            f"• Your requirement: {c.get('requirement')}",
+            f"• Listing offers: {c.get('listing_offers')}",
+            f"• Impact: {c.get('note')}",
+            "",
+        ]
+    for concern in report.get('concerns') or []:
+        lines += [f"• {concern}"]
+    if not unmatched and not report.get('concerns'):
+        lines += ["*No significant concerns - all criteria met!*"]
+    lines += ["", "---", ""]
+
+    if report.get('highlights'):
+        lines += ["## 💡 Key Highlights", ""]
+        lines += [f"• {h}" for h in report['highlights']]
+        lines += ["", "---", ""]
+
+    if report.get('gallery'):
+        lines += ["## 📸 Photo Analysis", ""]
+        for image in report['gallery']:
+            lines += [
+                f"### {image.get('room')}",
+                f"![{image.get('room')}]({image.get('image_url')})",
+                f"*{image.get('caption')}*",
+                "",
+            ]
+        lines += ["---", ""]
+
+    lines += [
+        "## 🤔 Our Recommendation", "",
+        f"**{report.get('verdict') or 'NOT A GOOD FIT'}**", "",
+        report.get('recommendation') or "",
+        "", "---", "",
+    ]
+    if report.get('next_steps'):
+        lines += ["## 📌 Next Steps", "", report['next_steps'], "", "---", ""]
+
+    contact = report.get('contact_message')
+    if contact and report.get('verdict') != "NOT A GOOD FIT":
+        lines += [
+            "## ✉️ Personalized Contact Message", "",
+            'Ready to send! Copy this message for the "Contact Advertiser" form on the property website:', "",
+            "---", "",
+            f"**Subject:** {contact.get('subject')}", "",
+            contact.get('body') or "",
+            "", "---", "",
+            "**Tip:** Personalize further by adding:",
+            "- Your current situation (relocating, growing family, etc.)",
+            "- Why you chose this specific listing",
+            "- Your move-in timeline",
+            "- Any relevant lifestyle details (quiet, respectful neighbor, etc.)",
+            "",
+            "Good apartments in Zürich get many applications - send this today! ⚡",
+        ]
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def _criteria_hash(criteria: dict) -> str:
+    """Short stable hash of scoring criteria (stored with each analysis to detect criteria changes)"""
+    return hashlib.sha256(json.dumps(criteria, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def _analysis_result_from_report(report: dict, listing_url: str, detail: str = "full", criteria: Optional[dict] = None) -> dict:
+    """
+    processed_emails.analysis_result for a structured report: markdown for display plus the structured fields.
+    detail="compact" marks a verdict-only result whose full narrative is generated when the user opens it.
+    criteria (the scoring criteria used) is recorded as criteria_hash so criteria changes can be re-scored.
+    """
+    result = {
+        'report': render_match_report(report),
+        'structured': report,
+        'match_score': report.get('match_score'),
+        'verdict': report.get('verdict'),
+        'detail': detail,
+        'prompt_version': MATCH_REPORT_PROMPT_VERSION,
+        'url': listing_url,
+        'analyzed_at': datetime.utcnow().isoformat(),
+    }
+    if criteria is not None:
+        result['criteria_hash'] = _criteria_hash(criteria)
+    return result
+
+
+# Batch mode for background (email) analyses: compact verdicts are collected and submitted as one
+# OpenAI Batch API job instead of one synchronous chat-completions call each. Interactive chat never batches.
+ANALYSIS_BATCH_MODE = os.getenv("ANALYSIS_BATCH_MODE", "false").lower() == "true"
+ANALYSIS_BATCH_MAX_SIZE = int(os.getenv("ANALYSIS_BATCH_MAX_SIZE", "50"))
+ANALYSIS_BATCH_WINDOW_SECONDS = float(os.getenv("ANALYSIS_BATCH_WINDOW_SECONDS", "30"))  # collect requests before submitting
+ANALYSIS_BATCH_POLL_SECONDS = float(os.getenv("ANALYSIS_BATCH_POLL_SECONDS", "30"))
+ANALYSIS_BATCH_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_BATCH_TIMEOUT_SECONDS", "3600"))  # then fall back to synchronous calls
+
+_analysis_batch_queue: List[tuple] = []  # (custom_id, request body, future)
+_analysis_batch_timer: Optional[asyncio.Task] = None
+_analysis_batch_flush: Optional[asyncio.Task] = None  # Flush of a full batch that has not taken its requests yet
+
+
+def _openai_api(method: str, path: str, raw: bool = False, **kwargs):
+    """Call an OpenAI API endpoint (relative to OPENAI_BASE_URL); returns the JSON body, or the text if raw"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment")
+    response = upstream_request(
+        "openai",
+        method,
+        f"{OPENAI_BASE_URL}{path}",
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=60,
+        **kwargs
+    )
+    response.raise_for_status()
+    return response.text if raw else response.json()
+
+
+async def run_openai_batch(bodies: dict) -> dict:
+    """
+    Run chat-completions requests ({custom_id: body}) as one OpenAI Batch API job: uploads the JSONL input,
+    polls from the event loop until the batch finishes or ANALYSIS_BATCH_TIMEOUT_SECONDS pass (then cancels it)
+    and returns {custom_id: response body} for the requests that completed. Only the API calls use a thread.
+    """
+    lines = "\n".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False)
+        for custom_id, body in bodies.items()
+    )
+    upload = await asyncio.to_thread(
+        _openai_api, "POST", "/files", data={"purpose": "batch"}, files={"file": ("analyses.jsonl", lines.encode("utf-8"), "application/jsonl")}
+    )
+    batch = await asyncio.to_thread(_openai_api, "POST", "/batches", json={
+        "input_file_id": upload["id"],
+        "endpoint": "/v1/chat/completions",
+        "completion_window": "24h",
+    })
+    logging.info(f"Submitted analysis batch {batch['id']} with {len(bodies)} requests")
+
+    deadline = time.monotonic() + ANALYSIS_BATCH_TIMEOUT_SECONDS
+    while batch.get("status") not in ("completed", "failed", "expired", "cancelled"):
+        if time.monotonic() >= deadline:
+            logging.warning(f"Analysis batch {batch['id']} timed out in status '{batch.get('status')}', cancelling")
+            try:
+                batch = await asyncio.to_thread(_openai_api, "POST", f"/batches/{batch['id']}/cancel")
+            except Exception as e:
+                logging.warning(f"Could not cancel analysis batch {batch['id']}: {str(e)}")
+            break
+        await asyncio.sleep(ANALYSIS_BATCH_POLL_SECONDS)
+        batch = await asyncio.to_thread(_openai_api, "GET", f"/batches/{batch['id']}")
+
+    results = {}
+    # Expired/cancelled batches can still carry the requests that finished in time
+    if batch.get("output_file_id"):
+        output = await asyncio.to_thread(_openai_api, "GET", f"/files/{batch['output_file_id']}/content", raw=True)
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("custom_id") in bodies and response.get("status_code") == 200:
+                results[item["custom_id"]] = response.get("body")
+    logging.info(f"Analysis batch {batch['id']} finished with status '{batch.get('status')}': {len(results)}/{len(bodies)} results")
+    return results
+
+
+async def _flush_analysis_batch():
+    """Submit the queued requests as one batch and resolve their futures (None for requests without a result)"""
+    global _analysis_batch_flush
+    items = _analysis_batch_queue[:ANALYSIS_BATCH_MAX_SIZE]
+    del _analysis_batch_queue[:len(items)]
+    if _analysis_batch_flush is asyncio.current_task():
+        _analysis_batch_flush = None
+    # Requests queued beyond this batch: the next full batch, or the window timer
+    _schedule_analysis_batch_flush()
+    if not items:
+        return
+    _pipeline_stats["batch_jobs_submitted"] += 1
+    _pipeline_stats["batch_requests_submitted"] += len(items)
+    try:
+        results = await run_openai_batch({custom_id: body for custom_id, body, _ in items})
     except Exception as e:
-        return f"Error generating match report: {str(e)}"
+        logging.error(f"Analysis batch failed: {str(e)}", exc_info=True)
+        results = {}
+    for custom_id, _, future in items:
+        if not future.done():
+            future.set_result(results.get(custom_id))
+
+
+async def _flush_analysis_batch_after_window():
+    global _analysis_batch_timer
+    await asyncio.sleep(ANALYSIS_BATCH_WINDOW_SECONDS)
+    _analysis_batch_timer = None
+    await _flush_analysis_batch()
+
+
+def _schedule_analysis_batch_flush() -> None:
+    """Flush a full batch right away (one flush at a time until it has taken its requests), else start the window timer"""
+    global _analysis_batch_flush, _analysis_batch_timer
+    if len(_analysis_batch_queue) >= ANALYSIS_BATCH_MAX_SIZE:
+        if _analysis_batch_flush is None:
+            _analysis_batch_flush = asyncio.create_task(_flush_analysis_batch())
+    elif _analysis_batch_queue and _analysis_batch_timer is None:
+        _analysis_batch_timer = asyncio.create_task(_flush_analysis_batch_after_window())
+
+
+async def submit_batch_request(body: dict) -> Optional[dict]:
+    """
+    Queue a chat-completions request for the next analysis batch and wait for its response body.
+    Returns None if the batch failed or timed out; the caller then falls back to a synchronous call.
+    """
+    future = asyncio.get_running_loop().create_future()
+    _analysis_batch_queue.append((uuid.uuid4().hex, body, future))
+    _schedule_analysis_batch_flush()
+    return await future
+
+
+async def generate_compact_verdict(criteria: dict, listing_facts: dict) -> dict:
+    """Compact match report for a background analysis: batched when ANALYSIS_BATCH_MODE is on, else synchronous"""
+    if ANALYSIS_BATCH_MODE:
+        payload = match_report_payload(criteria, listing_facts, "compact")
+        result = await submit_batch_request(payload)
+        if result is not None:
+            record_model_call("report", payload["model"], _prompt_chars(payload), None, result)
+            try:
+                return parse_match_report(result, listing_facts, "compact")
+            except Exception as e:
+                logging.warning(f"Unusable batch result for {listing_facts.get('listing_url')}: {str(e)}")
+        _pipeline_stats["batch_sync_fallbacks"] += 1
+        logging.info(f"Falling back to a synchronous report call for {listing_facts.get('listing_url')}")
+    return await asyncio.to_thread(generate_match_report, criteria, listing_facts, "compact")
+
+
+# user_criteria columns that describe what the user is looking for (everything else is account/email config)
+SCORING_CRITERIA_FIELDS = (
+    "property_type", "location", "min_rooms", "max_rooms", "min_living_space", "max_living_space",
+    "min_rent", "max_rent", "occupants", "duration", "starting_when", "user_additional_requirements",
+)
+
+
+def _scoring_criteria(user_criteria: dict) -> dict:
+    """Only the criteria fields of a user_criteria row (never ids, mailbox settings or app passwords)."""
+    return {k: user_criteria.get(k) for k in SCORING_CRITERIA_FIELDS if user_criteria.get(k) not in (None, "", [], {})}
+
+
+# Parsed once when an analysis is stored (see _analysis_summary_columns)
+MATCH_SCORE_RE = re.compile(r"Match\s*Score\s*:\s*\[?\s*(\d{1,3})\s*\]?\s*%", re.IGNORECASE)
+
+# Columns projected by the analyses list endpoint (never the full analysis_result report)
+
+
+def _extract_match_score(report: str) -> Optional[int]:
+    """
+    Best-effort parser for the "Match Score: XX%" line in a markdown report.
+    Only needed for analyses stored before reports were structured (generate_match_report returns the score).
+    """
+    if not report:
+        return None
+    try:
+        # Common variants:
+        # - "## 🎯 Match Score: 87%"
+        # - "## 🎯 Match Score: [87]%"
+        # - "Match Score: 87%"
+        m = MATCH_SCORE_RE.search(report)
+        if not m:
+            return None
+        score = int(m.group(1))
+        if score < 0:
+            return 0
+        if score > 100:
+            return 100
+        return score
+    except Exception:
+        return None
+
+
+def _analysis_summary_columns(analysis_result: Optional[dict]) -> dict:
+    """
+    Derive the indexed summary columns stored next to processed_emails.analysis_result.
+    Computed once at write time so list queries never need to download or re-parse reports.
+    """
+    if not analysis_result:
+        return {'analysis_status': 'pending', 'match_score': None, 'analysis_error': None}
+    if analysis_result.get('error'):
+        return {'analysis_status': 'error', 'match_score': None, 'analysis_error': str(analysis_result.get('error'))[:500]}
+    report = analysis_result.get('report')
+    match_score = analysis_result.get('match_score')
+    if not isinstance(match_score, int):
+        match_score = _extract_match_score(report) if isinstance(report, str) else None
+    return {
+        'analysis_status': 'completed',
+        'match_score': match_score,
+        'analysis_error': None,
+    }
+
+
+def _update_analysis_result(user_id: str, listing_url: str, analysis_result: Optional[dict]):
+    """Store an analysis result together with its summary columns (status, match_score)."""
+    update_data = {'analysis_result': analysis_result}
+    update_data.update(_analysis_summary_columns(analysis_result))
+    updated = storage.update_analysis(user_id, listing_url, update_data)
+    _notify_analysis_change(user_id)
+    return updated
+
+
+# Change feed wake-ups: one asyncio.Event per user with an open /api/user/analyses/changes long-poll.
+# Events only reach long-polls served by this process; other workers fall back to CHANGE_FEED_DB_POLL_SECONDS.
+_analysis_change_events: dict[str, asyncio.Event] = {}
+_analysis_change_waiters: Counter = Counter()  # open long-polls per user; the event is dropped with the last one
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+CHANGE_FEED_DB_POLL_SECONDS = 5.0
+# Rows are handed out only once their updated_at is this old, so a write stamped earlier but committed later
+# than one already returned is not skipped by the cursor
+CHANGE_FEED_SETTLE_SECONDS = 2.0
+NIL_UUID = str(uuid.UUID(int=0))
+
+
+def _notify_analysis_change(user_id: str) -> None:
+    """Wake up any change feed long-polls waiting for this user's analyses (thread-safe)."""
+    event = _analysis_change_events.get(user_id)
+    if event is None:
+        return
+    try:
+        asyncio.get_running_loop()
+        event.set()
+    except RuntimeError:
+        # Called from a worker thread: hand off to the event loop
+        if _event_loop and not _event_loop.is_closed():
+            _event_loop.call_soon_threadsafe(event.set)
 
 
 # Authentication endpoints
@@ -856,14 +2634,12 @@ async def dev_token(user_id: str, request: Request):
 @app.get("/api/user/criteria", response_model=UserCriteriaResponse)
 async def get_user_criteria(user_id: str = Depends(verify_token)):
     """Get user's saved criteria"""
-    _require_supabase()
+    _require_storage()
     try:
         logger.info(f"Fetching criteria for user_id: {user_id}")
-        # Use service role client for backend operations (bypasses RLS since we verify JWT ourselves)
-        response = supabase_admin.table("user_criteria").select("*").eq("user_id", user_id).execute()
+        criteria_data = storage.get_criteria(user_id)
         
-        if response.data and len(response.data) > 0:
-            criteria_data = response.data[0]
+        if criteria_data:
             logger.info(f"Found criteria for user_id: {user_id}, data keys: {list(criteria_data.keys())}")
             logger.debug(f"Criteria data: {criteria_data}")
             # Remove app_password from response for security
@@ -891,100 +2667,324 @@ def get_imap_server(email_provider: str) -> str:
     return providers.get(email_provider.lower(), 'imap.gmail.com')
 
 
-def extract_urls_from_email_body(body: str) -> List[str]:
-    """Extract URLs from email body (HTML or plain text)"""
-    urls = []
-    property_domains = ("homegate.ch", "immoscout24.ch", "flatfox.ch")
-    homegate_listing_re = re.compile(r"^https?://(?:www\.)?homegate\.ch/(?:rent|buy)/\d+", re.IGNORECASE)
-    
-    # Try parsing as HTML first
+PROPERTY_DOMAINS = ("homegate.ch", "immoscout24.ch", "flatfox.ch")
+HOMEGATE_LISTING_RE = re.compile(r"^https?://(?:www\.)?homegate\.ch/(?:rent|buy)/\d+", re.IGNORECASE)
+# One scan over the email body: quoted href values (HTML links) or bare URLs (plain text and HTML text).
+# At an href the first alternative consumes the attribute, so a link is not matched twice.
+EMAIL_LINK_RE = re.compile(r"""href\s*=\s*(?:"([^"]*)"|'([^']*)')|(https?://[^\s<>"]+)""", re.IGNORECASE)
+SENDGRID_CLICK_RE = re.compile(r"sendgrid\.net/ls/click", re.IGNORECASE)
+
+
+def _is_listing_url(url: str) -> bool:
+    """Property-portal URL that is a listing page (Homegate alerts also link guides, alert settings, etc.)"""
+    lower = url.lower()
+    if "homegate.ch" in lower and not HOMEGATE_LISTING_RE.match(url):
+        return False
+    return url.startswith(("http://", "https://"))
+
+
+TRACKING_REDIRECT_MAX_HOPS = 5
+TRACKING_REDIRECT_TIMEOUT = 5
+TRACKING_RESOLVE_WORKERS = 10
+# Tracking URL -> listing URL (None: not a listing page); backed by the tracking_redirects table
+TRACKING_CACHE_SIZE = 4096
+_tracking_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+_tracking_cache_lock = threading.Lock()
+
+
+def _resolve_tracking_url(tracking_url: str) -> tuple[bool, Optional[str]]:
+    """
+    Follow a click-tracking link hop by hop (HEAD, no body download) and stop at the first property-portal
+    Location, so the portal page itself is never fetched. Returns (resolved, listing URL or None).
+    resolved is True only when the chain reached a portal URL or ended on a 2xx/3xx page outside the portals;
+    network errors, 429/5xx from the tracker and chains longer than TRACKING_REDIRECT_MAX_HOPS are retried next time.
+    """
+    url = tracking_url
+    ended_outside_portals = False
     try:
-        soup = BeautifulSoup(body, 'html.parser')
-        # Find all links
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if href and ('homegate.ch' in href.lower() or 'immoscout24.ch' in href.lower() or 'flatfox.ch' in href.lower()):
-                urls.append(href)
+        for _ in range(TRACKING_REDIRECT_MAX_HOPS):
+            if any(domain in url.lower() for domain in PROPERTY_DOMAINS):
+                break
+            response = requests.head(url, allow_redirects=False, timeout=TRACKING_REDIRECT_TIMEOUT)
+            if response.status_code in (405, 501):
+                # Some trackers do not implement HEAD; a GET without following redirects is enough
+                response = requests.get(url, allow_redirects=False, timeout=TRACKING_REDIRECT_TIMEOUT, stream=True)
+                response.close()
+            location = response.headers.get("Location")
+            if response.is_redirect and location:
+                url = urljoin(url, location)
+                continue
+            ended_outside_portals = 200 <= response.status_code < 400
+            break
     except Exception as e:
-        logging.debug(f"HTML parsing failed: {str(e)}")
-    
-    # Also search for URLs in plain text (more flexible pattern)
-    # Match URLs from property websites - handle URLs on separate lines
-    # Pattern matches URLs that may be on their own line or separated by whitespace
-    # Updated pattern to handle URLs that might be on separate lines with newlines
-    url_pattern = r'https?://[^\s<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s<>"]*'
-    found_urls = re.findall(url_pattern, body, re.IGNORECASE)
-    urls.extend(found_urls)
+        logging.debug(f"Failed to resolve tracking URL {tracking_url}: {e}")
+        return False, None
+
+    if not any(domain in url.lower() for domain in PROPERTY_DOMAINS):
+        return ended_outside_portals, None
+    url = url.strip().rstrip('/')
+    # Homegate tracking links can land on non-listing pages (municipality guide, cancel alert, etc.)
+    if not _is_listing_url(url):
+        logging.debug(f"Resolved tracking URL is not a listing page, skipping: {url}")
+        return True, None
+    return True, url
+
+
+def _remember_tracking(tracking_url: str, listing_url: Optional[str]) -> None:
+    with _tracking_cache_lock:
+        _tracking_cache[tracking_url] = listing_url
+        _tracking_cache.move_to_end(tracking_url)
+        while len(_tracking_cache) > TRACKING_CACHE_SIZE:
+            _tracking_cache.popitem(last=False)
+
+
+def resolve_tracking_urls(tracking_urls: List[str]) -> List[Optional[str]]:
+    """
+    Listing URL (or None) for each click-tracking URL. Looks in the in-process cache, then the
+    tracking_redirects table, and resolves the rest concurrently, storing the results in both.
+    """
+    results = {}
+    with _tracking_cache_lock:
+        for url in tracking_urls:
+            if url in _tracking_cache:
+                results[url] = _tracking_cache[url]
+    missing = [url for url in tracking_urls if url not in results]
+    _pipeline_stats["tracking_cache_hits"] += len(tracking_urls) - len(missing)
+
+    hashes = {hashlib.sha256(url.encode("utf-8")).hexdigest(): url for url in missing}
+    if hashes and supabase_admin:
+        try:
+            stored = supabase_admin.table("tracking_redirects").select("url_hash, listing_url").in_("url_hash", list(hashes)).execute()
+            for row in stored.data or []:
+                url = hashes.pop(row["url_hash"])
+                results[url] = row.get("listing_url")
+                _pipeline_stats["tracking_cache_hits"] += 1
+                _remember_tracking(url, results[url])
+        except Exception as e:
+            logging.warning(f"Could not read tracking redirect cache: {str(e)}")
+
+    if hashes:
+        logging.info(f"Resolving {len(hashes)} tracking URLs ({len(tracking_urls) - len(hashes)} cached)...")
+        to_resolve = list(hashes.items())
+        with ThreadPoolExecutor(max_workers=min(TRACKING_RESOLVE_WORKERS, len(to_resolve))) as executor:
+            outcomes = list(executor.map(lambda item: _resolve_tracking_url(item[1]), to_resolve))
+        _pipeline_stats["tracking_resolved"] += len(to_resolve)
+        rows = []
+        for (url_hash, url), (resolved, listing_url) in zip(to_resolve, outcomes):
+            results[url] = listing_url
+            if resolved:
+                _remember_tracking(url, listing_url)
+                rows.append({"url_hash": url_hash, "tracking_url": url, "listing_url": listing_url, "resolved_at": datetime.utcnow().isoformat()})
+        if rows and supabase_admin:
+            try:
+                supabase_admin.table("tracking_redirects").upsert(rows, on_conflict="url_hash").execute()
+            except Exception as e:
+                logging.warning(f"Could not store tracking redirects: {str(e)}")
+    return [results.get(url) for url in tracking_urls]
+
+
+def extract_urls_from_email_body(body: str) -> List[str]:
+    """Extract listing URLs from an email body (HTML or plain text), in order of appearance, without duplicates"""
+    urls = []
+    tracking_urls = []
+    seen = set()
+    for match in EMAIL_LINK_RE.finditer(body):
+        href = match.group(1) if match.group(1) is not None else match.group(2)
+        url = html.unescape(href).strip() if href is not None else match.group(3)
+        lower = url.lower()
+        if any(domain in lower for domain in PROPERTY_DOMAINS):
+            url = url.rstrip('/')  # Remove trailing slash
+            if url not in seen and _is_listing_url(url):
+                seen.add(url)
+                urls.append(url)
+        elif SENDGRID_CLICK_RE.search(url) and url.startswith(("http://", "https://")):
+            tracking_urls.append(url)
 
     # Some providers (notably Homegate) send tracked links (e.g. SendGrid) that redirect to the real listing.
     # If we don't find any direct property URLs, attempt to resolve a small number of tracking URLs.
-    if not urls:
-        tracking_pattern = r'https?://[^\s<>"]*(?:ct\.sendgrid\.net/ls/click|sendgrid\.net/ls/click)[^\s<>"]*'
-        tracking_urls = re.findall(tracking_pattern, body, re.IGNORECASE)
-        if tracking_urls:
-            unique_tracking = list(dict.fromkeys([u.strip() for u in tracking_urls if u and u.strip()]))[:10]
-            logging.info(f"Found {len(unique_tracking)} tracking URLs, attempting to resolve redirects...")
-            for turl in unique_tracking:
+    if not urls and tracking_urls:
+        unique_tracking = list(dict.fromkeys(tracking_urls))[:10]
+        logging.info(f"Found {len(unique_tracking)} tracking URLs, attempting to resolve redirects...")
+        for final_url in resolve_tracking_urls(unique_tracking):
+            if final_url and final_url not in seen:
+                seen.add(final_url)
+                urls.append(final_url)
+                logging.info(f"Resolved tracking URL to listing: {final_url}")
+    
+    logging.info(f"Extracted {len(urls)} unique URLs from email: {urls}")
+    if len(urls) == 0:
+        logging.warning(f"No URLs extracted. Email body length: {len(body)} chars")
+        logging.debug(f"Email body preview (first 1000 chars): {body[:1000]}")
+    return urls
+
+
+def _email_filters(email_sender: Optional[str], email_subject_keywords: Optional[str]) -> tuple[List[str], List[str]]:
+    """Sender filters (any may match) and subject keywords (one must appear) from the user's email settings"""
+    # Default values if not configured
+    sender_filter = email_sender.lower().strip() if email_sender else None
+    subject_keywords = [kw.strip().lower() for kw in email_subject_keywords.split(',')] if email_subject_keywords else ['match']
+    sender_filters_list = []
+    if sender_filter:
+        # Split by comma if multiple senders provided
+        sender_filters_list = [s.strip() for s in sender_filter.split(',') if s.strip()]
+    return sender_filters_list, subject_keywords
+
+
+def _email_body(email_message) -> str:
+    """Email body - prioritize plain text, fallback to HTML"""
+    body = ""
+    plain_text_body = ""
+    html_body = ""
+    
+    if email_message.is_multipart():
+        for part in email_message.walk():
+            content_type = part.get_content_type()
+            if content_type == "text/plain":
+                try:
+                    payload = part.get_payload(decode=True)
+                    if payload:
+                        plain_text_body += payload.decode('utf-8', errors='ignore')
+                except Exception as e:
+                    logging.debug(f"Error decoding plain text part: {e}")
+            elif content_type == "text/html":
                 try:
-                    # Use GET with redirects to land on the final destination URL.
-                    resp = requests.get(turl, allow_redirects=True, timeout=10, stream=True)
-                    final_url = resp.url
-                    try:
-                        resp.close()
-                    except Exception:
-                        pass
-
-                    if final_url and any(d in final_url.lower() for d in property_domains):
-                        # Homegate tracking links can land on non-listing pages (municipality guide, cancel alert, etc.)
-                        # Only accept URLs that look like actual listing pages.
-                        if "homegate.ch" in final_url.lower() and not homegate_listing_re.match(final_url):
-                            logging.debug(f"Resolved tracking URL is not a listing page, skipping: {final_url}")
-                        else:
-                            urls.append(final_url)
-                            logging.info(f"Resolved tracking URL to listing: {final_url}")
+                    payload = part.get_payload(decode=True)
+                    if payload:
+                        html_body += payload.decode('utf-8', errors='ignore')
                 except Exception as e:
-                    logging.debug(f"Failed to resolve tracking URL {turl}: {e}")
+                    logging.debug(f"Error decoding HTML part: {e}")
+    else:
+        try:
+            body = email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
+        except:
+            body = str(email_message.get_payload())
     
-    # Handle URLs on separate lines (common in plain text emails)
-    # Split by lines and check each line for URLs
-    lines = body.split('\n')
-    for line in lines:
-        line = line.strip()
-        # Check if line contains a URL (not just starts with http, might have whitespace)
-        if 'http' in line.lower():
-            # Check if it's a property URL
-            if any(domain in line.lower() for domain in property_domains):
-                # Extract the full URL (might have leading/trailing whitespace or characters)
-                url_match = re.search(r'(https?://[^\s<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s<>"]*)', line, re.IGNORECASE)
-                if url_match:
-                    extracted_url = url_match.group(1).strip()
-                    urls.append(extracted_url)
-                    logging.debug(f"Found URL on line: {extracted_url}")
+    # Use plain text if available, otherwise HTML
+    if plain_text_body:
+        body = plain_text_body
+        logging.debug(f"Using plain text body (length: {len(body)} chars)")
+    elif html_body:
+        body = html_body
+        logging.debug(f"Using HTML body (length: {len(body)} chars)")
+    elif body:
+        logging.debug(f"Using single-part body (length: {len(body)} chars)")
+    return body
+
+
+def listing_from_email_message(
+    email_message,
+    user_id: str,
+    sender_filters_list: List[str],
+    subject_keywords: List[str],
+    last_email_check_dt: Optional[datetime] = None,
+    fallback_message_id: str = "",
+) -> Optional[dict]:
+    """
+    Apply a user's sender/subject filters to one alert email and extract its listing URLs.
+    Shared by IMAP polling and the inbound-email webhook; returns None if the email is skipped.
+    """
+    # Get subject
+    subject_header = email_message['Subject']
+    if subject_header:
+        subject_decoded = decode_header(subject_header)
+        subject = subject_decoded[0][0] if subject_decoded else ''
+        if isinstance(subject, bytes):
+            subject = subject.decode('utf-8', errors='ignore')
+        else:
+            subject = str(subject) if subject else ''
+    else:
+        subject = ''
+
+    # If we have last check time, skip emails that are not newer (precise filtering).
+    if last_email_check_dt:
+        try:
+            email_date_header = email_message.get('Date')
+            email_dt = parsedate_to_datetime(email_date_header) if email_date_header else None
+            if email_dt:
+                # Normalize to naive UTC for comparison (parsedate may include tzinfo).
+                if email_dt.tzinfo is not None:
+                    email_dt = email_dt.astimezone(timezone.utc).replace(tzinfo=None)
+                if email_dt <= last_email_check_dt:
+                    logging.debug(
+                        f"Skipping email - not newer than last check. "
+                        f"Email date: {email_dt.isoformat()}, last check: {last_email_check_dt.isoformat()}"
+                    )
+                    return None
+        except Exception:
+            # If date parsing fails, fall back to other filters (sender/subject/dedupe).
+            pass
     
-    # Also try a multiline pattern for URLs that might span or be separated
-    simple_pattern = r'https?://[^\s\n<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s\n<>"]*'
-    simple_urls = re.findall(simple_pattern, body, re.IGNORECASE | re.MULTILINE)
-    urls.extend(simple_urls)
+    # Get sender email address for filtering
+    sender_address = email_message['From'] or ''
+    sender_lower = sender_address.lower()
     
-    # Remove duplicates and clean URLs
-    unique_urls = []
-    seen = set()
-    for url in urls:
-        url = url.strip().rstrip('/')  # Remove trailing slash
-        # Filter out non-listing Homegate URLs (alerts, guides, etc.)
-        if "homegate.ch" in url.lower() and not homegate_listing_re.match(url):
-            continue
-        if url and url not in seen:
-            # Validate it's a proper URL
-            if url.startswith('http://') or url.startswith('https://'):
-                unique_urls.append(url)
-                seen.add(url)
+    # Filter by sender if configured (check if any sender filter matches)
+    if sender_filters_list:
+        sender_matches = False
+        for filter_sender in sender_filters_list:
+            # Check if filter matches sender email or domain
+            # e.g., "homegate" matches "noreply@homegate.ch" or "homegate.ch"
+            # e.g., "gilda.fernandezconcha@gmail.com" matches exact email
+            if filter_sender in sender_lower:
+                sender_matches = True
+                logging.debug(f"Sender filter '{filter_sender}' matches '{sender_address}'")
+                break
+        
+        if not sender_matches:
+            logging.debug(f"Skipping email - sender '{sender_address}' doesn't match any filter: {sender_filters_list}")
+            return None
     
-    logging.info(f"Extracted {len(unique_urls)} unique URLs from email: {unique_urls}")
-    if len(unique_urls) == 0:
-        logging.warning(f"No URLs extracted. Email body length: {len(body)} chars")
-        logging.debug(f"Email body preview (first 1000 chars): {body[:1000]}")
-    return unique_urls
+    # Filter: only process emails with configured keywords in subject (case-insensitive)
+    subject_lower = subject.lower()
+    if not any(keyword in subject_lower for keyword in subject_keywords):
+        logging.debug(f"Skipping email - subject '{subject}' doesn't contain any of the keywords: {subject_keywords}")
+        return None
+    
+    logging.info(f"Processing email: Subject='{subject}', From='{sender_address}'")
+    
+    # Get message ID
+    message_id = email_message['Message-ID'] or fallback_message_id
+    
+    # Check if already processed (by message_id)
+    if storage.email_processed(user_id, message_id):
+        logging.info(f"Email '{subject}' (message_id: {message_id}) already processed, skipping")
+        return None
+    
+    body = _email_body(email_message)
+    
+    # Extract URLs
+    logging.info(f"Extracting URLs from email body (length: {len(body)} chars)")
+    # Log email body for debugging (first 2000 chars)
+    logging.info(f"Email body preview (first 2000 chars):\n{body[:2000]}")
+    urls = extract_urls_from_email_body(body)
+    logging.info(f"✓ Found {len(urls)} URLs in email '{subject}': {urls}")
+    
+    # If fewer URLs than expected, log warning
+    if len(urls) == 0:
+        logging.error(f"✗ No URLs extracted from email '{subject}'. Full body:\n{body}")
+    elif len(urls) < 3:
+        logging.warning(f"⚠ Only {len(urls)} URL(s) extracted, might be missing some. Full body:\n{body}")
+    
+    # Log email body snippet for debugging if URLs seem incomplete
+    if len(urls) > 0 and len(urls) < 3:
+        logging.warning(f"⚠ Only {len(urls)} URL(s) found, expected more. Email body preview (first 2000 chars):\n{body[:2000]}")
+    elif not urls:
+        logging.warning(f"⚠ No URLs found in email '{subject}'. Email body preview (first 2000 chars):\n{body[:2000]}")
+    
+    # Log email body snippet for debugging (first 500 chars)
+    if not urls:
+        logging.warning(f"No URLs found. Email body preview (first 500 chars): {body[:500]}")
+    
+    if not urls:
+        logging.warning(f"No property URLs found in email. Email body length: {len(body)}")
+        return None
+    return {
+        'message_id': message_id,
+        'subject': subject,
+        'from': email_message['From'],
+        'urls': urls,
+        'received_date': email_message['Date']
+    }
 
 
 def check_email_for_listings(
@@ -1004,9 +3004,7 @@ def check_email_for_listings(
         mail.login(email_address, app_password)
         mail.select('INBOX')
         
-        # Default values if not configured
-        sender_filter = email_sender.lower().strip() if email_sender else None
-        subject_keywords = [kw.strip().lower() for kw in email_subject_keywords.split(',')] if email_subject_keywords else ['match']
+        sender_filters_list, subject_keywords = _email_filters(email_sender, email_subject_keywords)
 
         # If we have a last check timestamp, don't rely on UNSEEN (emails may be auto-marked read).
         # Use IMAP SINCE (date-level granularity) and then filter precisely in code.
@@ -1028,10 +3026,7 @@ def check_email_for_listings(
             logging.info(f"Searching emails SINCE {since_str} (last check: {last_email_check_dt.isoformat()})")
         else:
             search_criteria = ['UNSEEN']
-        sender_filters_list = []
-        if sender_filter:
-            # Split by comma if multiple senders provided
-            sender_filters_list = [s.strip() for s in sender_filter.split(',') if s.strip()]
+        if sender_filters_list:
             logging.info(f"Sender filters configured: {sender_filters_list}")
             # Note: IMAP FROM search only supports one sender at a time
             # We'll search all UNSEEN emails and filter by sender in code
@@ -1060,145 +3055,16 @@ def check_email_for_listings(
                 email_body = msg_data[0][1]
                 email_message = email.message_from_bytes(email_body)
                 
-                # Get subject
-                subject_header = email_message['Subject']
-                if subject_header:
-                    subject_decoded = decode_header(subject_header)
-                    subject = subject_decoded[0][0] if subject_decoded else ''
-                    if isinstance(subject, bytes):
-                        subject = subject.decode('utf-8', errors='ignore')
-                    else:
-                        subject = str(subject) if subject else ''
-                else:
-                    subject = ''
-
-                # If we have last check time, skip emails that are not newer (precise filtering).
-                if last_email_check_dt:
-                    try:
-                        email_date_header = email_message.get('Date')
-                        email_dt = parsedate_to_datetime(email_date_header) if email_date_header else None
-                        if email_dt:
-                            # Normalize to naive UTC for comparison (parsedate may include tzinfo).
-                            if email_dt.tzinfo is not None:
-                                email_dt = email_dt.astimezone(timezone.utc).replace(tzinfo=None)
-                            if email_dt <= last_email_check_dt:
-                                logging.debug(
-                                    f"Skipping email - not newer than last check. "
-                                    f"Email date: {email_dt.isoformat()}, last check: {last_email_check_dt.isoformat()}"
-                                )
-                                continue
-                    except Exception:
-                        # If date parsing fails, fall back to other filters (sender/subject/dedupe).
-                        pass
-                
-                # Get sender email address for filtering
-                sender_address = email_message['From'] or ''
-                sender_lower = sender_address.lower()
-                
-                # Filter by sender if configured (check if any sender filter matches)
-                if sender_filters_list:
-                    sender_matches = False
-                    for filter_sender in sender_filters_list:
-                        # Check if filter matches sender email or domain
-                        # e.g., "homegate" matches "noreply@homegate.ch" or "homegate.ch"
-                        # e.g., "gilda.fernandezconcha@gmail.com" matches exact email
-                        if filter_sender in sender_lower:
-                            sender_matches = True
-                            logging.debug(f"Sender filter '{filter_sender}' matches '{sender_address}'")
-                            break
-                    
-                    if not sender_matches:
-                        logging.debug(f"Skipping email - sender '{sender_address}' doesn't match any filter: {sender_filters_list}")
-                        continue
-                
-                # Filter: only process emails with configured keywords in subject (case-insensitive)
-                subject_lower = subject.lower()
-                if not any(keyword in subject_lower for keyword in subject_keywords):
-                    logging.debug(f"Skipping email - subject '{subject}' doesn't contain any of the keywords: {subject_keywords}")
-                    continue
-                
-                logging.info(f"Processing email: Subject='{subject}', From='{sender_address}'")
-                
-                # Get message ID
-                message_id = email_message['Message-ID'] or f"{email_id.decode()}"
-                
-                # Check if already processed (by message_id)
-                processed = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).eq("email_message_id", message_id).execute()
-                if processed.data and len(processed.data) > 0:
-                    logging.info(f"Email '{subject}' (message_id: {message_id}) already processed, skipping")
-                    continue
-                
-                # Extract body - prioritize plain text, fallback to HTML
-                body = ""
-                plain_text_body = ""
-                html_body = ""
-                
-                if email_message.is_multipart():
-                    for part in email_message.walk():
-                        content_type = part.get_content_type()
-                        if content_type == "text/plain":
-                            try:
-                                payload = part.get_payload(decode=True)
-                                if payload:
-                                    plain_text_body += payload.decode('utf-8', errors='ignore')
-                            except Exception as e:
-                                logging.debug(f"Error decoding plain text part: {e}")
-                        elif content_type == "text/html":
-                            try:
-                                payload = part.get_payload(decode=True)
-                                if payload:
-                                    html_body += payload.decode('utf-8', errors='ignore')
-                            except Exception as e:
-                                logging.debug(f"Error decoding HTML part: {e}")
-                else:
-                    try:
-                        body = email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    except:
-                        body = str(email_message.get_payload())
-                
-                # Use plain text if available, otherwise HTML
-                if plain_text_body:
-                    body = plain_text_body
-                    logging.debug(f"Using plain text body (length: {len(body)} chars)")
-                elif html_body:
-                    body = html_body
-                    logging.debug(f"Using HTML body (length: {len(body)} chars)")
-                elif body:
-                    logging.debug(f"Using single-part body (length: {len(body)} chars)")
-                
-                # Extract URLs
-                logging.info(f"Extracting URLs from email body (length: {len(body)} chars)")
-                # Log email body for debugging (first 2000 chars)
-                logging.info(f"Email body preview (first 2000 chars):\n{body[:2000]}")
-                urls = extract_urls_from_email_body(body)
-                logging.info(f"✓ Found {len(urls)} URLs in email '{subject}': {urls}")
-                
-                # If fewer URLs than expected, log warning
-                if len(urls) == 0:
-                    logging.error(f"✗ No URLs extracted from email '{subject}'. Full body:\n{body}")
-                elif len(urls) < 3:
-                    logging.warning(f"⚠ Only {len(urls)} URL(s) extracted, might be missing some. Full body:\n{body}")
-                
-                # Log email body snippet for debugging if URLs seem incomplete
-                if len(urls) > 0 and len(urls) < 3:
-                    logging.warning(f"⚠ Only {len(urls)} URL(s) found, expected more. Email body preview (first 2000 chars):\n{body[:2000]}")
-                elif not urls:
-                    logging.warning(f"⚠ No URLs found in email '{subject}'. Email body preview (first 2000 chars):\n{body[:2000]}")
-                
-                # Log email body snippet for debugging (first 500 chars)
-                if not urls:
-                    logging.warning(f"No URLs found. Email body preview (first 500 chars): {body[:500]}")
-                
-                if urls:
-                    new_listings.append({
-                        'message_id': message_id,
-                        'subject': subject,
-                        'from': email_message['From'],
-                        'urls': urls,
-                        'received_date': email_message['Date']
-                    })
-                else:
-                    logging.warning(f"No property URLs found in email. Email body length: {len(body)}")
+                listing = listing_from_email_message(
+                    email_message,
+                    user_id,
+                    sender_filters_list,
+                    subject_keywords,
+                    last_email_check_dt=last_email_check_dt,
+                    fallback_message_id=email_id.decode(),
+                )
+                if listing:
+                    new_listings.append(listing)
                     
             except Exception as e:
                 logging.error(f"Error processing email {email_id}: {str(e)}")
@@ -1213,6 +3079,55 @@ def check_email_for_listings(
         return []
 
 
+async def process_email_listings(user_id: str, new_listings: List[dict], user_criteria: dict) -> None:
+    """Record each listing URL of the given alert emails in processed_emails and start its analysis"""
+    logging.info(f"Found {len(new_listings)} emails with listings to process")
+    for listing in new_listings:
+        urls_count = len(listing['urls'])
+        logging.info(f"Processing email '{listing['subject']}' with {urls_count} URLs: {listing['urls']}")
+        
+        for idx, url in enumerate(listing['urls'], 1):
+            try:
+                logging.info(f"[{idx}/{urls_count}] Processing URL: {url}")
+                
+                # Check if already exists (avoid duplicates)
+                existing_record = storage.find_analysis(user_id, url)
+                
+                if existing_record:
+                    # Check if analysis already exists (completed or error)
+                    if existing_record.get('analysis_status') not in (None, 'pending'):
+                        logging.info(f"URL {url} already has analysis, skipping")
+                        continue
+                    else:
+                        logging.info(f"URL {url} exists but no analysis yet, will retry analysis")
+                
+                # Mark email as processed (insert or update)
+                if not existing_record:
+                    storage.insert_processed_email({
+                        'user_id': user_id,
+                        'email_message_id': listing['message_id'],
+                        'email_subject': listing['subject'],
+                        'email_from': listing['from'],
+                        'listing_url': url,
+                        'analysis_result': None,  # Will be updated after analysis
+                        'analysis_status': 'pending'
+                    })
+                    logging.info(f"✓ Inserted processed_email record for URL {idx}/{urls_count}: {url}")
+                    _notify_analysis_change(user_id)
+                else:
+                    logging.info(f"✓ Record already exists for URL {idx}/{urls_count}: {url}")
+                
+                # Trigger analysis (async) - use asyncio.create_task to run in background
+                asyncio.create_task(analyze_listing_from_email(user_id, url, user_criteria))
+                logging.info(f"✓ Started analysis task {idx}/{urls_count} for: {url}")
+                
+            except Exception as e:
+                logging.error(f"✗ Error processing URL {idx}/{urls_count} ({url}): {str(e)}", exc_info=True)
+                continue
+        
+        logging.info(f"✓ Completed processing all {urls_count} URLs from email '{listing['subject']}'")
+
+
 async def process_new_email_listings(user_id: str, email_address: str, app_password: str, email_provider: str, email_sender: Optional[str] = None, email_subject_keywords: Optional[str] = None):
     """Process new email listings and trigger analysis"""
     try:
@@ -1223,9 +3138,9 @@ async def process_new_email_listings(user_id: str, email_address: str, app_passw
         # Try to respect last_email_check so we don't miss emails that are already marked read.
         last_email_check = None
         try:
-            criteria_response = supabase_admin.table("user_criteria").select("last_email_check").eq("user_id", user_id).execute()
-            if criteria_response.data and len(criteria_response.data) > 0:
-                last_email_check = criteria_response.data[0].get("last_email_check")
+            saved = storage.get_criteria(user_id)
+            if saved:
+                last_email_check = saved.get("last_email_check")
         except Exception:
             last_email_check = None
 
@@ -1244,147 +3159,461 @@ async def process_new_email_listings(user_id: str, email_address: str, app_passw
         logging.info(f"Found {len(new_listings)} new listings to process")
         
         if not new_listings:
-            logging.info("No new listings found")
-            return
-        
-        # Get user criteria
-        criteria_response = supabase_admin.table("user_criteria").select("*").eq("user_id", user_id).execute()
-        if not criteria_response.data or len(criteria_response.data) == 0:
-            return
-        
-        user_criteria = criteria_response.data[0]
-        
-        # Process each listing
-        logging.info(f"Found {len(new_listings)} emails with listings to process")
-        for listing in new_listings:
-            urls_count = len(listing['urls'])
-            logging.info(f"Processing email '{listing['subject']}' with {urls_count} URLs: {listing['urls']}")
-            
-            for idx, url in enumerate(listing['urls'], 1):
-                try:
-                    logging.info(f"[{idx}/{urls_count}] Processing URL: {url}")
-                    
-                    # Check if already exists (avoid duplicates)
-                    existing = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).eq("listing_url", url).execute()
-                    
-                    if existing.data and len(existing.data) > 0:
-                        existing_record = existing.data[0]
-                        # Check if analysis already exists
-                        if existing_record.get('analysis_result'):
-                            logging.info(f"URL {url} already has analysis, skipping")
-                            continue
-                        else:
-                            logging.info(f"URL {url} exists but no analysis yet, will retry analysis")
-                    
-                    # Mark email as processed (insert or update)
-                    if not existing.data or len(existing.data) == 0:
-                        supabase_admin.table("processed_emails").insert({
-                            'user_id': user_id,
-                            'email_message_id': listing['message_id'],
-                            'email_subject': listing['subject'],
-                            'email_from': listing['from'],
-                            'listing_url': url,
-                            'analysis_result': None  # Will be updated after analysis
-                        }).execute()
-                        logging.info(f"✓ Inserted processed_email record for URL {idx}/{urls_count}: {url}")
-                    else:
-                        logging.info(f"✓ Record already exists for URL {idx}/{urls_count}: {url}")
-                    
-                    # Trigger analysis (async) - use asyncio.create_task to run in background
-                    asyncio.create_task(analyze_listing_from_email(user_id, url, user_criteria))
-                    logging.info(f"✓ Started analysis task {idx}/{urls_count} for: {url}")
-                    
-                except Exception as e:
-                    logging.error(f"✗ Error processing URL {idx}/{urls_count} ({url}): {str(e)}", exc_info=True)
-                    continue
-            
-            logging.info(f"✓ Completed processing all {urls_count} URLs from email '{listing['subject']}'")
+            logging.info("No new listings found")
+            return
+        
+        # Get user criteria
+        user_criteria = storage.get_criteria(user_id)
+        if not user_criteria:
+            return
+        
+        # Process each listing
+        await process_email_listings(user_id, new_listings, user_criteria)
         
         # Update last_email_check timestamp
-        supabase_admin.table("user_criteria").update({
+        storage.update_criteria(user_id, {
             'last_email_check': datetime.utcnow().isoformat()
-        }).eq("user_id", user_id).execute()
+        })
         
     except Exception as e:
         logging.error(f"Error in process_new_email_listings: {str(e)}")
 
 
+# Email analyses deferred while an upstream circuit breaker was open: (user_id, listing_url) -> user_criteria
+_deferred_analyses: dict = {}
+
+
+async def retry_deferred_analyses() -> None:
+    """Restart deferred email analyses once no circuit breaker is refusing calls any more"""
+    if not _deferred_analyses:
+        return
+    now = time.monotonic()
+    if any(breaker.state == "open" and now - breaker.opened_at < BREAKER_OPEN_SECONDS for breaker in _circuit_breakers.values()):
+        return
+    deferred = list(_deferred_analyses.items())
+    _deferred_analyses.clear()
+    logging.info(f"Retrying {len(deferred)} deferred analyses")
+    for (user_id, listing_url), user_criteria in deferred:
+        asyncio.create_task(analyze_listing_from_email(user_id, listing_url, user_criteria))
+
+
 async def analyze_listing_from_email(user_id: str, listing_url: str, user_criteria: dict):
     """Analyze a listing URL from email and store results"""
     try:
         logging.info(f"Starting analysis for URL: {listing_url}")
         
-        # Scrape listing
-        listing_data = call_firecrawl_scraper(listing_url)
-        if "error" in listing_data:
-            logging.error(f"Error scraping listing {listing_url}: {listing_data.get('error')}")
+        # Stage 1: listing facts (scrape + structured facts), shared by every user this listing reaches
+        listing_facts = await get_listing_facts(listing_url, include_images=False)
+        if "error" in listing_facts:
+            logging.error(f"Error scraping listing {listing_url}: {listing_facts.get('error')}")
             # Store error in database
-            supabase_admin.table("processed_emails").update({
-                'analysis_result': {'error': listing_data.get('error'), 'url': listing_url}
-            }).eq("user_id", user_id).eq("listing_url", listing_url).execute()
+            _update_analysis_result(user_id, listing_url, {'error': listing_facts.get('error'), 'url': listing_url})
             return
         
-        logging.info(f"Successfully scraped listing, generating report...")
+        # Fallback facts (failed extraction) would match nearly every user; fan out once real facts exist
+        if LISTING_FANOUT and listing_url not in _fanned_out_listings and not (listing_facts.get('facts') or {}).get('facts_error'):
+            _fanned_out_listings[listing_url] = None
+            while len(_fanned_out_listings) > 10000:
+                _fanned_out_listings.popitem(last=False)
+            asyncio.create_task(fan_out_listing(listing_url, listing_facts))
+        
+        # Same apartment on another portal: reuse this user's analysis of it instead of running the report stages.
+        # (Two portal URLs analysed at the same moment can both miss each other; both then get their own report.)
+        try:
+            canonical_url = await asyncio.to_thread(find_duplicate_listing, listing_url, listing_facts.get('facts') or {})
+            if canonical_url:
+                _pipeline_stats["duplicate_listings"] += 1
+                if await asyncio.to_thread(reuse_duplicate_analysis, user_id, listing_url, canonical_url):
+                    _pipeline_stats["duplicate_analyses_reused"] += 1
+                    logging.info(f"Reused analysis of {canonical_url} for duplicate listing {listing_url}")
+                    return
+        except Exception as e:
+            logging.warning(f"Duplicate listing check failed for {listing_url}: {str(e)}")
         
-        # Convert criteria to format expected by analysis
-        criteria_text = json.dumps(user_criteria, default=str)
+        # Hard-constraint prefilter: clear deal-breakers get a "not a fit" result without vision/report LLM calls
+        _pipeline_stats["prefilter_checked"] += 1
+        reasons = evaluate_hard_constraints(user_criteria, listing_facts.get('facts') or {})
+        if reasons:
+            _pipeline_stats["prefilter_rejected"] += 1
+            _pipeline_stats["llm_report_calls_avoided"] += 1
+            if listing_facts.get('image_analysis') is None:
+                # Vision is skipped for now; it only runs if another user finds this listing plausible.
+                # Counted per listing: how many vision requests it would take depends on the photos and VISION_MULTI_IMAGE
+                _pipeline_stats["vision_listings_deferred"] += 1
+            logging.info(f"Prefilter rejected {listing_url} for user {user_id}: {[r['criterion'] for r in reasons]}")
+            analysis_data = _analysis_result_from_report(prefilter_report(listing_facts, reasons), listing_url, criteria=_scoring_criteria(user_criteria))
+            analysis_data['prefilter'] = {'reasons': reasons}
+            _update_analysis_result(user_id, listing_url, analysis_data)
+            return
         
-        # Analyze images
-        image_analysis = analyze_images(listing_data.get('content', ''), max_images=3)
+        logging.info(f"Listing facts ready, generating compact verdict...")
         
-        # Generate match report
-        match_report = generate_match_report(user_criteria, listing_data, image_analysis)
+        # Stage 2: per-user compact verdict from the facts. Images and the full narrative are only
+        # generated if the user opens the analysis (GET /api/user/analyses/{id}).
+        match_report = await generate_compact_verdict(_scoring_criteria(user_criteria), listing_facts)
+        if "error" in match_report:
+            logging.error(f"Error generating report for {listing_url}: {match_report['error']}")
+            _update_analysis_result(user_id, listing_url, {'error': match_report['error'], 'url': listing_url})
+            return
         
-        logging.info(f"Generated match report (length: {len(match_report)}), storing in database...")
+        logging.info(f"Generated match report (score: {match_report.get('match_score')}), storing in database...")
         
-        # Store analysis result - use JSONB format
-        analysis_data = {
-            'report': match_report,
-            'url': listing_url,
-            'analyzed_at': datetime.utcnow().isoformat()
-        }
+        # Store analysis result - use JSONB format (markdown report + structured fields)
+        analysis_data = _analysis_result_from_report(match_report, listing_url, detail="compact", criteria=_scoring_criteria(user_criteria))
         
-        # Update the analysis_result field - use supabase_admin to bypass RLS
+        # Update the analysis_result field (plus status/match_score summary columns)
         try:
-            update_result = supabase_admin.table("processed_emails").update({
-                'analysis_result': analysis_data
-            }).eq("user_id", user_id).eq("listing_url", listing_url).execute()
+            update_result = _update_analysis_result(user_id, listing_url, analysis_data)
             
-            if update_result.data and len(update_result.data) > 0:
+            if update_result:
                 logging.info(f"Successfully stored analysis result for {listing_url}")
             else:
                 logging.warning(f"No rows updated for {listing_url}, record might not exist")
                 # Try to ensure the record exists by checking first
-                check = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).eq("listing_url", listing_url).execute()
-                if not check.data or len(check.data) == 0:
+                if not storage.find_analysis(user_id, listing_url):
                     logging.error(f"Record doesn't exist for {listing_url}, cannot store analysis")
                 else:
                     logging.info(f"Record exists, retrying update...")
-                    update_result = supabase_admin.table("processed_emails").update({
-                        'analysis_result': analysis_data
-                    }).eq("user_id", user_id).eq("listing_url", listing_url).execute()
-                    if update_result.data:
+                    update_result = _update_analysis_result(user_id, listing_url, analysis_data)
+                    if update_result:
                         logging.info(f"Successfully stored analysis result on retry for {listing_url}")
         except Exception as db_error:
             logging.error(f"Database error storing analysis for {listing_url}: {str(db_error)}", exc_info=True)
             raise
         
+    except CircuitOpenError as e:
+        # Upstream is down: keep the analysis pending and retry it later instead of storing an error
+        logging.warning(f"Deferring analysis of {listing_url}: {str(e)}")
+        _deferred_analyses[(user_id, listing_url)] = user_criteria
+        _pipeline_stats["analyses_deferred"] += 1
     except Exception as e:
         logging.error(f"Error analyzing listing from email: {str(e)}", exc_info=True)
         # Try to store error in database
         try:
-            supabase_admin.table("processed_emails").update({
-                'analysis_result': {'error': str(e), 'url': listing_url}
-            }).eq("user_id", user_id).eq("listing_url", listing_url).execute()
+            _update_analysis_result(user_id, listing_url, {'error': str(e), 'url': listing_url})
         except:
             pass
-        # Try to store error in database
+
+
+# Re-scoring after a criteria change: stored analyses carry the hash of the criteria they were scored against;
+# analyses with another hash are re-scored from the stored listing facts (no scraping, vision or full report)
+RESCORE_CONCURRENCY = int(os.getenv("RESCORE_CONCURRENCY", "8"))  # Verdict calls in flight per user
+RESCORE_BATCH_SIZE = 100  # Analyses loaded and re-scored per round
+_rescore_tasks: Dict[str, asyncio.Task] = {}
+_rescore_again: set = set()  # users whose criteria changed again while their re-scoring was running
+
+
+def _facts_for_rescoring(listing_urls: List[str]) -> dict:
+    """Stored listing facts by URL, without the scraped page content (the compact verdict does not use it)"""
+    return {row["listing_url"]: row for row in storage.listing_facts_for(listing_urls)}
+
+
+async def rescore_user_analyses(user_id: str) -> dict:
+    """
+    Re-score the user's completed analyses that were scored against other criteria, in batches of
+    RESCORE_BATCH_SIZE. Listings are compared from their stored facts (hard-constraint prefilter, else a
+    compact verdict); full reports are regenerated when the user next opens them. Returns counts.
+    """
+    counts = Counter()
+    user_criteria = await asyncio.to_thread(storage.get_criteria, user_id)
+    if not user_criteria:
+        return dict(counts)
+    criteria = _scoring_criteria(user_criteria)
+    current_hash = _criteria_hash(criteria)
+
+    # Only the hash and duplicate link are projected, never the report bodies
+    rows = await asyncio.to_thread(storage.completed_analysis_keys, user_id)
+    stale = [row for row in rows if row.get("criteria_hash") != current_hash]
+    counts["up_to_date"] = len(rows) - len(stale)
+    semaphore = asyncio.Semaphore(RESCORE_CONCURRENCY)
+
+    async def rescore(row: dict, listing_facts: Optional[dict]) -> None:
+        listing_url = row["listing_url"]
+        if not listing_facts:
+            counts["missing_facts"] += 1
+            return
+        listing_facts = {**listing_facts, "listing_url": listing_url}
+        reasons = evaluate_hard_constraints(criteria, listing_facts.get('facts') or {})
+        if reasons:
+            analysis_result = _analysis_result_from_report(prefilter_report(listing_facts, reasons), listing_url, criteria=criteria)
+            analysis_result['prefilter'] = {'reasons': reasons}
+            counts["prefilter_rejected"] += 1
+        else:
+            async with semaphore:
+                report = await asyncio.to_thread(generate_match_report, criteria, listing_facts, "compact")
+            if "error" in report:
+                logging.warning(f"Re-scoring {listing_url} failed: {report['error']}")
+                counts["errors"] += 1
+                return
+            analysis_result = _analysis_result_from_report(report, listing_url, detail="compact", criteria=criteria)
+        if row.get("duplicate_of"):
+            analysis_result['duplicate_of'] = row["duplicate_of"]
+        await asyncio.to_thread(_update_analysis_result, user_id, listing_url, analysis_result)
+        counts["rescored"] += 1
+
+    for start in range(0, len(stale), RESCORE_BATCH_SIZE):
+        batch = stale[start:start + RESCORE_BATCH_SIZE]
+        # Duplicates are scored from the canonical listing's facts, like their full reports
+        facts_urls = {row["id"]: (row.get("duplicate_of") or {}).get("listing_url") or row["listing_url"] for row in batch}
+        facts = await asyncio.to_thread(_facts_for_rescoring, list(set(facts_urls.values())))
+        results = await asyncio.gather(
+            *(rescore(row, facts.get(facts_urls[row["id"]])) for row in batch),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, CircuitOpenError):
+                # OpenAI is down: stop here, the remaining analyses keep their old hash and are picked up next time
+                logging.warning(f"Re-scoring for user {user_id} postponed: {str(result)}")
+                counts["postponed"] = len(stale) - counts["rescored"] - counts["missing_facts"] - counts["errors"]
+                return dict(counts)
+            if isinstance(result, Exception):
+                logging.error(f"Re-scoring error for user {user_id}: {str(result)}")
+                counts["errors"] += 1
+    _pipeline_stats["analyses_rescored"] += counts["rescored"]
+    logging.info(f"Re-scored analyses for user {user_id}: {dict(counts)}")
+    return dict(counts)
+
+
+async def _rescore_until_current(user_id: str) -> dict:
+    counts = {}
+    while True:
+        _rescore_again.discard(user_id)
         try:
-            supabase_admin.table("processed_emails").update({
-                'analysis_result': {'error': str(e), 'url': listing_url}
-            }).eq("user_id", user_id).eq("listing_url", listing_url).execute()
-        except:
-            pass
+            counts = await rescore_user_analyses(user_id)
+        except Exception as e:
+            logging.error(f"Re-scoring failed for user {user_id}: {str(e)}", exc_info=True)
+        if user_id not in _rescore_again:
+            return counts
+
+
+def schedule_rescore(user_id: str) -> asyncio.Task:
+    """Start re-scoring the user's analyses (once per user; a change during a run triggers one more run)"""
+    task = _rescore_tasks.get(user_id)
+    if task and not task.done():
+        _rescore_again.add(user_id)
+        return task
+    task = asyncio.create_task(_rescore_until_current(user_id))
+    _rescore_tasks[user_id] = task
+    task.add_done_callback(lambda _: _rescore_tasks.pop(user_id, None) if _rescore_tasks.get(user_id) is task else None)
+    return task
+
+
+def _criteria_changed(old_row: Optional[dict], new_row: dict) -> bool:
+    """Whether a criteria write changed anything the analyses are scored against"""
+    return _criteria_hash(_scoring_criteria(old_row or {})) != _criteria_hash(_scoring_criteria(new_row))
+
+
+# Change detection for analysed listings: a background refresher re-fetches listings with conditional requests
+# and re-analyses them only when a meaningful fact changed. State lives in listing_refresh_state, prices in
+# listing_price_history (supabase_schema_listing_changes.sql).
+LISTING_REFRESH_ENABLED = os.getenv("LISTING_REFRESH_ENABLED", "false").lower() == "true"
+LISTING_REFRESH_INTERVAL_SECONDS = float(os.getenv("LISTING_REFRESH_INTERVAL_SECONDS", str(6 * 3600)))  # per listing
+LISTING_REFRESH_MAX_AGE_DAYS = int(os.getenv("LISTING_REFRESH_MAX_AGE_DAYS", "30"))  # stop tracking older listings
+LISTING_REFRESH_BATCH = int(os.getenv("LISTING_REFRESH_BATCH", "50"))  # listings checked per round
+# Listings whose portal blocks direct requests cost a Firecrawl scrape per check: check them less often
+LISTING_REFRESH_BLOCKED_INTERVAL_SECONDS = float(os.getenv("LISTING_REFRESH_BLOCKED_INTERVAL_SECONDS", str(24 * 3600)))
+LISTING_REFRESH_CONCURRENCY = 4
+# Facts whose change is worth a new verdict (descriptions, highlights etc. are reworded on every extraction)
+LISTING_CHANGE_FIELDS = (
+    "listing_type", "price_chf", "additional_costs_chf", "rooms", "living_space_m2",
+    "available_from", "floor", "address", "postal_code",
+)
+LISTING_REFRESH_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; REPA listing refresher)"}
+
+
+def _facts_hash(facts: dict) -> str:
+    """Hash of the normalized meaningful facts (numbers parsed, strings case- and whitespace-folded)"""
+    normalized = {}
+    for field in LISTING_CHANGE_FIELDS:
+        value = facts.get(field)
+        number = _as_number(value) if field.endswith(("_chf", "_m2")) or field == "rooms" else None
+        normalized[field] = number if number is not None else (" ".join(str(value).lower().split()) if value not in (None, "") else None)
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _page_hash(text: str) -> str:
+    """Hash of a page's visible text (scripts, styles and markup removed, whitespace collapsed)"""
+    text = re.sub(r"<(script|style|noscript)\b.*?</\1\s*>", " ", text, flags=re.IGNORECASE | re.DOTALL)
+    text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:32]
+
+
+def check_listing_for_changes(listing_url: str, facts: dict, state: dict) -> dict:
+    """
+    Re-fetch one listing and report what changed. Tries a direct conditional GET (ETag/Last-Modified) first;
+    portals that block it are scraped through Firecrawl (and the state records direct_blocked_at, so the listing
+    is checked less often). Facts are only re-extracted when the page text changed; without a previous check,
+    the first directly fetched page is taken as the analysed version.
+    Returns {"status": "not_modified" | "unchanged" | "changed" | "removed" | "error", "state": {...}, ...};
+    "changed" also carries the listing_data and facts of the new version. A failed facts extraction is an
+    "error", never a change.
+    """
+    new_state = {"listing_url": listing_url, "checked_at": datetime.utcnow().isoformat()}
+    listing_data = None
+    page_hash = None
+    try:
+        headers = dict(LISTING_REFRESH_HEADERS)
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        response = requests.get(listing_url, headers=headers, timeout=15)
+        if response.status_code in (200, 304, 404, 410):
+            new_state["direct_blocked_at"] = None
+        if response.status_code == 304:
+            return {"status": "not_modified", "state": new_state}
+        if response.status_code in (404, 410):
+            return {"status": "removed", "state": {**new_state, "removed_at": new_state["checked_at"]}}
+        if response.status_code == 200:
+            new_state["etag"] = response.headers.get("ETag")
+            new_state["last_modified"] = response.headers.get("Last-Modified")
+            page_hash = f"direct:{_page_hash(response.text)}"
+    except requests.RequestException as e:
+        logging.debug(f"Direct fetch of {listing_url} failed: {str(e)}")
+
+    if page_hash is None:
+        # Blocked (403, bot protection) or unreachable: fall back to the scraper
+        new_state["direct_blocked_at"] = state.get("direct_blocked_at") or new_state["checked_at"]
+        listing_data = call_firecrawl_scraper(listing_url, timeout=30)
+        if "error" in listing_data:
+            return {"status": "error", "state": new_state, "error": listing_data["error"]}
+        page_hash = f"firecrawl:{_page_hash(listing_data.get('content') or '')}"
+    new_state["content_hash"] = page_hash
+    if state.get("content_hash") == page_hash:
+        return {"status": "unchanged", "state": new_state}
+    if not state.get("checked_at") and page_hash.startswith("direct:"):
+        # First check: there is no earlier page HTML to compare with (the stored content is the scraper's)
+        new_state["facts_hash"] = state.get("facts_hash") or _facts_hash(facts)
+        return {"status": "unchanged", "state": new_state}
+
+    # The page changed (or this is the first check): compare the facts that matter
+    if listing_data is None:
+        listing_data = call_firecrawl_scraper(listing_url, timeout=30)
+        if "error" in listing_data:
+            return {"status": "error", "state": new_state, "error": listing_data["error"]}
+    new_facts = extract_listing_facts(listing_data)
+    if new_facts.get("facts_error"):
+        # Keep the previous validators and hashes so the next round fetches and extracts this version again
+        return {
+            "status": "error",
+            "state": {**new_state, **{key: state.get(key) for key in ("etag", "last_modified", "content_hash", "facts_hash")}},
+            "error": new_facts["facts_error"],
+        }
+    new_state["facts_hash"] = _facts_hash(new_facts)
+    if new_state["facts_hash"] == (state.get("facts_hash") or _facts_hash(facts)):
+        return {"status": "unchanged", "state": new_state}
+    new_state["changed_at"] = new_state["checked_at"]
+    return {"status": "changed", "state": new_state, "listing_data": listing_data, "facts": new_facts}
+
+
+def _record_price(listing_url: str, facts: dict) -> None:
+    supabase_admin.table("listing_price_history").insert({
+        "listing_url": listing_url,
+        "price_chf": _as_number(facts.get('price_chf')),
+        "additional_costs_chf": _as_number(facts.get('additional_costs_chf')),
+        "available_from": facts.get('available_from'),
+        "observed_at": datetime.utcnow().isoformat(),
+    }).execute()
+
+
+async def refresh_listing(record: dict, state: Optional[dict] = None) -> str:
+    """Check one tracked listing (a listing_facts row) for changes and re-analyse it for its users if it changed"""
+    listing_url = record["listing_url"]
+    facts = record.get("facts") or {}
+    if state is None:
+        response = await asyncio.to_thread(
+            lambda: supabase_admin.table("listing_refresh_state").select("*").eq("listing_url", listing_url).limit(1).execute()
+        )
+        state = response.data[0] if response.data else {}
+    if not state:
+        # First check: start the price history with the price the listing was analysed at, and compare the page
+        # and its facts with the stored (analysed) version so an unchanged listing is not extracted again
+        await asyncio.to_thread(_record_price, listing_url, facts)
+        state = {
+            "content_hash": f"firecrawl:{_page_hash(record.get('content') or '')}",
+            "facts_hash": _facts_hash(facts),
+        }
+
+    outcome = await asyncio.to_thread(check_listing_for_changes, listing_url, facts, state)
+    await asyncio.to_thread(
+        lambda: supabase_admin.table("listing_refresh_state").upsert(outcome["state"], on_conflict="listing_url").execute()
+    )
+    _pipeline_stats[f"listing_refresh_{outcome['status']}"] += 1
+    if outcome["status"] != "changed":
+        return outcome["status"]
+
+    # New version of the listing: keep the photo summaries (photos rarely change), replace the facts
+    new_facts = outcome["facts"]
+    new_facts["listing_image_url"] = facts.get("listing_image_url") or _listing_image_url(outcome["listing_data"])
+    new_record = {
+        **_listing_facts_record(listing_url, outcome["listing_data"], new_facts),
+        "image_analysis": record.get("image_analysis"),
+    }
+    await asyncio.to_thread(_save_listing_facts, new_record)
+    _cache_listing_facts(new_record)
+    if any(_as_number(new_facts.get(field)) != _as_number(facts.get(field)) for field in ("price_chf", "additional_costs_chf")) \
+            or new_facts.get('available_from') != facts.get('available_from'):
+        await asyncio.to_thread(_record_price, listing_url, new_facts)
+    logging.info(f"Listing changed: {listing_url} (price {facts.get('price_chf')} -> {new_facts.get('price_chf')})")
+
+    # Re-analyse for every user with a completed analysis of it
+    user_ids = await asyncio.to_thread(storage.users_with_listing, listing_url, None, "completed")
+    if user_ids:
+        criteria_rows = await asyncio.to_thread(storage.criteria_for_users, user_ids)
+        for user_criteria in criteria_rows:
+            asyncio.create_task(analyze_listing_from_email(user_criteria["user_id"], listing_url, user_criteria))
+        _pipeline_stats["listing_refresh_reanalyses"] += len(criteria_rows)
+    return "changed"
+
+
+async def refresh_tracked_listings() -> Counter:
+    """One refresher round: check the LISTING_REFRESH_BATCH listings that are most overdue"""
+    now = datetime.utcnow()
+    records = await asyncio.to_thread(storage.listing_facts_since, (now - timedelta(days=LISTING_REFRESH_MAX_AGE_DAYS)).isoformat())
+    states = {}
+    urls = [record["listing_url"] for record in records]
+    for start in range(0, len(urls), 100):
+        response = await asyncio.to_thread(
+            lambda chunk=urls[start:start + 100]: supabase_admin.table("listing_refresh_state").select("*").in_("listing_url", chunk).execute()
+        )
+        states.update({row["listing_url"]: row for row in response.data or []})
+
+    cutoff = (now - timedelta(seconds=LISTING_REFRESH_INTERVAL_SECONDS)).isoformat()
+    blocked_cutoff = (now - timedelta(seconds=LISTING_REFRESH_BLOCKED_INTERVAL_SECONDS)).isoformat()
+
+    def is_due(state: dict) -> bool:
+        if state.get("removed_at"):
+            return False
+        return (state.get("checked_at") or "") < (blocked_cutoff if state.get("direct_blocked_at") else cutoff)
+
+    due = [record for record in records if is_due(states.get(record["listing_url"], {}))]
+    due.sort(key=lambda record: states.get(record["listing_url"], {}).get("checked_at") or "")
+    semaphore = asyncio.Semaphore(LISTING_REFRESH_CONCURRENCY)
+
+    async def refresh(record: dict) -> str:
+        async with semaphore:
+            try:
+                return await refresh_listing(record, states.get(record["listing_url"], {}))
+            except CircuitOpenError:
+                return "postponed"
+            except Exception as e:
+                logging.error(f"Refreshing {record['listing_url']} failed: {str(e)}")
+                return "error"
+
+    outcomes = Counter(await asyncio.gather(*(refresh(record) for record in due[:LISTING_REFRESH_BATCH])))
+    if outcomes:
+        logging.info(f"Listing refresh: {dict(outcomes)} ({max(0, len(due) - LISTING_REFRESH_BATCH)} still due)")
+    return outcomes
+
+
+async def periodic_listing_refresh():
+    """Background task: refresh tracked listings every few minutes (each listing once per LISTING_REFRESH_INTERVAL_SECONDS)"""
+    while True:
+        try:
+            await refresh_tracked_listings()
+        except Exception as e:
+            logger.error(f"Error in listing refresh: {str(e)}")
+        await asyncio.sleep(600)
 
 
 @app.post("/api/user/criteria", response_model=UserCriteriaResponse)
@@ -1393,11 +3622,10 @@ async def create_user_criteria(
     user_id: str = Depends(verify_token)
 ):
     """Create or update user criteria"""
-    _require_supabase()
+    _require_storage()
     try:
-        # Use service role client for backend operations (bypasses RLS since we verify JWT ourselves)
         # Check if criteria already exists
-        existing = supabase_admin.table("user_criteria").select("*").eq("user_id", user_id).execute()
+        existing = storage.get_criteria(user_id)
         
         criteria_data = criteria.dict(exclude_none=True)
         criteria_data["user_id"] = user_id
@@ -1405,25 +3633,27 @@ async def create_user_criteria(
         # Handle app_password: only update if provided, otherwise keep existing
         app_password = criteria_data.pop('email_app_password', None)
         
-        if existing.data and len(existing.data) > 0:
+        if existing:
             # Update existing
-            criteria_id = existing.data[0]["id"]
             criteria_data["updated_at"] = datetime.utcnow().isoformat()
             # Only update password if a new one is provided
             if app_password:
                 criteria_data["email_app_password"] = app_password
             # If app_password is None, don't include it - this preserves the existing password
-            response = supabase_admin.table("user_criteria").update(criteria_data).eq("id", criteria_id).execute()
+            saved = storage.update_criteria(user_id, criteria_data)
         else:
             # Create new
             criteria_data["created_at"] = datetime.utcnow().isoformat()
             criteria_data["updated_at"] = datetime.utcnow().isoformat()
             if app_password:
                 criteria_data["email_app_password"] = app_password
-            response = supabase_admin.table("user_criteria").insert(criteria_data).execute()
+            saved = storage.insert_criteria(criteria_data)
         
-        if response.data and len(response.data) > 0:
-            result = response.data[0].copy()
+        if saved:
+            criteria_index.upsert(saved)
+            if existing and _criteria_changed(existing, saved):
+                schedule_rescore(user_id)
+            result = saved.copy()
             # Remove app_password from response for security
             result.pop('email_app_password', None)
             return UserCriteriaResponse(**result)
@@ -1441,7 +3671,7 @@ async def update_user_criteria(
     user_id: str = Depends(verify_token)
 ):
     """Update user criteria"""
-    _require_supabase()
+    _require_storage()
     try:
         criteria_data = criteria.dict(exclude_none=True)
         criteria_data["updated_at"] = datetime.utcnow().isoformat()
@@ -1451,10 +3681,15 @@ async def update_user_criteria(
         if app_password:
             criteria_data["email_app_password"] = app_password
         
-        response = supabase_admin.table("user_criteria").update(criteria_data).eq("user_id", user_id).execute()
+        # Previous criteria, to re-score stored analyses only when scoring criteria changed
+        existing = storage.get_criteria(user_id)
+        saved = storage.update_criteria(user_id, criteria_data)
         
-        if response.data and len(response.data) > 0:
-            result = response.data[0].copy()
+        if saved:
+            criteria_index.upsert(saved)
+            if existing and _criteria_changed(existing, saved):
+                schedule_rescore(user_id)
+            result = saved.copy()
             # Remove app_password from response for security
             result.pop('email_app_password', None)
             return UserCriteriaResponse(**result)
@@ -1466,22 +3701,49 @@ async def update_user_criteria(
         raise HTTPException(status_code=500, detail=f"Error updating criteria: {str(e)}")
 
 
+@app.post("/api/user/analyses/rescore")
+async def rescore_analyses(user_id: str = Depends(verify_token)):
+    """Re-score stored analyses against the current criteria (also runs automatically after criteria changes)"""
+    _require_storage()
+    # Shielded: the job is shared with criteria writes and must outlive a cancelled request
+    counts = await asyncio.shield(schedule_rescore(user_id))
+    return {"status": "success", "counts": counts}
+
+
+@app.post("/api/user/analyses/{analysis_id}/refresh")
+async def refresh_analysis_listing(analysis_id: str, user_id: str = Depends(verify_token)):
+    """Check an analysed listing for changes now (re-analysed if a meaningful fact changed); returns its price history"""
+    _require_supabase()  # refresh state and price history are Supabase tables
+    _require_storage()
+    analysis = storage.get_analysis(user_id, analysis_id)
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    listing_url = analysis["listing_url"]
+    records = storage.listing_facts_for([listing_url])
+    if not records:
+        raise HTTPException(status_code=409, detail="Listing has not been analysed yet")
+    try:
+        outcome = await refresh_listing(records[0])
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    history = supabase_admin.table("listing_price_history").select("price_chf, additional_costs_chf, available_from, observed_at").eq("listing_url", listing_url).order("observed_at").execute().data or []
+    return {"status": outcome, "price_history": history}
+
+
 @app.post("/api/user/check-email")
 async def check_email_manual(
     background_tasks: BackgroundTasks,
     user_id: str = Depends(verify_token)
 ):
     """Manually trigger email check"""
-    _require_supabase()
+    _require_storage()
     try:
         # Get user criteria with email settings
-        criteria_response = supabase_admin.table("user_criteria").select("*").eq("user_id", user_id).execute()
+        user_criteria = storage.get_criteria(user_id)
         
-        if not criteria_response.data or len(criteria_response.data) == 0:
+        if not user_criteria:
             raise HTTPException(status_code=404, detail="No criteria found")
         
-        user_criteria = criteria_response.data[0]
-        
         if not user_criteria.get('email_monitoring_enabled'):
             raise HTTPException(status_code=400, detail="Email monitoring is not enabled")
         
@@ -1505,10 +3767,10 @@ async def check_email_manual(
         
         # Check for pending analyses and retry them
         try:
-            pending_analyses = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).is_("analysis_result", "null").execute()
-            if pending_analyses.data and len(pending_analyses.data) > 0:
-                logger.info(f"Found {len(pending_analyses.data)} pending analyses, retrying...")
-                for pending in pending_analyses.data:
+            pending_analyses = storage.pending_analyses(user_id)
+            if pending_analyses:
+                logger.info(f"Found {len(pending_analyses)} pending analyses, retrying...")
+                for pending in pending_analyses:
                     listing_url = pending.get('listing_url')
                     if listing_url:
                         logger.info(f"Retrying analysis for {listing_url}")
@@ -1534,135 +3796,237 @@ async def check_email_manual(
         raise HTTPException(status_code=500, detail=f"Error checking email: {str(e)}")
 
 
+# Inbound-email webhook: alerts pushed by a mail-forwarding service or local SMTP relay (no IMAP polling)
+INBOUND_EMAIL_SECRET = os.getenv("INBOUND_EMAIL_SECRET")
+INBOUND_EMAIL_MAX_BYTES = int(os.getenv("INBOUND_EMAIL_MAX_BYTES", str(10 * 1024 * 1024)))
+# Domain that receives plus-addressed alerts (alerts+<user_id>@INBOUND_EMAIL_DOMAIN); plus-addressing is off without it
+INBOUND_EMAIL_DOMAIN = (os.getenv("INBOUND_EMAIL_DOMAIN") or "").strip().lower() or None
+
+
+def _inbound_email_message(fields: dict):
+    """
+    Email message from a parsed inbound payload. Accepts the raw message ("raw"/"email") or the split fields used
+    by forwarding services (SendGrid Inbound Parse: from/to/subject/text/html, Mailgun: sender/recipient/body-plain/body-html).
+    """
+    raw = fields.get("raw") or fields.get("email")
+    if raw:
+        return email.message_from_bytes(raw.encode("utf-8") if isinstance(raw, str) else raw)
+    message = EmailMessage()
+    for header, keys in (
+        ("From", ("from", "sender")),
+        ("To", ("to", "recipient")),
+        ("Subject", ("subject",)),
+        ("Message-ID", ("message_id", "Message-Id")),
+        ("Date", ("date", "Date")),
+    ):
+        value = next((fields[key] for key in keys if fields.get(key)), None)
+        if value:
+            message[header] = str(value)
+    text = fields.get("text") or fields.get("body-plain")
+    html_body = fields.get("html") or fields.get("body-html")
+    if text:
+        message.set_content(text)
+        if html_body:
+            message.add_alternative(html_body, subtype="html")
+    elif html_body:
+        message.set_content(html_body, subtype="html")
+    return message
+
+
+def _inbound_recipients(envelope_recipients: List[str]) -> List[str]:
+    """
+    Recipient addresses from the SMTP envelope passed by the relay. Message headers (To, Cc, Delivered-To, ...)
+    are written by the sender and never used for routing.
+    """
+    addresses = [address.strip() for _, address in getaddresses(envelope_recipients) if "@" in address]
+    return list(dict.fromkeys(addresses))
+
+
+def _inbound_recipient_users(recipients: List[str]) -> List[dict]:
+    """
+    Users an inbound email is for: plus-addressed to their user id on the inbound domain
+    (alerts+<user_id>@INBOUND_EMAIL_DOMAIN) or sent to their monitored address. Only users with email monitoring enabled.
+    """
+    user_ids = []
+    for address in recipients:
+        local_part, _, domain = address.rpartition("@")
+        if INBOUND_EMAIL_DOMAIN and domain.lower() == INBOUND_EMAIL_DOMAIN and "+" in local_part:
+            try:
+                user_ids.append(str(uuid.UUID(local_part.split("+", 1)[1])))
+            except ValueError:
+                pass
+    users = {}
+    if user_ids:
+        users.update({row["user_id"]: row for row in storage.criteria_for_users(user_ids, monitoring_only=True)})
+    # monitor_email is stored as typed by the user; match it as received and lower-cased
+    addresses = list(dict.fromkeys(recipients + [address.lower() for address in recipients]))
+    users.update({row["user_id"]: row for row in storage.criteria_by_monitor_email(addresses)})
+    return list(users.values())
+
+
+async def process_inbound_email(email_message, user_criteria_rows: List[dict], fallback_message_id: str) -> None:
+    """Run one pushed email through each recipient's filters, URL extraction and analysis"""
+    for user_criteria in user_criteria_rows:
+        user_id = user_criteria.get('user_id')
+        try:
+            sender_filters_list, subject_keywords = _email_filters(user_criteria.get('email_sender'), user_criteria.get('email_subject_keywords'))
+            # URL extraction may resolve tracking links (blocking I/O)
+            listing = await asyncio.to_thread(
+                listing_from_email_message,
+                email_message,
+                user_id,
+                sender_filters_list,
+                subject_keywords,
+                None,
+                fallback_message_id,
+            )
+            if listing:
+                await process_email_listings(user_id, [listing], user_criteria)
+        except Exception as e:
+            logging.error(f"Error processing inbound email for user {user_id}: {str(e)}", exc_info=True)
+
+
+@app.post("/api/inbound-email")
+async def inbound_email(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    to: Optional[str] = None,
+):
+    """
+    Receive an alert email pushed by a mail-forwarding service or SMTP relay, authenticated with the shared
+    INBOUND_EMAIL_SECRET (X-Inbound-Secret header). Accepts raw RFC822 (message/rfc822 or text/plain),
+    JSON or form fields (raw message or from/to/subject/text/html). The email is routed by its envelope
+    recipients only: ?to= (comma-separated), SendGrid's envelope field or Mailgun's recipient field.
+    """
+    if not INBOUND_EMAIL_SECRET:
+        raise HTTPException(status_code=404, detail="Inbound email is not enabled")
+    provided = request.headers.get("X-Inbound-Secret") or ""
+    if not hmac.compare_digest(provided.encode("utf-8"), INBOUND_EMAIL_SECRET.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid inbound email secret")
+    _require_storage()
+
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > INBOUND_EMAIL_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Email too large")
+    body = await request.body()
+    if len(body) > INBOUND_EMAIL_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Email too large")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    envelope_recipients = [to] if to else []
+    try:
+        if content_type == "application/json":
+            fields = json.loads(body)
+            if not isinstance(fields, dict):
+                raise ValueError("expected a JSON object")
+        elif content_type in ("multipart/form-data", "application/x-www-form-urlencoded"):
+            fields = {key: value for key, value in (await request.form()).items() if isinstance(value, str)}
+        else:
+            fields = {"raw": body}
+        # SendGrid passes the SMTP envelope as a JSON string: {"to": [...], "from": "..."}
+        envelope = fields.get("envelope")
+        if isinstance(envelope, str):
+            envelope = json.loads(envelope)
+        if isinstance(envelope, dict):
+            envelope_recipients.extend(envelope.get("to") or [])
+        # Mailgun routes pass the envelope recipient as "recipient"
+        if fields.get("recipient"):
+            envelope_recipients.append(str(fields["recipient"]))
+        email_message = _inbound_email_message(fields)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse email: {str(e)}")
+
+    recipients = _inbound_recipients(envelope_recipients)
+    users = await asyncio.to_thread(_inbound_recipient_users, recipients) if recipients else []
+    if not users:
+        # Accept anyway so forwarding services do not keep retrying mail for unknown recipients
+        logging.info(f"Inbound email for {recipients} does not match any user with email monitoring enabled")
+        return {"status": "ignored", "message": "No user with email monitoring enabled for this recipient"}
+
+    fallback_message_id = f"inbound-{hashlib.sha256(body).hexdigest()[:32]}"
+    background_tasks.add_task(process_inbound_email, email_message, users, fallback_message_id)
+    _pipeline_stats["inbound_emails"] += 1
+    return {"status": "success", "message": f"Email accepted for {len(users)} user(s)"}
+
+
+def _encode_analyses_cursor(item: dict) -> str:
+    """Encode the keyset position (score_rank, processed_at, id) of the last returned analysis."""
+    position = {"r": item.get('score_rank'), "t": item.get('processed_at'), "id": str(item.get('id'))}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def _decode_analyses_cursor(cursor: str) -> dict:
+    """Decode a cursor produced by _encode_analyses_cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return {"r": int(position["r"]), "t": str(position["t"]), "id": str(uuid.UUID(str(position["id"])))}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _analysis_list_item(item: dict) -> dict:
+    """Shape a projected processed_emails row for the analyses list (no report body)."""
+    listing_url = item.get('listing_url')
+    result = {
+        'id': str(item.get('id')),
+        'listing_url': listing_url,
+        'url': listing_url,
+        'email_subject': item.get('email_subject') or 'No subject',
+        'email_from': item.get('email_from') or 'Unknown',
+        'created_at': item.get('processed_at'),
+        'match_score': item.get('match_score'),
+        'status': item.get('analysis_status') or 'pending',
+    }
+    if result['status'] == 'error':
+        result['error'] = item.get('analysis_error')
+    return result
+
+
 @app.get("/api/user/analyses")
 async def get_email_analyses(
+    request: Request,
     user_id: str = Depends(verify_token),
-    limit: int = 50
+    limit: int = 50,
+    cursor: Optional[str] = None
 ):
-    """Get email analysis results for the user"""
-    _require_supabase()
-    def _extract_match_score(report: str) -> Optional[int]:
-        """
-        Best-effort parser for the "Match Score: XX%" line in the LLM report.
-        Expected format in prompt: "## 🎯 Match Score: [X]%" (but we allow variants).
-        """
-        if not report:
-            return None
-        try:
-            # Common variants:
-            # - "## 🎯 Match Score: 87%"
-            # - "## 🎯 Match Score: [87]%"
-            # - "Match Score: 87%"
-            m = re.search(r"Match\s*Score\s*:\s*\[?\s*(\d{1,3})\s*\]?\s*%", report, flags=re.IGNORECASE)
-            if not m:
-                return None
-            score = int(m.group(1))
-            if score < 0:
-                return 0
-            if score > 100:
-                return 100
-            return score
-        except Exception:
-            return None
-
+    """
+    Get email analysis summaries for the user, ranked by match score (highest first).
+    Only summary columns are returned; fetch /api/user/analyses/{id} for the full report.
+    Pagination is keyset-based: pass the returned next_cursor to get the following page.
+    Pending/failed analyses are only included on the first page.
+    """
+    _require_storage()
+    limit = max(1, min(limit, 100))
     try:
-        # Use service role client for backend operations (bypasses RLS since we verify JWT ourselves)
-        # Get all processed emails with analysis results for this user
-        # Note: Column is 'processed_at' not 'created_at'
-        # Try ordering by processed_at descending
-        try:
-            response = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).order("processed_at", desc=True).limit(limit).execute()
-        except Exception as order_error:
-            # If ordering fails, try without order or with different syntax
-            logging.warning(f"Ordering failed, trying without order: {str(order_error)}")
-            response = supabase_admin.table("processed_emails").select("*").eq("user_id", user_id).limit(limit).execute()
-        
-        analyses = []
+        # Completed analyses ordered by (score_rank, processed_at, id) - served by idx_processed_emails_user_ranked
+        after = None
+        if cursor:
+            position = _decode_analyses_cursor(cursor)
+            after = (position["r"], position["t"], position["id"])
+        rows = storage.ranked_analyses(user_id, limit + 1, after)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        analyses = [_analysis_list_item(item) for item in rows]
+        next_cursor = _encode_analyses_cursor(rows[-1]) if has_more and rows else None
+
         pending_analyses = []
-        if response.data:
-            logging.info(f"Found {len(response.data)} processed email records")
-            for item in response.data:
-                analysis_result = item.get('analysis_result')
-                listing_url = item.get('listing_url')
-                
-                # Track pending analyses (record exists but no analysis_result yet)
-                if not analysis_result:
-                    pending_analyses.append({
-                        'id': str(item.get('id')),
-                        'listing_url': listing_url,
-                        'email_subject': item.get('email_subject') or 'No subject',
-                        'email_from': item.get('email_from') or 'Unknown',
-                        'created_at': item.get('processed_at') or item.get('created_at'),
-                        'status': 'pending'
-                    })
-                    logging.debug(f"Analysis pending for {listing_url}")
-                    continue
-                
-                # Handle both dict and string formats for analysis_result
-                if isinstance(analysis_result, str):
-                    try:
-                        analysis_result = json.loads(analysis_result)
-                    except json.JSONDecodeError:
-                        logging.warning(f"Failed to parse analysis_result as JSON: {str(analysis_result)[:100]}")
-                        analysis_result = {}
-                elif not isinstance(analysis_result, dict):
-                    analysis_result = {}
-                
-                # Check for errors
-                if analysis_result.get('error'):
-                    logging.warning(f"Analysis error for {listing_url}: {analysis_result.get('error')}")
-                    pending_analyses.append({
-                        'id': str(item.get('id')),
-                        'listing_url': listing_url,
-                        'email_subject': item.get('email_subject') or 'No subject',
-                        'email_from': item.get('email_from') or 'Unknown',
-                        'created_at': item.get('processed_at') or item.get('created_at'),
-                        'status': 'error',
-                        'error': analysis_result.get('error')
-                    })
-                    continue
-                
-                # Only include items that have a report
-                if analysis_result and analysis_result.get('report'):
-                    report_text = analysis_result.get('report')
-                    match_score = _extract_match_score(report_text) if isinstance(report_text, str) else None
-                    analyses.append({
-                        'id': str(item.get('id')),
-                        'listing_url': listing_url,
-                        'email_subject': item.get('email_subject') or 'No subject',
-                        'email_from': item.get('email_from') or 'Unknown',
-                        'created_at': item.get('processed_at') or item.get('created_at'),
-                        'report': report_text,
-                        'url': analysis_result.get('url', listing_url),
-                        'match_score': match_score,
-                        'status': 'completed'
-                    })
-        
+        changes_cursor = None
+        if not cursor:
+            pending_analyses = [_analysis_list_item(item) for item in storage.pending_analyses(user_id, ("pending", "error"), 100)]
+            changes_cursor = _latest_analysis_change(user_id)
+
         logging.info(f"Returning {len(analyses)} completed analyses, {len(pending_analyses)} pending")
-        
-        # Sort analyses by match score (highest first), then recency as tie-breaker.
-        # Keep items without a parsable score at the bottom.
-        if analyses:
-            analyses.sort(
-                key=lambda x: (
-                    x.get('match_score') is not None,
-                    x.get('match_score') if x.get('match_score') is not None else -1,
-                    str(x.get('created_at') or ""),
-                ),
-                reverse=True,
-            )
-        
-        # Sort pending analyses too
-        if pending_analyses:
-            pending_analyses.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
+
         # Always return success, even if no analyses found
-        return {
-            "analyses": analyses, 
+        return _conditional_json_response(request, {
+            "analyses": analyses,
             "count": len(analyses),
             "pending": pending_analyses,
-            "pending_count": len(pending_analyses)
-        }
+            "pending_count": len(pending_analyses),
+            "next_cursor": next_cursor,
+            "changes_cursor": changes_cursor
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -1672,7 +4036,12 @@ async def get_email_analyses(
         logging.error(traceback.format_exc())
         
         # Provide more helpful error messages
-        if "does not exist" in error_msg.lower() or "relation" in error_msg.lower() or "table" in error_msg.lower():
+        if "column" in error_msg.lower() and "does not exist" in error_msg.lower():
+            raise HTTPException(
+                status_code=500,
+                detail="The processed_emails summary columns are missing. Please run the database migration: supabase_schema_analysis_summary.sql in your Supabase SQL Editor."
+            )
+        elif "does not exist" in error_msg.lower() or "relation" in error_msg.lower() or "table" in error_msg.lower():
             raise HTTPException(
                 status_code=500, 
                 detail="The processed_emails table does not exist. Please run the database migration: supabase_schema_email.sql in your Supabase SQL Editor."
@@ -1685,7 +4054,7 @@ async def get_email_analyses(
         elif "not found" in error_msg.lower() or "404" in error_msg.lower():
             # If table doesn't exist or no records, return empty list instead of error
             logging.warning("No analyses found or table doesn't exist, returning empty list")
-            return {"analyses": [], "count": 0}
+            return {"analyses": [], "count": 0, "pending": [], "pending_count": 0, "next_cursor": None}
         else:
             error_detail = f"Error retrieving analyses: {error_msg}"
             if hasattr(e, 'message'):
@@ -1693,116 +4062,421 @@ async def get_email_analyses(
             raise HTTPException(status_code=500, detail=error_detail)
 
 
+# sort parameter -> (column, descending); price sorts cheapest first, everything else largest/newest first
+USER_LISTINGS_SORTS = {
+    "score": ("score_rank", True),
+    "price": ("price_chf", False),
+    "rooms": ("rooms", True),
+    "space": ("living_space_m2", True),
+    "recent": ("processed_at", True),
+}
+
+
+@app.get("/api/user/listings")
+async def search_user_listings(
+    user_id: str = Depends(verify_token),
+    q: Optional[str] = None,
+    listing_type: Optional[str] = None,
+    min_rooms: Optional[float] = None,
+    max_rooms: Optional[float] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_space: Optional[float] = None,
+    max_space: Optional[float] = None,
+    postal_code: Optional[str] = None,
+    city: Optional[str] = None,
+    features: Optional[str] = None,
+    min_score: Optional[int] = None,
+    sort: str = "score",
+    limit: int = 50,
+    offset: int = 0,
+):
+    """
+    Search the user's analysed listings by their typed facts (Supabase: user_listings view from
+    supabase_schema_listing_search.sql; SQLite storage: FTS5 tables).
+    q is a full-text query over the listing text and the user's report (web search syntax: "lake view" -studio);
+    features is a comma-separated list of amenities that must all be present (e.g. balcony,elevator).
+    """
+    _require_storage()
+    if sort not in USER_LISTINGS_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(USER_LISTINGS_SORTS)}")
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+
+    filters = [
+        (column, operator, value) for column, operator, value in (
+            ("rooms", "gte", min_rooms), ("rooms", "lte", max_rooms),
+            ("price_chf", "gte", min_price), ("price_chf", "lte", max_price),
+            ("living_space_m2", "gte", min_space), ("living_space_m2", "lte", max_space),
+            ("match_score", "gte", min_score),
+            ("listing_type", "eq", listing_type.lower() if listing_type else None),
+            ("postal_code", "eq", postal_code.strip() if postal_code else None),
+            ("city", "ieq", city.strip() if city else None),
+        )
+        if value is not None
+    ]
+    wanted = [feature.strip().lower() for feature in (features or "").split(",") if feature.strip()]
+    try:
+        rows = await asyncio.to_thread(
+            storage.search_listings, user_id, filters, wanted, (q or "").strip() or None, USER_LISTINGS_SORTS[sort], limit + 1, offset
+        )
+    except Exception as e:
+        error_msg = str(e)
+        logging.error(f"Error searching listings: {error_msg}")
+        if "user_listings" in error_msg or "does not exist" in error_msg.lower():
+            raise HTTPException(
+                status_code=500,
+                detail="The listing search view is missing. Please run the database migration: supabase_schema_listing_search.sql in your Supabase SQL Editor."
+            )
+        raise HTTPException(status_code=500, detail=f"Error searching listings: {error_msg}")
+
+    has_more = len(rows) > limit
+    listings = []
+    for row in rows[:limit]:
+        status_value = row.pop("analysis_status", None)
+        listings.append({**row, "id": str(row["id"]), "status": status_value or "pending"})
+    return {
+        "listings": listings,
+        "count": len(listings),
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+def _settled_change_time() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)
+
+
+def _encode_changes_cursor(updated_at: str, row_id: str = NIL_UUID) -> str:
+    """Encode the change feed position (updated_at, id) of the last returned change."""
+    return base64.urlsafe_b64encode(json.dumps({"t": updated_at, "id": str(row_id)}).encode()).decode().rstrip("=")
+
+
+def _decode_changes_cursor(cursor: str) -> tuple:
+    """Decode a change feed cursor; a bare ISO timestamp (older clients) starts before every row at that time."""
+    try:
+        datetime.fromisoformat(cursor.replace("Z", "+00:00"))
+        return cursor, NIL_UUID
+    except ValueError:
+        pass
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        datetime.fromisoformat(str(position["t"]).replace("Z", "+00:00"))
+        return str(position["t"]), str(uuid.UUID(str(position["id"])))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid since cursor")
+
+
+def _latest_analysis_change(user_id: str) -> str:
+    """The change feed starting cursor: everything up to the settle window is covered by the list just returned."""
+    return _encode_changes_cursor(_settled_change_time().isoformat())
+
+
+def _fetch_analysis_changes(user_id: str, after: tuple, limit: int = 100) -> List[dict]:
+    """Summary rows for the user's analyses created or updated after the cursor position, once settled."""
+    return storage.analysis_changes(user_id, after, _settled_change_time().isoformat(), limit)
+
+
+@app.get("/api/user/analyses/changes")
+async def get_email_analysis_changes(
+    user_id: str = Depends(verify_token),
+    since: Optional[str] = None,
+    timeout: float = 25.0
+):
+    """
+    Long-poll change feed for the user's analyses.
+    Returns summaries (no reports) of analyses that became pending, completed or failed after `since`,
+    waiting up to `timeout` seconds for something to change. Pass the returned cursor as the next `since`.
+    """
+    _require_storage()
+    timeout = max(0.0, min(timeout, 55.0))
+    try:
+        if not since:
+            # No cursor yet: hand out the current position without waiting
+            return {"changes": [], "cursor": _latest_analysis_change(user_id)}
+        position = _decode_changes_cursor(since)
+
+        event = _analysis_change_events.setdefault(user_id, asyncio.Event())
+        _analysis_change_waiters[user_id] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                # Clear before querying so a write racing with the query still wakes the next wait
+                event.clear()
+                rows = await asyncio.to_thread(_fetch_analysis_changes, user_id, position)
+                remaining = deadline - loop.time()
+                if rows or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, CHANGE_FEED_DB_POLL_SECONDS))
+                    # The write is committed; wait until it is outside the settle window
+                    await asyncio.sleep(min(CHANGE_FEED_SETTLE_SECONDS, max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            _analysis_change_waiters[user_id] -= 1
+            if _analysis_change_waiters[user_id] <= 0:
+                del _analysis_change_waiters[user_id]
+                _analysis_change_events.pop(user_id, None)
+
+        cursor = _encode_changes_cursor(rows[-1]['updated_at'], rows[-1]['id']) if rows else since
+        return {"changes": [_analysis_list_item(item) for item in rows], "cursor": cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error retrieving analysis changes: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error retrieving analysis changes: {str(e)}")
+
+
+# One full-report generation per analysis at a time (two tabs opening the same analysis share it)
+_full_report_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+async def _generate_full_report(user_id: str, listing_url: str, compact_result: dict) -> dict:
+    """
+    Upgrade a compact email analysis to the full narrative report (with images) and store it. The compact
+    verdict's score and verdict are kept, so opening an analysis never moves it in the ranked list.
+    Returns the stored analysis_result; falls back to the compact result if generation fails for any reason.
+    """
+    lock_key = f"{user_id}:{listing_url}"
+    lock = _full_report_locks.get(lock_key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _full_report_locks[lock_key] = lock
+    async with lock:
+        # Another request may have finished the upgrade while we waited
+        current = await asyncio.to_thread(storage.find_analysis, user_id, listing_url)
+        if current and isinstance(current.get('analysis_result'), dict) and current['analysis_result'].get('detail') != 'compact':
+            return current['analysis_result']
+
+        user_criteria = await asyncio.to_thread(storage.get_criteria, user_id)
+        if not user_criteria:
+            return compact_result
+        try:
+            # Duplicates of a listing on another portal share its facts and photo summaries
+            duplicate_of = compact_result.get('duplicate_of')
+            facts_url = duplicate_of['listing_url'] if duplicate_of else listing_url
+            listing_facts = await get_listing_facts(facts_url, max_images=3)
+            if "error" in listing_facts or (listing_facts.get('facts') or {}).get('facts_error'):
+                logging.warning(f"Could not load listing facts for full report of {listing_url}: "
+                                f"{listing_facts.get('error') or listing_facts['facts']['facts_error']}")
+                return compact_result
+            criteria = _scoring_criteria(user_criteria)
+            report = await asyncio.to_thread(generate_match_report, criteria, listing_facts)
+        except CircuitOpenError as e:
+            logging.warning(f"Full report for {listing_url} postponed: {str(e)}")
+            return compact_result
+        except Exception as e:
+            logging.error(f"Full report generation failed for {listing_url}: {str(e)}", exc_info=True)
+            return compact_result
+        if "error" in report:
+            logging.warning(f"Full report generation failed for {listing_url}: {report['error']}")
+            return compact_result
+        # The narrative is added to the existing verdict; the score that ranks the analysis stays as it was
+        if compact_result.get('match_score') is not None:
+            report = {**report, 'match_score': compact_result['match_score'], 'verdict': compact_result.get('verdict') or report.get('verdict')}
+        analysis_result = _analysis_result_from_report(report, listing_url, criteria=criteria)
+        if duplicate_of:
+            analysis_result['duplicate_of'] = duplicate_of
+        await asyncio.to_thread(_update_analysis_result, user_id, listing_url, analysis_result)
+        _pipeline_stats["full_reports_generated"] += 1
+        return analysis_result
+
+
+@app.get("/api/user/analyses/{analysis_id}")
+async def get_email_analysis(analysis_id: str, request: Request, user_id: str = Depends(verify_token)):
+    """Get a single email analysis including the full report"""
+    _require_storage()
+    try:
+        uuid.UUID(analysis_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    try:
+        item = storage.get_analysis(user_id, analysis_id)
+        if not item:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+
+        analysis = _analysis_list_item(item)
+        analysis_result = item.get('analysis_result')
+        # Handle both dict and string formats for analysis_result
+        if isinstance(analysis_result, str):
+            try:
+                analysis_result = json.loads(analysis_result)
+            except json.JSONDecodeError:
+                analysis_result = {}
+        elif not isinstance(analysis_result, dict):
+            analysis_result = {}
+        if analysis_result.get('detail') == 'compact' and not analysis_result.get('error'):
+            # First open of an email analysis: generate and cache the full narrative report
+            analysis_result = await _generate_full_report(user_id, item.get('listing_url'), analysis_result)
+            analysis['match_score'] = analysis_result.get('match_score', analysis['match_score'])
+        analysis['report'] = analysis_result.get('report')
+        analysis['url'] = analysis_result.get('url') or analysis['listing_url']
+        analysis['detail'] = analysis_result.get('detail', 'full')
+        if analysis_result.get('duplicate_of'):
+            analysis['duplicate_of'] = analysis_result['duplicate_of']
+        return _conditional_json_response(request, analysis)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error retrieving analysis {analysis_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error retrieving analysis: {str(e)}")
+
+
+def save_chat_criteria(user_id: str, criteria: dict) -> None:
+    """Save criteria extracted from a chat message to the user's profile (raises if the save fails)"""
+    # Check if criteria already exists
+    existing = storage.get_criteria(user_id)
+    
+    # Prepare criteria data - only include fields that exist in the schema
+    # Map OpenAI extracted fields to database fields
+    additional_reqs = criteria.get('additional_requirements') or criteria.get('user_additional_requirements')
+    # Convert array to dict if needed, or keep as dict
+    if isinstance(additional_reqs, list):
+        # Convert array to dict format
+        additional_reqs = {"requirements": additional_reqs}
+    elif additional_reqs and not isinstance(additional_reqs, dict):
+        # If it's a string or other type, wrap it
+        additional_reqs = {"requirements": [str(additional_reqs)]}
+    
+    criteria_data = {
+        "user_id": user_id,
+        "property_type": criteria.get('property_type'),
+        "location": criteria.get('location'),
+        "min_rooms": criteria.get('min_rooms'),
+        "max_rooms": criteria.get('max_rooms'),
+        "min_living_space": criteria.get('min_living_space'),
+        "max_living_space": criteria.get('max_living_space'),
+        "min_rent": criteria.get('min_rent'),
+        "max_rent": criteria.get('max_rent'),
+        "occupants": criteria.get('occupants'),
+        "duration": criteria.get('duration'),
+        "starting_when": criteria.get('starting_when'),
+    }
+    
+    # Add additional_requirements only if it exists
+    if additional_reqs:
+        criteria_data["user_additional_requirements"] = additional_reqs
+    
+    # Remove None values (but keep empty strings and 0)
+    criteria_data = {k: v for k, v in criteria_data.items() if v is not None}
+    
+    logger.info(f"Saving criteria for user {user_id}: {criteria_data}")
+    
+    if existing:
+        # Update existing
+        criteria_data["updated_at"] = datetime.utcnow().isoformat()
+        saved = storage.update_criteria(user_id, criteria_data)
+        logger.info(f"Updated criteria for user {user_id}, saved: {saved}")
+    else:
+        # Create new
+        criteria_data["created_at"] = datetime.utcnow().isoformat()
+        criteria_data["updated_at"] = datetime.utcnow().isoformat()
+        saved = storage.insert_criteria(criteria_data)
+        logger.info(f"Created new criteria for user {user_id}, saved: {saved}")
+        
+    if not saved:
+        error_msg = "Database save returned no data"
+        logger.error(f"Failed to save criteria - {error_msg}")
+        raise Exception(error_msg)
+    
+    criteria_index.upsert(saved)
+    if existing and _criteria_changed(existing, saved) and _event_loop:
+        # Runs in a worker thread (see /api/chat): hand the re-scoring job to the event loop
+        _event_loop.call_soon_threadsafe(schedule_rescore, user_id)
+    logger.info(f"Successfully saved criteria for user {user_id}")
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, user_id: str = Depends(verify_token)):
     """
     Process a chat message with apartment criteria. Optionally analyze a listing URL if provided.
     """
-    _require_supabase()
+    _require_storage()
+    facts_task = save_task = None
     try:
         # Extract URL from message (optional)
         user_message, listing_url = extract_url_from_message(request.message)
         
-        # Step 1: Extract user criteria from the message
-        criteria = extract_criteria_with_openai(user_message)
-        if "error" in criteria:
-            raise HTTPException(status_code=500, detail=f"Error extracting criteria: {criteria['error']}")
+        # Stages run as a small dependency graph:
+        #   listing facts (scrape -> facts -> images)  -- independent of the criteria, starts immediately
+        #   criteria (extraction, or the saved profile for URL-only messages) -> profile save
+        #   report <- criteria + listing facts; the profile save runs alongside it
+        #   all within CHAT_DEADLINE_SECONDS: the listing stage must leave CHAT_REPORT_RESERVE_SECONDS for the report
+        deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
+        degraded: List[str] = []
+        url_only = bool(listing_url) and not re.search(r'\w', user_message)
+        facts_task = asyncio.create_task(get_listing_facts(
+            listing_url, max_images=3, deadline=deadline - CHAT_REPORT_RESERVE_SECONDS, degraded=degraded
+        )) if listing_url else None
         
-        # Step 2: Save criteria to user profile automatically
-        save_success = False
-        save_error_message = None
-        try:
-            # Use service role client for backend operations (bypasses RLS since we verify JWT ourselves)
-            logger.info(f"Using supabase_admin client (service key: {'SET' if SUPABASE_SERVICE_KEY else 'NOT SET'})")
-            # Check if criteria already exists
-            existing = supabase_admin.table("user_criteria").select("*").eq("user_id", user_id).execute()
-            
-            # Prepare criteria data - only include fields that exist in the schema
-            # Map OpenAI extracted fields to database fields
-            additional_reqs = criteria.get('additional_requirements') or criteria.get('user_additional_requirements')
-            # Convert array to dict if needed, or keep as dict
-            if isinstance(additional_reqs, list):
-                # Convert array to dict format
-                additional_reqs = {"requirements": additional_reqs}
-            elif additional_reqs and not isinstance(additional_reqs, dict):
-                # If it's a string or other type, wrap it
-                additional_reqs = {"requirements": [str(additional_reqs)]}
-            
-            criteria_data = {
-                "user_id": user_id,
-                "property_type": criteria.get('property_type'),
-                "location": criteria.get('location'),
-                "min_rooms": criteria.get('min_rooms'),
-                "max_rooms": criteria.get('max_rooms'),
-                "min_living_space": criteria.get('min_living_space'),
-                "max_living_space": criteria.get('max_living_space'),
-                "min_rent": criteria.get('min_rent'),
-                "max_rent": criteria.get('max_rent'),
-                "occupants": criteria.get('occupants'),
-                "duration": criteria.get('duration'),
-                "starting_when": criteria.get('starting_when'),
-            }
-            
-            # Add additional_requirements only if it exists
-            if additional_reqs:
-                criteria_data["user_additional_requirements"] = additional_reqs
-            
-            # Remove None values (but keep empty strings and 0)
-            criteria_data = {k: v for k, v in criteria_data.items() if v is not None}
-            
-            logger.info(f"Saving criteria for user {user_id}: {criteria_data}")
-            
-            if existing.data and len(existing.data) > 0:
-                # Update existing
-                criteria_id = existing.data[0]["id"]
-                criteria_data["updated_at"] = datetime.utcnow().isoformat()
-                response = supabase_admin.table("user_criteria").update(criteria_data).eq("id", criteria_id).execute()
-                logger.info(f"Updated criteria for user {user_id}, response data: {response.data}")
-            else:
-                # Create new
-                criteria_data["created_at"] = datetime.utcnow().isoformat()
-                criteria_data["updated_at"] = datetime.utcnow().isoformat()
-                response = supabase_admin.table("user_criteria").insert(criteria_data).execute()
-                logger.info(f"Created new criteria for user {user_id}, response data: {response.data}")
-                
-            if not response.data or len(response.data) == 0:
-                error_msg = "Database save returned no data"
-                logger.error(f"Failed to save criteria - {error_msg}")
-                raise Exception(error_msg)
+        if url_only:
+            # Nothing to extract: score against the saved profile right away
+            saved = await asyncio.to_thread(storage.get_criteria, user_id)
+            criteria = _scoring_criteria(saved) if saved else {}
+        else:
+            # Step 1: Extract user criteria from the message
+            criteria = await asyncio.to_thread(extract_criteria_with_openai, user_message, deadline - CHAT_REPORT_RESERVE_SECONDS)
+            if "error" in criteria:
+                raise HTTPException(status_code=500, detail=f"Error extracting criteria: {criteria['error']}")
             
-            logger.info(f"Successfully saved criteria for user {user_id}")
-            save_success = True
-                
-        except Exception as save_error:
-            error_msg = f"Failed to save criteria: {str(save_error)}"
-            logger.error(error_msg, exc_info=True)
-            save_success = False
-            save_error_message = str(save_error)
+            # Step 2: Save criteria to user profile automatically (in the background of the listing stages)
+            save_task = asyncio.create_task(asyncio.to_thread(save_chat_criteria, user_id, criteria))
+        
+        async def save_result() -> tuple[bool, Optional[str]]:
+            if save_task is None:
+                return False, None
+            try:
+                await save_task
+                return True, None
+            except Exception as save_error:
+                logger.error(f"Failed to save criteria: {str(save_error)}", exc_info=True)
+                return False, str(save_error)
         
         # Step 3: If URL provided, analyze the listing
         if listing_url:
-            # Scrape listing
-            listing_data = call_firecrawl_scraper(listing_url)
-            if "error" in listing_data:
+            def saved_note(save_success: bool) -> str:
+                return "✅ Your preferences have been saved to your profile!\n\nHowever, " if save_success else "Sorry, "
+            
+            # Listing facts (scrape + facts + images), reused if this listing was analysed before
+            listing_facts = await facts_task
+            if "error" in listing_facts:
+                save_success, _ = await save_result()
                 return ChatResponse(
-                    response=f"✅ Your preferences have been saved to your profile!\n\nHowever, I couldn't analyze the listing URL: {listing_data['error']}\n\nYou can view and edit your saved preferences in your Profile page.",
+                    response=f"{saved_note(save_success)}I couldn't analyze the listing URL: {listing_facts['error']}\n\nYou can view and edit your saved preferences in your Profile page.",
                     status="success"
                 )
             
-            # Analyze images (optional, can be skipped for speed)
-            print(f"[Debug] Starting image analysis...")
-            image_analysis = analyze_images(listing_data.get('content', ''), max_images=3)
+            image_analysis = listing_facts.get('image_analysis') or ""
             print(f"[Debug] Image analysis length: {len(image_analysis)}")
-            print(f"[Debug] Image analysis result: {image_analysis[:500]}...")  # First 500 chars
             print(f"[Debug] Image analysis is valid: {image_analysis not in ['No images found to analyze', 'Image analysis skipped (no API key)']}")
             
-            # Generate match report
-            print(f"[Debug] Generating match report with image_analysis={bool(image_analysis)}")
-            match_report = generate_match_report(criteria, listing_data, image_analysis)
+            # Generate match report (the compact verdict if the budget no longer allows the full narrative)
+            detail = "full"
+            if _time_left(deadline) < CHAT_FULL_REPORT_MIN_SECONDS:
+                detail = "compact"
+                degraded.append("report_compact")
+            print(f"[Debug] Generating {detail} match report with image_analysis={bool(image_analysis)}")
+            match_report = await asyncio.to_thread(generate_match_report, criteria, listing_facts, detail, _budget(deadline, 60))
+            save_success, _ = await save_result()
+            if degraded:
+                logger.info(f"/api/chat degraded stages for {listing_url}: {degraded}")
+            if "error" in match_report:
+                return ChatResponse(
+                    response=f"{saved_note(save_success)}the match report could not be generated: {match_report['error']}",
+                    status="success",
+                    degraded=degraded
+                )
             
+            response_text = render_match_report(match_report)
+            if degraded:
+                notes = [DEGRADED_STAGE_NOTES.get(stage, stage) for stage in degraded]
+                response_text += f"\n\n---\n\n*To answer quickly, some steps were shortened: {'; '.join(notes)}. Ask again for the complete analysis.*"
             return ChatResponse(
-                response=match_report,
-                status="success"
+                response=response_text,
+                status="success",
+                degraded=degraded
             )
         else:
             # No URL provided - just confirm criteria was saved
@@ -1836,6 +4510,7 @@ async def chat(request: ChatRequest, user_id: str = Depends(verify_token)):
             
             summary_text = "\n".join(criteria_summary) if criteria_summary else "Your preferences"
             
+            save_success, save_error_message = await save_result()
             if save_success:
                 return ChatResponse(
                     response=f"""✅ **Your preferences have been saved!**
@@ -1862,26 +4537,203 @@ Error: {save_error_message}""",
                     status="warning"
                 )
     
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"{str(e)}. Please try again in a minute.")
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"[ERROR] Exception in /api/chat endpoint:")
         print(error_details)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # A stage that failed early (criteria extraction, the listing facts) leaves the others running
+        pending = [task for task in (facts_task, save_task) if task and not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Bulk analysis (POST /api/analyze/batch): compact verdicts for many pasted URLs, streamed as they complete.
+# The semaphore is shared by all batch requests of this process, on top of the upstream circuit breakers.
+BATCH_ANALYZE_MAX_URLS = int(os.getenv("BATCH_ANALYZE_MAX_URLS", "50"))
+BATCH_ANALYZE_CONCURRENCY = int(os.getenv("BATCH_ANALYZE_CONCURRENCY", "4"))
+_batch_analyze_semaphore = asyncio.Semaphore(BATCH_ANALYZE_CONCURRENCY)
+# Query parameters added by newsletters and ads; they never change which listing a URL shows
+TRACKING_QUERY_PARAMS = ("fbclid", "gclid", "mc_cid", "mc_eid")
+
+
+def canonical_listing_url(url: str) -> Optional[str]:
+    """Normalized listing URL (lowercase scheme/host, no fragment, tracking parameters or trailing slash), None if not http(s)"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ("http", "https") or not parts.netloc:
+        return None
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_QUERY_PARAMS
+    ))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ""))
+
+
+async def _batch_analyze_url(user_id: str, listing_url: str, criteria: dict, stored: Optional[dict]) -> dict:
+    """Compact verdict for one batch URL, stored as the user's analysis; reuses a completed analysis for the same criteria"""
+    item = {"url": listing_url, "id": stored["id"] if stored else None}
+    if stored and stored.get("analysis_status") == "completed" and stored.get("criteria_hash") == _criteria_hash(criteria):
+        _pipeline_stats["batch_analyses_reused"] += 1
+        return {**item, "status": "completed", "source": "stored", "match_score": stored.get("match_score"),
+                "verdict": stored.get("verdict"), "title": stored.get("title")}
+
+    async with _batch_analyze_semaphore:
+        try:
+            listing_facts = await get_listing_facts(listing_url, include_images=False)
+            if "error" in listing_facts:
+                return {**item, "status": "error", "error": listing_facts["error"]}
+            reasons = evaluate_hard_constraints(criteria, listing_facts.get('facts') or {})
+            if reasons:
+                report = prefilter_report(listing_facts, reasons)
+            else:
+                report = await asyncio.to_thread(generate_match_report, criteria, listing_facts, "compact")
+                if "error" in report:
+                    return {**item, "status": "error", "error": report["error"]}
+        except CircuitOpenError as e:
+            return {**item, "status": "postponed", "error": str(e)}
+
+    analysis_data = _analysis_result_from_report(report, listing_url, detail="compact", criteria=criteria)
+    if reasons:
+        analysis_data['prefilter'] = {'reasons': reasons}
+    if stored:
+        await asyncio.to_thread(_update_analysis_result, user_id, listing_url, analysis_data)
+    else:
+        # Listed with the user's other analyses; the full report is generated when it is opened
+        try:
+            inserted = await asyncio.to_thread(storage.insert_processed_email, {
+                'user_id': user_id,
+                'email_message_id': f"batch:{hashlib.sha256(listing_url.encode('utf-8')).hexdigest()[:32]}",
+                'email_subject': "Analysed from a pasted list",
+                'email_from': next((domain for domain in PROPERTY_DOMAINS if domain in listing_url.lower()), None),
+                'listing_url': listing_url,
+                'analysis_result': analysis_data,
+                **_analysis_summary_columns(analysis_data),
+            })
+            item["id"] = inserted.get("id")
+            _notify_analysis_change(user_id)
+        except Exception as e:
+            # Unique (user_id, email_message_id): a concurrent batch with the same URL inserted it first
+            updated = await asyncio.to_thread(_update_analysis_result, user_id, listing_url, analysis_data)
+            if not updated:
+                raise
+            logging.debug(f"Batch analysis of {listing_url} already inserted, updated instead: {str(e)}")
+            item["id"] = updated[0].get("id")
+    _pipeline_stats["batch_analyses"] += 1
+    return {**item, "status": "completed", "source": "prefilter" if reasons else "analyzed",
+            "match_score": report.get('match_score'), "verdict": report.get('verdict'),
+            "title": report.get('title') or listing_facts.get('title')}
+
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(request: BatchAnalyzeRequest, http_request: Request, format: Optional[str] = None,
+                        user_id: str = Depends(verify_token)):
+    """
+    Analyze many listing URLs against the saved criteria. Results are streamed in completion order as NDJSON
+    (default) or server-sent events (format=sse or Accept: text/event-stream), followed by a summary ranked by score.
+    """
+    _require_storage()
+    if len(request.urls) > BATCH_ANALYZE_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_ANALYZE_MAX_URLS} URLs per batch")
+
+    # Canonicalize (resolving click-tracking links) and dedupe, keeping the order they were pasted in
+    invalid = []
+    canonical = []
+    tracking = [url.strip() for url in request.urls if SENDGRID_CLICK_RE.search(url)]
+    resolved = dict(zip(tracking, await asyncio.to_thread(resolve_tracking_urls, tracking))) if tracking else {}
+    for url in request.urls:
+        listing_url = resolved.get(url.strip()) if SENDGRID_CLICK_RE.search(url) else url
+        listing_url = canonical_listing_url(listing_url) if listing_url else None
+        if listing_url and _is_listing_url(listing_url):
+            canonical.append(listing_url)
+        else:
+            invalid.append(url)
+    listing_urls = list(dict.fromkeys(canonical))
+
+    saved = await asyncio.to_thread(storage.get_criteria, user_id)
+    criteria = _scoring_criteria(saved) if saved else {}
+    stored = {row["listing_url"]: row for row in await asyncio.to_thread(storage.analyses_for_urls, user_id, listing_urls)}
+
+    sse = format == "sse" or (format is None and "text/event-stream" in http_request.headers.get("accept", ""))
+
+    def encode(event: str, data: dict) -> str:
+        if sse:
+            return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        return json.dumps({"type": event, **data}, default=str) + "\n"
+
+    async def analyze(listing_url: str) -> dict:
+        try:
+            return await _batch_analyze_url(user_id, listing_url, criteria, stored.get(listing_url))
+        except Exception as e:
+            # Still reported, so every accepted URL gets a result and is counted in the summary
+            logging.error(f"Batch analysis of {listing_url} failed: {str(e)}", exc_info=True)
+            return {"url": listing_url, "status": "error", "error": str(e)}
+
+    async def stream():
+        yield encode("accepted", {"urls": listing_urls, "duplicates": len(canonical) - len(listing_urls), "invalid": invalid})
+        tasks = [asyncio.create_task(analyze(url)) for url in listing_urls]
+        results = []
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                results.append(result)
+                yield encode("result", result)
+            ranked = sorted(
+                (result for result in results if result["status"] == "completed"),
+                key=lambda result: result.get("match_score") if isinstance(result.get("match_score"), (int, float)) else -1,
+                reverse=True,
+            )
+            yield encode("summary", {
+                "ranked": ranked,
+                "counts": dict(Counter(result["status"] for result in results)),
+            })
+        finally:
+            # Client went away: analyses not started yet are dropped (finished ones are already stored)
+            for task in tasks:
+                task.cancel()
+
+    # Content-Encoding is set so the compression middleware passes the stream through instead of buffering it
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Content-Encoding": "identity", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Static HTML pages cached in memory: path -> (mtime, bytes). Re-read only when the file changes on disk.
+_static_page_cache: dict[str, tuple[float, bytes]] = {}
+
+
+def _read_static_page(path: str) -> bytes:
+    """Return the bytes of a static page from the in-memory cache."""
+    mtime = os.path.getmtime(path)
+    cached = _static_page_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        content = f.read()
+    _static_page_cache[path] = (mtime, content)
+    return content
 
 
 @app.get("/profile", response_class=HTMLResponse)
-async def read_profile():
+async def read_profile(request: Request):
     """Serve the profile page"""
-    with open("static/profile.html", "r") as f:
-        return f.read()
+    return _conditional_response(request, _read_static_page("static/profile.html"), "text/html; charset=utf-8", cache_control="no-cache")
 
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
+async def read_root(request: Request):
     """Serve the main HTML page"""
-    with open("static/index.html", "r") as f:
-        return f.read()
+    return _conditional_response(request, _read_static_page("static/index.html"), "text/html; charset=utf-8", cache_control="no-cache")
 
 @app.head("/")
 async def head_root():
@@ -1910,8 +4762,14 @@ async def health():
             "firecrawl_configured": bool(os.getenv("FIRECRAWL_API_KEY")),
             "supabase_configured": bool(SUPABASE_URL and SUPABASE_KEY),
             "jwt_configured": bool(JWT_SECRET),
+            "storage": type(storage).__name__ if storage else None,
         },
         "missing": missing,
+        "pipeline": dict(_pipeline_stats),
+        "models": model_stats_summary(),
+        "circuit_breakers": {name: breaker.snapshot() for name, breaker in _circuit_breakers.items()},
+        "deferred_analyses": len(_deferred_analyses),
+        "criteria_index_users": len(criteria_index),
     }
 
 @app.head("/health")
@@ -1928,14 +4786,14 @@ async def periodic_email_check():
     """Background task to periodically check emails for all users with monitoring enabled"""
     while True:
         try:
+            await retry_deferred_analyses()
+            
             # Get all users with email monitoring enabled
-            # Supabase client calls are synchronous; run them in a thread to avoid blocking the event loop (especially during startup).
-            response = await asyncio.to_thread(
-                lambda: supabase_admin.table("user_criteria").select("*").eq("email_monitoring_enabled", True).execute()
-            )
+            # Storage calls are synchronous; run them in a thread to avoid blocking the event loop (especially during startup).
+            monitoring = await asyncio.to_thread(storage.monitoring_criteria)
             
-            if response.data:
-                for user_criteria in response.data:
+            if monitoring:
+                for user_criteria in monitoring:
                     user_id = user_criteria.get('user_id')
                     email_address = user_criteria.get('monitor_email')
                     app_password = user_criteria.get('email_app_password')
@@ -1957,14 +4815,28 @@ async def periodic_email_check():
             await asyncio.sleep(60)  # Wait 1 minute on error
 
 
+async def _load_criteria_index_on_startup():
+    try:
+        count = await asyncio.to_thread(load_criteria_index)
+        logger.info(f"Criteria index loaded ({count} monitoring users)")
+    except Exception as e:
+        logger.error(f"Could not load criteria index: {str(e)}")
+
+
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks on application startup"""
-    if supabase_admin:
+    global _event_loop
+    _event_loop = asyncio.get_running_loop()
+    if storage:
         asyncio.create_task(periodic_email_check())
+        asyncio.create_task(_load_criteria_index_on_startup())
+        if LISTING_REFRESH_ENABLED and supabase_admin:
+            asyncio.create_task(periodic_listing_refresh())
+            logger.info("Listing refresh background task started")
         logger.info("Email monitoring background task started")
     else:
-        logger.warning("Email monitoring background task NOT started (Supabase not configured).")
+        logger.warning("Email monitoring background task NOT started (no storage configured).")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""
+Benchmark for the reverse criteria index (criteria_index in app.py) used to fan a listing out to every
+monitoring user whose criteria it fits.
+
+    python benchmarks/bench_criteria_index.py                 # 100k synthetic users, 2000 listings
+    python benchmarks/bench_criteria_index.py --users 10000
+
+Measures build time, lookup latency (p50/p99) and incremental updates, and checks every lookup against a
+brute-force scan (evaluate_hard_constraints plus a plain-text location check, written independently of the
+index's location keys) over all users.
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import (  # noqa: E402
+    KNOWN_PLACES, LOCATION_ALIASES, LOCATION_MAX_POSTAL_RANGE, CriteriaIndex, evaluate_hard_constraints,
+)
+
+# (postal code, city, weight): demand is concentrated in the larger cities
+PLACES = [
+    ("8001", "Zürich", 6), ("8004", "Zürich", 6), ("8005", "Zürich", 5), ("8037", "Zürich", 4), ("8050", "Zürich", 4),
+    ("8400", "Winterthur", 3), ("1201", "Genève", 4), ("1205", "Genève", 3), ("1003", "Lausanne", 3),
+    ("3011", "Bern", 3), ("4051", "Basel", 3), ("6003", "Luzern", 2), ("6900", "Lugano", 2), ("9000", "St. Gallen", 2),
+    ("8700", "Küsnacht", 1), ("8610", "Uster", 1), ("5400", "Baden", 1), ("6300", "Zug", 2), ("2502", "Biel", 1),
+    ("1700", "Fribourg", 1),
+]
+# How users write their location in the profile or chat
+LOCATION_FORMATS = [
+    "{city}", "{postal}", "{city} Kreis {kreis}", "{postal} {city}", "near {city}", "{city} or {other}",
+    "{postal}-{postal_end}", "near ETH", "close to the lake",
+]
+
+
+def synthetic_users(count: int, rng: random.Random) -> list:
+    weights = [place[2] for place in PLACES]
+    users = []
+    for _ in range(count):
+        postal, city, _ = rng.choices(PLACES, weights)[0]
+        property_type = rng.choices(["rent", "buy", None], [80, 12, 8])[0]
+        min_rooms = rng.choice([None, 1, 2, 2, 2.5, 3, 3, 3.5, 4, 4, 4.5, 5])
+        max_rooms = rng.choice([None, min_rooms + 1 if min_rooms else 3, min_rooms + 1.5 if min_rooms else 4])
+        min_space = rng.choice([None, 40, 50, 60, 70, 80, 90, 100])
+        if property_type == "buy":
+            max_rent = rng.choice([None, 600000, 800000, 1000000, 1500000])
+        else:
+            max_rent = rng.choice([None, 1500, 1800, 2000, 2200, 2500, 2800, 3000, 3500, 4500])
+        location = rng.choice(LOCATION_FORMATS) if rng.random() > 0.03 else None
+        if location:
+            location = location.format(city=city, postal=postal, postal_end=int(postal) + rng.choice([9, 50, 500]),
+                                       kreis=rng.randint(1, 12), other=rng.choices(PLACES, weights)[0][1])
+        users.append({
+            "user_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "property_type": property_type,
+            "location": location,
+            "min_rooms": min_rooms,
+            "max_rooms": max_rooms,
+            "min_living_space": min_space,
+            "max_living_space": rng.choice([None, None, None, 120, 150]),
+            "max_rent": max_rent,
+            "email_monitoring_enabled": True,
+        })
+    return users
+
+
+def synthetic_listings(count: int, rng: random.Random) -> list:
+    weights = [place[2] for place in PLACES]
+    listings = []
+    for _ in range(count):
+        postal, city, _ = rng.choices(PLACES, weights)[0]
+        listing_type = rng.choices(["rent", "buy"], [85, 15])[0]
+        rooms = rng.choice([1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5.5, 6.5])
+        listings.append({
+            "listing_type": listing_type,
+            "postal_code": postal if rng.random() > 0.05 else None,
+            "city": city,
+            "rooms": rooms if rng.random() > 0.05 else None,
+            "living_space_m2": round(rooms * rng.uniform(18, 30)) if rng.random() > 0.1 else None,
+            "price_chf": (round(rooms * rng.uniform(600, 1100), -1) if listing_type == "rent" else round(rooms * rng.uniform(150000, 300000), -4)) if rng.random() > 0.05 else None,
+        })
+    return listings
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().replace("ß", "ss"))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def location_fits(location, facts: dict) -> bool:
+    """
+    Reference location rule: a user location that names postal codes (or a range of them) or known places fits
+    a listing that shares one of them; a location naming none of them, or a listing without a location, fits.
+    """
+    if not location or not (facts.get("postal_code") or facts.get("city")):
+        return True
+    text = _normalize(location)
+    codes = set()
+    for start, end in re.findall(r"(\d{4})\s*(?:-|–|to|bis|a)\s*(\d{4})", text):
+        if int(end) - int(start) <= LOCATION_MAX_POSTAL_RANGE:
+            codes.update(str(code) for code in range(int(start), int(end) + 1))
+    text = re.sub(r"\d{4}\s*(?:-|–|to|bis|a)\s*\d{4}", " ", text)
+    codes.update(re.findall(r"\d{4}", text))
+    places = {LOCATION_ALIASES.get(word, word) for word in re.findall(r"[a-z]+", text)} & KNOWN_PLACES
+    if not codes and not places:
+        return True
+    listing_places = {LOCATION_ALIASES.get(word, word) for word in re.findall(r"[a-z]+", _normalize(facts.get("city") or ""))}
+    return str(facts.get("postal_code")) in codes or bool(places & listing_places)
+
+
+def brute_force(users: list, facts: dict) -> set:
+    """Reference: every user without a deal-breaker whose location fits the listing"""
+    return {
+        user["user_id"] for user in users
+        if not evaluate_hard_constraints(user, facts) and location_fits(user.get("location"), facts)
+    }
+
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--verify", type=int, default=50, help="lookups to check against the brute-force scan")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(42)
+    users = synthetic_users(args.users, rng)
+    listings = synthetic_listings(args.listings, rng)
+
+    index = CriteriaIndex()
+    started = time.perf_counter()
+    index.rebuild(users)
+    print(f"Build: {len(index)} users in {time.perf_counter() - started:.2f} s")
+
+    # A listing that does not state its price or size fits far more users (unknown values never exclude),
+    # and a lookup costs about one microsecond per returned user: report complete listings separately
+    for label, selected in (
+        ("all listings", listings),
+        ("price, rooms and space known", [f for f in listings if None not in (f["price_chf"], f["rooms"], f["living_space_m2"])]),
+    ):
+        latencies = []
+        candidates = []
+        for facts in selected:
+            started = time.perf_counter()
+            result = index.match(facts)
+            latencies.append((time.perf_counter() - started) * 1000)
+            candidates.append(len(result))
+        print(f"Lookup ({label}, {len(selected)}): p50 {percentile(latencies, 0.5):.3f} ms  p99 {percentile(latencies, 0.99):.3f} ms  "
+              f"max {max(latencies):.3f} ms  (candidate users per listing: median {percentile(candidates, 0.5)}, p99 {percentile(candidates, 0.99)})")
+
+    mismatches = 0
+    for facts in listings[:args.verify]:
+        if set(index.match(facts)) != brute_force(users, facts):
+            mismatches += 1
+    started = time.perf_counter()
+    brute_force(users, listings[0])
+    print(f"Brute-force scan: {(time.perf_counter() - started) * 1000:.1f} ms per listing; "
+          f"lookups that disagree with it: {mismatches}/{min(args.verify, len(listings))}")
+
+    # Incremental updates: users editing their criteria
+    updates = synthetic_users(1000, random.Random(7))
+    started = time.perf_counter()
+    for user, update in zip(users, updates):
+        update["user_id"] = user["user_id"]
+        index.upsert(update)
+    print(f"Update: {(time.perf_counter() - started) / len(updates) * 1000:.3f} ms per criteria write")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Micro-benchmark for extract_urls_from_email_body (the CPU hot spot of email polling).
+
+Compares the single-pass extractor in app.py with the previous implementation (BeautifulSoup parse plus
+three regex passes and a line scan) on a corpus of alert emails, and checks that both find the same listings.
+
+    python benchmarks/bench_extract_urls.py                      # synthetic Homegate/ImmoScout24/Flatfox alerts
+    python benchmarks/bench_extract_urls.py --corpus path/to/eml # real alert emails (*.eml, *.html, *.txt)
+
+The synthetic corpus mirrors the structure of real alert emails: table-based HTML with inline styles,
+tracking pixels, listing cards with several links each, and footer links to guides and alert settings.
+"""
+import argparse
+import email
+import html
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import extract_urls_from_email_body  # noqa: E402
+
+
+def legacy_extract_urls(body: str) -> list:
+    """extract_urls_from_email_body before the single-pass rewrite (tracking-link resolution left out: no network)"""
+    urls = []
+    property_domains = ("homegate.ch", "immoscout24.ch", "flatfox.ch")
+    homegate_listing_re = re.compile(r"^https?://(?:www\.)?homegate\.ch/(?:rent|buy)/\d+", re.IGNORECASE)
+    try:
+        soup = BeautifulSoup(body, 'html.parser')
+        for link in soup.find_all('a', href=True):
+            href = link['href']
+            if href and ('homegate.ch' in href.lower() or 'immoscout24.ch' in href.lower() or 'flatfox.ch' in href.lower()):
+                urls.append(href)
+    except Exception:
+        pass
+    url_pattern = r'https?://[^\s<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s<>"]*'
+    urls.extend(re.findall(url_pattern, body, re.IGNORECASE))
+    for line in body.split('\n'):
+        line = line.strip()
+        if 'http' in line.lower() and any(domain in line.lower() for domain in property_domains):
+            url_match = re.search(r'(https?://[^\s<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s<>"]*)', line, re.IGNORECASE)
+            if url_match:
+                urls.append(url_match.group(1).strip())
+    simple_pattern = r'https?://[^\s\n<>"]*(?:homegate\.ch|immoscout24\.ch|flatfox\.ch)[^\s\n<>"]*'
+    urls.extend(re.findall(simple_pattern, body, re.IGNORECASE | re.MULTILINE))
+    unique_urls = []
+    seen = set()
+    for url in urls:
+        url = url.strip().rstrip('/')
+        if "homegate.ch" in url.lower() and not homegate_listing_re.match(url):
+            continue
+        if url and url not in seen and (url.startswith('http://') or url.startswith('https://')):
+            unique_urls.append(url)
+            seen.add(url)
+    return unique_urls
+
+
+def _listing_card(rng: random.Random, portal: str) -> str:
+    listing_id = rng.randint(3000000000, 4999999999)
+    if portal == "homegate":
+        url = f"https://www.homegate.ch/rent/{listing_id}"
+    elif portal == "immoscout24":
+        url = f"https://www.immoscout24.ch/rent/{listing_id}"
+    else:
+        url = f"https://flatfox.ch/en/flat/zurich-{listing_id}/"
+    rooms = rng.choice(["2.5", "3", "3.5", "4.5"])
+    price = rng.randint(18, 45) * 100
+    image = f"https://media2.homegate.ch/t_web_dp_small/listings/{listing_id}/image/{rng.getrandbits(64):x}.jpg"
+    return f"""
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="border-collapse:collapse;margin:0 0 16px 0;background:#ffffff;border:1px solid #e5e5e5;">
+  <tr>
+    <td style="padding:0;"><a href="{url}/" target="_blank" style="text-decoration:none;"><img src="{image}" width="560" alt="Listing photo" style="display:block;border:0;width:100%;max-width:560px;"></a></td>
+  </tr>
+  <tr>
+    <td style="padding:12px 16px;font-family:Arial,Helvetica,sans-serif;font-size:14px;line-height:20px;color:#333333;">
+      <a href="{url}" style="color:#e5007d;font-weight:bold;text-decoration:none;">{rooms} rooms, CHF {price}.&ndash; per month</a><br>
+      Seestrasse {rng.randint(1, 200)}, 80{rng.randint(0, 99):02d} Z&uuml;rich<br>
+      <span style="color:#666666;">Available from {rng.randint(1, 28)}.{rng.randint(1, 12)}.2026</span>
+    </td>
+  </tr>
+  <tr>
+    <td style="padding:0 16px 16px 16px;"><a href="{url}?utm_source=alert&amp;utm_medium=email&amp;utm_campaign=match" style="display:inline-block;padding:8px 16px;background:#e5007d;color:#ffffff;text-decoration:none;border-radius:4px;">View listing</a></td>
+  </tr>
+</table>"""
+
+
+def synthetic_corpus(count: int = 200, seed: int = 42) -> list:
+    """Alert emails shaped like the portals' HTML and plain-text alerts (deterministic)"""
+    rng = random.Random(seed)
+    style = "".join(f".c{i}{{margin:{i}px;padding:{i % 7}px;color:#{rng.getrandbits(24):06x};}}\n" for i in range(300))
+    footer = """
+<p style="font-size:11px;color:#999999;">
+  <a href="https://www.homegate.ch/en/municipality-guide/zurich">Municipality guide</a> |
+  <a href="https://www.homegate.ch/c/en/alerts/cancel?token=abc123&amp;lang=en">Cancel this alert</a> |
+  <a href="https://www.homegate.ch/c/en/privacy">Privacy</a>
+</p>
+<img src="https://u1234567.ct.sendgrid.net/wf/open?upn=tracking-pixel" width="1" height="1" alt="">"""
+    corpus = []
+    for idx in range(count):
+        portal = ("homegate", "immoscout24", "flatfox")[idx % 3]
+        cards = [_listing_card(rng, portal) for _ in range(rng.randint(3, 12))]
+        if idx % 5 == 4:
+            # Plain-text alert: one URL per line
+            text = "\n\n".join(
+                f"{rng.choice(['2.5', '3.5', '4.5'])} rooms, CHF {rng.randint(18, 45) * 100}.-\n  "
+                + re.search(r'href="([^"]+)"', card).group(1)
+                for card in cards
+            )
+            corpus.append(f"New listings matching your search\n\n{text}\n\nCancel alert: https://www.homegate.ch/c/en/alerts/cancel?token=abc\n")
+        else:
+            corpus.append(
+                f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>{style}</style></head>"
+                f"<body style=\"margin:0;padding:0;background:#f4f4f4;\"><center><table width=\"600\"><tr><td>"
+                f"<h1 style=\"font-family:Arial;\">{len(cards)} new listings match your search</h1>"
+                f"{''.join(cards)}{footer}</td></tr></table></center></body></html>"
+            )
+    return corpus
+
+
+def load_corpus(directory: str) -> list:
+    """Email bodies from *.eml (plain text part preferred, like check_email_for_listings), *.html and *.txt files"""
+    bodies = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".eml"):
+            with open(path, "rb") as f:
+                message = email.message_from_bytes(f.read())
+            parts = {"text/plain": "", "text/html": ""}
+            for part in message.walk():
+                if part.get_content_type() in parts:
+                    payload = part.get_payload(decode=True)
+                    if payload:
+                        parts[part.get_content_type()] += payload.decode("utf-8", errors="ignore")
+            bodies.append(parts["text/plain"] or parts["text/html"])
+        elif name.endswith((".html", ".txt")):
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                bodies.append(f.read())
+    return bodies
+
+
+def bench(function, corpus: list, repeat: int) -> float:
+    """Best-of-repeat wall time (seconds) for one pass over the corpus"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in corpus:
+            function(body)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory with alert emails (*.eml, *.html, *.txt)")
+    parser.add_argument("--count", type=int, default=200, help="synthetic emails to generate")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # The extractor logs every result; keep logging out of the measurement
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.count)
+    total_bytes = sum(len(body) for body in corpus)
+    print(f"Corpus: {len(corpus)} emails, {total_bytes / 1024 / 1024:.1f} MiB")
+
+    # The legacy extractor also returned the raw "&amp;" form of every href it found in the text scan
+    # (a second, broken copy of the same link); compare entity-decoded URLs
+    mismatches = 0
+    for body in corpus:
+        if set(extract_urls_from_email_body(body)) != {html.unescape(url) for url in legacy_extract_urls(body)}:
+            mismatches += 1
+    print(f"Emails where the extractors disagree: {mismatches}")
+
+    legacy = bench(legacy_extract_urls, corpus, args.repeat)
+    current = bench(extract_urls_from_email_body, corpus, args.repeat)
+    print(f"legacy (bs4 + 3 regex passes + line scan): {legacy * 1000:8.1f} ms  {total_bytes / legacy / 1024 / 1024:7.1f} MiB/s")
+    print(f"single pass (app.py):                      {current * 1000:8.1f} ms  {total_bytes / current / 1024 / 1024:7.1f} MiB/s")
+    print(f"speedup: {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Local stand-in for a mail-forwarding service: pushes alert emails to REPA's POST /api/inbound-email.
+
+    python inbound_email_relay.py --to alerts@example.com alert1.eml alert2.eml   # post saved emails (raw RFC822)
+    python inbound_email_relay.py --smtp 2525             # SMTP relay on localhost:2525 (needs aiosmtpd)
+
+The app routes emails by their envelope recipients only, so saved emails are posted with the --to addresses.
+With --smtp, point a test mailer (or a forwarding rule of a local mail server) at the port; every message
+received is posted with its envelope recipients. Environment:
+- INBOUND_EMAIL_URL: webhook URL (default http://localhost:8000/api/inbound-email)
+- INBOUND_EMAIL_SECRET: the shared secret configured for the app
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import requests
+
+INBOUND_EMAIL_URL = os.getenv("INBOUND_EMAIL_URL", "http://localhost:8000/api/inbound-email")
+INBOUND_EMAIL_SECRET = os.getenv("INBOUND_EMAIL_SECRET", "")
+
+
+def post_email(raw: bytes, recipients: list = None) -> None:
+    """Post one raw RFC822 message to the webhook"""
+    params = {"to": ",".join(recipients)} if recipients else None
+    response = requests.post(
+        INBOUND_EMAIL_URL,
+        data=raw,
+        params=params,
+        headers={"Content-Type": "message/rfc822", "X-Inbound-Secret": INBOUND_EMAIL_SECRET},
+        timeout=30,
+    )
+    print(f"{response.status_code} {response.text}")
+
+
+class RelayHandler:
+    """aiosmtpd handler: accept every message and post it to the webhook"""
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.to_thread(post_email, envelope.original_content or envelope.content, envelope.rcpt_tos)
+        return "250 Message accepted for delivery"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="saved emails (*.eml) to post")
+    parser.add_argument("--to", action="append", default=[], metavar="ADDRESS", help="envelope recipient of the saved emails (repeatable)")
+    parser.add_argument("--smtp", type=int, metavar="PORT", help="run an SMTP relay on this port")
+    args = parser.parse_args()
+
+    for path in args.files:
+        with open(path, "rb") as f:
+            post_email(f.read(), args.to)
+
+    if args.smtp:
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            sys.exit("--smtp needs the aiosmtpd package (pip install aiosmtpd)")
+        controller = Controller(RelayHandler(), hostname="127.0.0.1", port=args.smtp)
+        controller.start()
+        print(f"SMTP relay on 127.0.0.1:{args.smtp} -> {INBOUND_EMAIL_URL} (Ctrl+C to stop)")
+        try:
+            asyncio.run(asyncio.Event().wait())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            controller.stop()
+    elif not args.files:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
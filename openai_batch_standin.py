@@ -0,0 +1,152 @@
+"""
+Local stand-in for the OpenAI Files/Batches/Chat Completions endpoints used by REPA's batch mode.
+
+Lets the batch pipeline (ANALYSIS_BATCH_MODE) be exercised without an OpenAI account or a 24h batch window:
+
+    uvicorn openai_batch_standin:app --port 8001
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=test ANALYSIS_BATCH_MODE=true python app.py
+
+Responses are canned: requests with a json_schema response_format get a minimal object that satisfies
+the schema, json_object requests get "{}", everything else a short text. Environment:
+- STANDIN_BATCH_DELAY_SECONDS: how long a batch stays "in_progress" (default 0)
+- STANDIN_BATCH_NEVER_COMPLETE: "true" keeps batches in progress forever (to test the sync fallback)
+"""
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile
+from fastapi.responses import PlainTextResponse
+import os
+import json
+import time
+import uuid
+
+STANDIN_BATCH_DELAY_SECONDS = float(os.getenv("STANDIN_BATCH_DELAY_SECONDS", "0"))
+STANDIN_BATCH_NEVER_COMPLETE = os.getenv("STANDIN_BATCH_NEVER_COMPLETE", "false").lower() == "true"
+
+app = FastAPI(title="OpenAI batch stand-in")
+
+_files: dict = {}  # file id -> {"purpose", "content"}
+_batches: dict = {}  # batch id -> batch object
+
+
+def _sample_from_schema(schema: dict):
+    """Smallest value that satisfies a (strict structured outputs) JSON schema"""
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return _sample_from_schema(schema["anyOf"][-1])
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {key: _sample_from_schema(value) for key, value in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [_sample_from_schema(schema["items"])] if "items" in schema else []
+    if schema_type == "integer":
+        return 50
+    if schema_type == "number":
+        return 0
+    if schema_type == "boolean":
+        return True
+    if schema_type == "null":
+        return None
+    return "Stand-in value"
+
+
+def _chat_completion(body: dict) -> dict:
+    """Canned chat-completions response body for a request body"""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps(_sample_from_schema(response_format["json_schema"]["schema"]))
+    elif response_format.get("type") == "json_object":
+        content = "{}"
+    else:
+        content = "Stand-in response."
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stand-in"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _run_batch(batch: dict) -> None:
+    """Execute every line of the batch input file and store the output file"""
+    output = []
+    for line in _files[batch["input_file_id"]]["content"].splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        output.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _chat_completion(request["body"])},
+            "error": None,
+        }))
+    output_file_id = f"file-{uuid.uuid4().hex}"
+    _files[output_file_id] = {"purpose": "batch_output", "content": "\n".join(output) + "\n"}
+    batch.update({
+        "status": "completed",
+        "output_file_id": output_file_id,
+        "completed_at": int(time.time()),
+        "request_counts": {"total": len(output), "completed": len(output), "failed": 0},
+    })
+
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    file_id = f"file-{uuid.uuid4().hex}"
+    content = (await file.read()).decode("utf-8")
+    _files[file_id] = {"purpose": purpose, "content": content}
+    return {"id": file_id, "object": "file", "bytes": len(content), "filename": file.filename, "purpose": purpose}
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in _files:
+        raise HTTPException(status_code=404, detail="File not found")
+    return PlainTextResponse(_files[file_id]["content"])
+
+
+@app.post("/v1/batches")
+async def create_batch(request: dict):
+    if request.get("input_file_id") not in _files:
+        raise HTTPException(status_code=400, detail="Unknown input_file_id")
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    _batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": request.get("endpoint"),
+        "input_file_id": request["input_file_id"],
+        "completion_window": request.get("completion_window", "24h"),
+        "status": "in_progress",
+        "output_file_id": None,
+        "created_at": int(time.time()),
+    }
+    return _batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = _batches.get(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    ready = time.time() - batch["created_at"] >= STANDIN_BATCH_DELAY_SECONDS
+    if batch["status"] == "in_progress" and ready and not STANDIN_BATCH_NEVER_COMPLETE:
+        _run_batch(batch)
+    return batch
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    batch = _batches.get(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if batch["status"] == "in_progress":
+        batch["status"] = "cancelled"
+    return batch
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: dict):
+    return _chat_completion(request)
@@ -0,0 +1,762 @@
+"""
+Storage backends for REPA's data: user criteria, processed emails (one row per analysed listing and user,
+with its analysis result) and the shared listing facts.
+
+- SupabaseStorage: the hosted Postgres tables (supabase_schema*.sql), through the service-role client
+- SQLiteStorage: an embedded SQLite database (WAL mode) for single-node deployments, offline development
+  and benchmarks; full-text search uses FTS5
+
+app.py selects the backend with STORAGE_BACKEND (supabase | sqlite). Both return plain dicts shaped like
+the Supabase rows, so callers do not depend on the backend.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Sequence, Tuple
+
+# Summary columns of processed_emails (no report body); used by the analyses list and change feed
+ANALYSIS_SUMMARY_COLUMNS = "id, listing_url, email_subject, email_from, processed_at, match_score, score_rank, analysis_status, analysis_error"
+# Columns of the user_listings search results
+USER_LISTINGS_COLUMNS = (
+    "id, listing_url, title, listing_type, price_chf, additional_costs_chf, rooms, living_space_m2, postal_code, city, "
+    "features, listing_image_url, match_score, analysis_status, processed_at"
+)
+# Filter operators accepted by search_listings: ieq is a case-insensitive equality
+SEARCH_OPERATORS = ("eq", "ieq", "gte", "lte")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Storage(ABC):
+    """
+    Data access used by app.py. Methods are synchronous (callers on the event loop use asyncio.to_thread).
+    Abstract: a backend missing a method fails when it is created, not at first use.
+    """
+
+    name = ""
+
+    # User criteria (one row per user)
+    @abstractmethod
+    def get_criteria(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def criteria_for_users(self, user_ids: Sequence[str], monitoring_only: bool = False) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def criteria_by_monitor_email(self, addresses: Sequence[str]) -> List[dict]:
+        """Monitoring users whose monitor_email is one of the addresses (exact match)"""
+
+    @abstractmethod
+    def monitoring_criteria(self) -> List[dict]:
+        """Criteria of every user with email monitoring enabled"""
+
+    @abstractmethod
+    def insert_criteria(self, data: dict) -> Optional[dict]:
+        """Insert the user's criteria; returns the stored row"""
+
+    @abstractmethod
+    def update_criteria(self, user_id: str, data: dict) -> Optional[dict]:
+        """Update the user's criteria; returns the updated row, None if the user has none"""
+
+    # Processed emails and analyses
+    @abstractmethod
+    def email_processed(self, user_id: str, message_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def insert_processed_email(self, row: dict) -> dict:
+        """Insert a processed_emails row; raises if (user_id, email_message_id) exists"""
+
+    @abstractmethod
+    def update_analysis(self, user_id: str, listing_url: str, data: dict) -> List[dict]:
+        """Update analysis_result and its summary columns; returns the updated rows (id only)"""
+
+    @abstractmethod
+    def find_analysis(self, user_id: str, listing_url: str, status: Optional[str] = None) -> Optional[dict]:
+        """The user's row for a listing (with the given analysis_status, if set): id, analysis_status, analysis_result"""
+
+    @abstractmethod
+    def get_analysis(self, user_id: str, analysis_id: str) -> Optional[dict]:
+        """Summary columns plus analysis_result of one of the user's analyses"""
+
+    @abstractmethod
+    def users_with_listing(self, listing_url: str, user_ids: Optional[Sequence[str]] = None, status: Optional[str] = None) -> List[str]:
+        ...
+
+    @abstractmethod
+    def analyses_for_urls(self, user_id: str, listing_urls: Sequence[str]) -> List[dict]:
+        """Summary of the user's analyses of these listings, with criteria_hash, verdict and title from the result"""
+
+    @abstractmethod
+    def completed_analysis_keys(self, user_id: str) -> List[dict]:
+        """id, listing_url, criteria_hash and duplicate_of of the user's completed analyses (no report bodies)"""
+
+    @abstractmethod
+    def ranked_analyses(self, user_id: str, limit: int, after: Optional[Tuple[int, str, str]] = None) -> List[dict]:
+        """Completed analyses by (score_rank, processed_at, id) descending, after the given keyset position"""
+
+    @abstractmethod
+    def pending_analyses(self, user_id: str, statuses: Sequence[str] = ("pending",), limit: int = 100) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def analysis_changes(self, user_id: str, after: Tuple[str, str], until: str, limit: int = 100) -> List[dict]:
+        """Summaries (with updated_at) of the user's analyses by (updated_at, id) after the keyset position, up to until"""
+
+    # Listing facts (shared by all users)
+    @abstractmethod
+    def get_listing_facts(self, listing_url: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def listing_facts_for(self, listing_urls: Sequence[str]) -> List[dict]:
+        """listing_url, title, facts and image_analysis of the listings (without the scraped content)"""
+
+    @abstractmethod
+    def listing_facts_since(self, since: str) -> List[dict]:
+        """listing_url, facts and image_analysis of the listings first analysed after the given time"""
+
+    @abstractmethod
+    def save_listing_facts(self, row: dict) -> None:
+        """Upsert a listing_facts row (keyed by listing_url)"""
+
+    @abstractmethod
+    def search_listings(
+        self,
+        user_id: str,
+        filters: Sequence[Tuple[str, str, Any]],
+        features: Sequence[str],
+        query: Optional[str],
+        sort: Tuple[str, bool],
+        limit: int,
+        offset: int,
+    ) -> List[dict]:
+        """
+        The user's analysed listings with their typed facts (USER_LISTINGS_COLUMNS). filters are
+        (column, operator, value) with SEARCH_OPERATORS; features must all be present; query is a full-text
+        query (web search syntax) over the listing text and the user's report; sort is (column, descending),
+        NULLs last.
+        """
+
+
+class SupabaseStorage(Storage):
+    """The Supabase (PostgREST) tables, through the service-role client"""
+
+    name = "supabase"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_criteria(self, user_id: str) -> Optional[dict]:
+        response = self.client.table("user_criteria").select("*").eq("user_id", user_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def criteria_for_users(self, user_ids: Sequence[str], monitoring_only: bool = False) -> List[dict]:
+        rows = []
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), 200):
+            query = self.client.table("user_criteria").select("*").in_("user_id", user_ids[start:start + 200])
+            if monitoring_only:
+                query = query.eq("email_monitoring_enabled", True)
+            rows.extend(query.execute().data or [])
+        return rows
+
+    def criteria_by_monitor_email(self, addresses: Sequence[str]) -> List[dict]:
+        response = self.client.table("user_criteria").select("*").in_("monitor_email", list(addresses)).eq("email_monitoring_enabled", True).execute()
+        return response.data or []
+
+    def monitoring_criteria(self) -> List[dict]:
+        page_size = 1000
+        rows = []
+        while True:
+            page = self.client.table("user_criteria").select("*").eq("email_monitoring_enabled", True).order("user_id").range(
+                len(rows), len(rows) + page_size - 1
+            ).execute().data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+    def insert_criteria(self, data: dict) -> Optional[dict]:
+        response = self.client.table("user_criteria").insert(data).execute()
+        return response.data[0] if response.data else None
+
+    def update_criteria(self, user_id: str, data: dict) -> Optional[dict]:
+        response = self.client.table("user_criteria").update(data).eq("user_id", user_id).execute()
+        return response.data[0] if response.data else None
+
+    def email_processed(self, user_id: str, message_id: str) -> bool:
+        response = self.client.table("processed_emails").select("id").eq("user_id", user_id).eq("email_message_id", message_id).limit(1).execute()
+        return bool(response.data)
+
+    def insert_processed_email(self, row: dict) -> dict:
+        response = self.client.table("processed_emails").insert(row).execute()
+        return response.data[0] if response.data else {}
+
+    def update_analysis(self, user_id: str, listing_url: str, data: dict) -> List[dict]:
+        response = self.client.table("processed_emails").update(data).eq("user_id", user_id).eq("listing_url", listing_url).execute()
+        return [{"id": row["id"]} for row in response.data or []]
+
+    def find_analysis(self, user_id: str, listing_url: str, status: Optional[str] = None) -> Optional[dict]:
+        query = self.client.table("processed_emails").select("id, analysis_status, analysis_result").eq("user_id", user_id).eq("listing_url", listing_url)
+        if status:
+            query = query.eq("analysis_status", status)
+        response = query.limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def get_analysis(self, user_id: str, analysis_id: str) -> Optional[dict]:
+        response = self.client.table("processed_emails").select(f"{ANALYSIS_SUMMARY_COLUMNS}, analysis_result").eq("id", analysis_id).eq("user_id", user_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def users_with_listing(self, listing_url: str, user_ids: Optional[Sequence[str]] = None, status: Optional[str] = None) -> List[str]:
+        chunks = [list(user_ids)[start:start + 200] for start in range(0, len(user_ids), 200)] if user_ids is not None else [None]
+        found = []
+        for chunk in chunks:
+            query = self.client.table("processed_emails").select("user_id").eq("listing_url", listing_url)
+            if chunk is not None:
+                query = query.in_("user_id", chunk)
+            if status:
+                query = query.eq("analysis_status", status)
+            found.extend(str(row["user_id"]) for row in query.execute().data or [])
+        return list(dict.fromkeys(found))
+
+    def analyses_for_urls(self, user_id: str, listing_urls: Sequence[str]) -> List[dict]:
+        rows = []
+        listing_urls = list(listing_urls)
+        for start in range(0, len(listing_urls), 100):
+            rows.extend(self.client.table("processed_emails").select(
+                "id, listing_url, analysis_status, match_score, criteria_hash:analysis_result->>criteria_hash, "
+                "verdict:analysis_result->>verdict, title:analysis_result->structured->>title"
+            ).eq("user_id", user_id).in_("listing_url", listing_urls[start:start + 100]).execute().data or [])
+        return rows
+
+    def completed_analysis_keys(self, user_id: str) -> List[dict]:
+        return self.client.table("processed_emails").select(
+            "id, listing_url, criteria_hash:analysis_result->>criteria_hash, duplicate_of:analysis_result->duplicate_of"
+        ).eq("user_id", user_id).eq("analysis_status", "completed").execute().data or []
+
+    def ranked_analyses(self, user_id: str, limit: int, after: Optional[Tuple[int, str, str]] = None) -> List[dict]:
+        # Served by idx_processed_emails_user_ranked
+        query = self.client.table("processed_emails").select(ANALYSIS_SUMMARY_COLUMNS).eq("user_id", user_id).eq("analysis_status", "completed")
+        if after:
+            rank, processed_at, last_id = after
+            query = query.or_(
+                f'score_rank.lt.{rank},'
+                f'and(score_rank.eq.{rank},processed_at.lt."{processed_at}"),'
+                f'and(score_rank.eq.{rank},processed_at.eq."{processed_at}",id.lt.{last_id})'
+            )
+        return query.order("score_rank", desc=True).order("processed_at", desc=True).order("id", desc=True).limit(limit).execute().data or []
+
+    def pending_analyses(self, user_id: str, statuses: Sequence[str] = ("pending",), limit: int = 100) -> List[dict]:
+        return self.client.table("processed_emails").select(ANALYSIS_SUMMARY_COLUMNS).eq("user_id", user_id).in_(
+            "analysis_status", list(statuses)
+        ).order("processed_at", desc=True).limit(limit).execute().data or []
+
+    def analysis_changes(self, user_id: str, after: Tuple[str, str], until: str, limit: int = 100) -> List[dict]:
+        # Served by idx_processed_emails_user_changes
+        updated_at, last_id = after
+        return self.client.table("processed_emails").select(f"{ANALYSIS_SUMMARY_COLUMNS}, updated_at").eq("user_id", user_id).or_(
+            f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt.{last_id})'
+        ).lte("updated_at", until).order("updated_at").order("id").limit(limit).execute().data or []
+
+    def get_listing_facts(self, listing_url: str) -> Optional[dict]:
+        response = self.client.table("listing_facts").select(
+            "listing_url, title, content, metadata, facts, image_analysis, computed_at"
+        ).eq("listing_url", listing_url).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def listing_facts_for(self, listing_urls: Sequence[str]) -> List[dict]:
+        rows = []
+        listing_urls = list(listing_urls)
+        for start in range(0, len(listing_urls), 100):
+            rows.extend(self.client.table("listing_facts").select("listing_url, title, facts, image_analysis").in_(
+                "listing_url", listing_urls[start:start + 100]
+            ).execute().data or [])
+        return rows
+
+    def listing_facts_since(self, since: str) -> List[dict]:
+        page_size = 1000
+        rows = []
+        while True:
+            page = self.client.table("listing_facts").select("listing_url, facts, image_analysis").gte("created_at", since).order("listing_url").range(
+                len(rows), len(rows) + page_size - 1
+            ).execute().data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+    def save_listing_facts(self, row: dict) -> None:
+        self.client.table("listing_facts").upsert(row, on_conflict="listing_url").execute()
+
+    def search_listings(self, user_id, filters, features, query, sort, limit, offset) -> List[dict]:
+        # user_listings view (supabase_schema_listing_search.sql)
+        request = self.client.table("user_listings").select(USER_LISTINGS_COLUMNS).eq("user_id", user_id)
+        for column, operator, value in filters:
+            if operator == "ieq":
+                # ILIKE without wildcards: the user's % and _ (and the escape character itself) match literally
+                request = request.ilike(column, re.sub(r"([\\%_])", r"\\\1", str(value)))
+            else:
+                request = getattr(request, operator)(column, value)
+        if features:
+            request = request.contains("features", list(features))
+        if query:
+            # Either the listing or the user's report may contain the words (both are GIN-indexed)
+            quoted = '"' + query.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            request = request.or_(f"listing_search.wfts(simple).{quoted},report_search.wfts(simple).{quoted}")
+        column, descending = sort
+        # PostgREST sorts NULLs first when descending; postgrest-py only exposes nullsfirst, so the modifier is spelled out
+        request = request.order(f"{column}.desc.nullslast" if descending else column).order("id", desc=True)
+        return request.range(offset, offset + limit - 1).execute().data or []
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_criteria (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,  -- every other column of the Supabase table, as JSON
+    email_monitoring_enabled INTEGER NOT NULL DEFAULT 0,
+    monitor_email TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_criteria_monitor_email ON user_criteria(monitor_email) WHERE email_monitoring_enabled = 1;
+
+CREATE TABLE IF NOT EXISTS processed_emails (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    email_message_id TEXT NOT NULL,
+    email_subject TEXT,
+    email_from TEXT,
+    listing_url TEXT,
+    processed_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    analysis_result TEXT,
+    analysis_status TEXT NOT NULL DEFAULT 'pending',
+    match_score INTEGER,
+    score_rank INTEGER GENERATED ALWAYS AS (COALESCE(match_score, -1)) VIRTUAL,
+    analysis_error TEXT,
+    UNIQUE(user_id, email_message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_listing ON processed_emails(user_id, listing_url);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_listing_url ON processed_emails(listing_url);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_ranked
+    ON processed_emails(user_id, score_rank DESC, processed_at DESC, id DESC) WHERE analysis_status = 'completed';
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_status ON processed_emails(user_id, analysis_status, processed_at DESC);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_changes ON processed_emails(user_id, updated_at, id);
+
+CREATE TABLE IF NOT EXISTS listing_facts (
+    listing_url TEXT PRIMARY KEY,
+    title TEXT,
+    content TEXT,
+    metadata TEXT,
+    facts TEXT NOT NULL DEFAULT '{}',
+    image_analysis TEXT,
+    computed_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    listing_type TEXT,
+    price_chf REAL,
+    additional_costs_chf REAL,
+    rooms REAL,
+    living_space_m2 REAL,
+    postal_code TEXT,
+    city TEXT,
+    features TEXT NOT NULL DEFAULT '[]'  -- lowercased, JSON array
+);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_created ON listing_facts(created_at);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_price ON listing_facts(price_chf);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_rooms ON listing_facts(rooms);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_space ON listing_facts(living_space_m2);
+
+-- Full-text indexes (same text as the Postgres tsvector columns), kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS listing_facts_fts USING fts5(title, body, tokenize = 'unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE IF NOT EXISTS processed_emails_fts USING fts5(report, tokenize = 'unicode61 remove_diacritics 2');
+
+CREATE TRIGGER IF NOT EXISTS listing_facts_fts_insert AFTER INSERT ON listing_facts BEGIN
+    INSERT INTO listing_facts_fts(rowid, title, body) VALUES (
+        new.rowid,
+        COALESCE(new.title, '') || ' ' || COALESCE(json_extract(new.facts, '$.title'), ''),
+        COALESCE(json_extract(new.facts, '$.summary'), '') || ' ' || COALESCE(json_extract(new.facts, '$.address'), '') || ' ' ||
+        COALESCE(json_extract(new.facts, '$.city'), '') || ' ' || COALESCE(json_extract(new.facts, '$.features'), '') || ' ' ||
+        COALESCE(json_extract(new.facts, '$.highlights'), '') || ' ' || COALESCE(new.content, '')
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS listing_facts_fts_update AFTER UPDATE OF title, content, facts ON listing_facts BEGIN
+    DELETE FROM listing_facts_fts WHERE rowid = old.rowid;
+    INSERT INTO listing_facts_fts(rowid, title, body) VALUES (
+        new.rowid,
+        COALESCE(new.title, '') || ' ' || COALESCE(json_extract(new.facts, '$.title'), ''),
+        COALESCE(json_extract(new.facts, '$.summary'), '') || ' ' || COALESCE(json_extract(new.facts, '$.address'), '') || ' ' ||
+        COALESCE(json_extract(new.facts, '$.city'), '') || ' ' || COALESCE(json_extract(new.facts, '$.features'), '') || ' ' ||
+        COALESCE(json_extract(new.facts, '$.highlights'), '') || ' ' || COALESCE(new.content, '')
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS listing_facts_fts_delete AFTER DELETE ON listing_facts BEGIN
+    DELETE FROM listing_facts_fts WHERE rowid = old.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS processed_emails_fts_insert AFTER INSERT ON processed_emails BEGIN
+    INSERT INTO processed_emails_fts(rowid, report) VALUES (new.rowid, COALESCE(json_extract(new.analysis_result, '$.report'), ''));
+END;
+CREATE TRIGGER IF NOT EXISTS processed_emails_fts_update AFTER UPDATE OF analysis_result ON processed_emails BEGIN
+    DELETE FROM processed_emails_fts WHERE rowid = old.rowid;
+    INSERT INTO processed_emails_fts(rowid, report) VALUES (new.rowid, COALESCE(json_extract(new.analysis_result, '$.report'), ''));
+END;
+CREATE TRIGGER IF NOT EXISTS processed_emails_fts_delete AFTER DELETE ON processed_emails BEGIN
+    DELETE FROM processed_emails_fts WHERE rowid = old.rowid;
+END;
+"""
+
+# Columns written as given; JSON columns are (de)serialized
+PROCESSED_EMAIL_COLUMNS = (
+    "user_id", "email_message_id", "email_subject", "email_from", "listing_url",
+    "analysis_result", "analysis_status", "match_score", "analysis_error",
+)
+LISTING_FACTS_COLUMNS = (
+    "listing_url", "title", "content", "metadata", "facts", "image_analysis", "computed_at",
+    "listing_type", "price_chf", "additional_costs_chf", "rooms", "living_space_m2", "postal_code", "city", "features",
+)
+JSON_COLUMNS = {"analysis_result", "metadata", "facts", "features"}
+# search_listings column -> SQL expression over processed_emails pe JOIN listing_facts lf
+SQLITE_SEARCH_COLUMNS = {
+    "id": "pe.id",
+    "listing_url": "pe.listing_url",
+    "title": "COALESCE(json_extract(lf.facts, '$.title'), lf.title)",
+    "listing_type": "lf.listing_type",
+    "price_chf": "lf.price_chf",
+    "additional_costs_chf": "lf.additional_costs_chf",
+    "rooms": "lf.rooms",
+    "living_space_m2": "lf.living_space_m2",
+    "postal_code": "lf.postal_code",
+    "city": "lf.city",
+    "features": "lf.features",
+    "listing_image_url": "json_extract(lf.facts, '$.listing_image_url')",
+    "match_score": "pe.match_score",
+    "score_rank": "pe.score_rank",
+    "analysis_status": "pe.analysis_status",
+    "processed_at": "pe.processed_at",
+}
+SQLITE_BATCH = 500  # bound parameters per IN (...) list
+
+
+def _fts5_query(query: str) -> Optional[str]:
+    """
+    FTS5 query for a web-search style query: words and "quoted phrases" must all match, -word excludes,
+    "or" between terms matches either. Every term is quoted, so FTS5 operators in the input stay literal.
+    None if the query has no positive term.
+    """
+    terms: List[str] = []
+    excluded: List[str] = []
+    join_next = False
+    for negate, phrase, word in re.findall(r'(-?)(?:"([^"]*)"|(\S+))', query):
+        text = (phrase or word).strip()
+        if not text:
+            continue
+        if word and not negate and text.lower() == "or":
+            join_next = bool(terms)
+            continue
+        term = '"' + text.replace('"', '""') + '"'
+        if negate:
+            excluded.append(term)
+        elif join_next:
+            terms[-1] = f"{terms[-1]} OR {term}"
+            join_next = False
+        else:
+            terms.append(term)
+    if not terms:
+        return None
+    return " AND ".join(f"({term})" if " OR " in term else term for term in terms) + "".join(f" NOT {term}" for term in excluded)
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite database in WAL mode (concurrent readers, one writer). One connection per thread;
+    statements autocommit. Criteria rows are stored as JSON next to the columns that are queried.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db().executescript(SQLITE_SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # Unicode case folding for ieq filters (SQLite's lower() and NOCASE only fold ASCII)
+            connection.create_function("casefold", 1, lambda value: value.casefold() if isinstance(value, str) else value, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def _rows(self, sql: str, params: Sequence = ()) -> List[dict]:
+        return [self._decode(row) for row in self._db().execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> dict:
+        item = dict(row)
+        for column in JSON_COLUMNS.intersection(item):
+            if isinstance(item[column], str):
+                item[column] = json.loads(item[column])
+        return item
+
+    @staticmethod
+    def _encode(column: str, value):
+        return json.dumps(value, default=str) if column in JSON_COLUMNS and value is not None else value
+
+    # User criteria
+    @staticmethod
+    def _criteria_row(row: sqlite3.Row) -> dict:
+        return {
+            **json.loads(row["data"]),
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "email_monitoring_enabled": bool(row["email_monitoring_enabled"]),
+            "monitor_email": row["monitor_email"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def _write_criteria(self, criteria_id: str, user_id: str, data: dict, created_at: str, insert: bool) -> dict:
+        data = {key: value for key, value in data.items() if key not in ("id", "user_id", "created_at", "updated_at")}
+        params = (
+            json.dumps(data, default=str), 1 if data.get("email_monitoring_enabled") else 0,
+            data.get("monitor_email"), _now(),
+        )
+        if insert:
+            self._db().execute(
+                "INSERT INTO user_criteria (data, email_monitoring_enabled, monitor_email, updated_at, id, user_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                params + (criteria_id, user_id, created_at),
+            )
+        else:
+            self._db().execute(
+                "UPDATE user_criteria SET data = ?, email_monitoring_enabled = ?, monitor_email = ?, updated_at = ? WHERE id = ?",
+                params + (criteria_id,),
+            )
+        return self.get_criteria(user_id)
+
+    def get_criteria(self, user_id: str) -> Optional[dict]:
+        row = self._db().execute("SELECT * FROM user_criteria WHERE user_id = ?", (str(user_id),)).fetchone()
+        return self._criteria_row(row) if row else None
+
+    def criteria_for_users(self, user_ids: Sequence[str], monitoring_only: bool = False) -> List[dict]:
+        user_ids = [str(user_id) for user_id in user_ids]
+        rows = []
+        for start in range(0, len(user_ids), SQLITE_BATCH):
+            chunk = user_ids[start:start + SQLITE_BATCH]
+            sql = f"SELECT * FROM user_criteria WHERE user_id IN ({','.join('?' * len(chunk))})"
+            if monitoring_only:
+                sql += " AND email_monitoring_enabled = 1"
+            rows.extend(self._criteria_row(row) for row in self._db().execute(sql, chunk))
+        return rows
+
+    def criteria_by_monitor_email(self, addresses: Sequence[str]) -> List[dict]:
+        addresses = list(addresses)
+        if not addresses:
+            return []
+        sql = f"SELECT * FROM user_criteria WHERE email_monitoring_enabled = 1 AND monitor_email IN ({','.join('?' * len(addresses))})"
+        return [self._criteria_row(row) for row in self._db().execute(sql, addresses)]
+
+    def monitoring_criteria(self) -> List[dict]:
+        return [self._criteria_row(row) for row in self._db().execute(
+            "SELECT * FROM user_criteria WHERE email_monitoring_enabled = 1 ORDER BY user_id"
+        )]
+
+    def insert_criteria(self, data: dict) -> Optional[dict]:
+        return self._write_criteria(str(data.get("id") or uuid.uuid4()), str(data["user_id"]), data, data.get("created_at") or _now(), insert=True)
+
+    def update_criteria(self, user_id: str, data: dict) -> Optional[dict]:
+        existing = self.get_criteria(user_id)
+        if existing is None:
+            return None
+        return self._write_criteria(existing["id"], existing["user_id"], {**existing, **data}, existing["created_at"], insert=False)
+
+    # Processed emails and analyses
+    def email_processed(self, user_id: str, message_id: str) -> bool:
+        row = self._db().execute(
+            "SELECT 1 FROM processed_emails WHERE user_id = ? AND email_message_id = ? LIMIT 1", (str(user_id), message_id)
+        ).fetchone()
+        return row is not None
+
+    def insert_processed_email(self, row: dict) -> dict:
+        now = _now()
+        record = {"analysis_status": "pending", **{column: row.get(column) for column in PROCESSED_EMAIL_COLUMNS if column in row}}
+        record.update({"id": str(row.get("id") or uuid.uuid4()), "user_id": str(row["user_id"]), "processed_at": now, "updated_at": now})
+        columns = list(record)
+        self._db().execute(
+            f"INSERT INTO processed_emails ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [self._encode(column, record[column]) for column in columns],
+        )
+        return record
+
+    def update_analysis(self, user_id: str, listing_url: str, data: dict) -> List[dict]:
+        columns = [column for column in PROCESSED_EMAIL_COLUMNS if column in data]
+        assignments = ", ".join(f"{column} = ?" for column in columns + ["updated_at"])
+        params = [self._encode(column, data[column]) for column in columns] + [_now(), str(user_id), listing_url]
+        return self._rows(
+            f"UPDATE processed_emails SET {assignments} WHERE user_id = ? AND listing_url = ? RETURNING id", params
+        )
+
+    def find_analysis(self, user_id: str, listing_url: str, status: Optional[str] = None) -> Optional[dict]:
+        sql = "SELECT id, analysis_status, analysis_result FROM processed_emails WHERE user_id = ? AND listing_url = ?"
+        params = [str(user_id), listing_url]
+        if status:
+            sql += " AND analysis_status = ?"
+            params.append(status)
+        rows = self._rows(sql + " LIMIT 1", params)
+        return rows[0] if rows else None
+
+    def get_analysis(self, user_id: str, analysis_id: str) -> Optional[dict]:
+        rows = self._rows(
+            f"SELECT {ANALYSIS_SUMMARY_COLUMNS}, analysis_result FROM processed_emails WHERE id = ? AND user_id = ?",
+            (str(analysis_id), str(user_id)),
+        )
+        return rows[0] if rows else None
+
+    def users_with_listing(self, listing_url: str, user_ids: Optional[Sequence[str]] = None, status: Optional[str] = None) -> List[str]:
+        sql = "SELECT DISTINCT user_id FROM processed_emails WHERE listing_url = ?"
+        params: List[Any] = [listing_url]
+        if status:
+            sql += " AND analysis_status = ?"
+            params.append(status)
+        found = [row["user_id"] for row in self._db().execute(sql, params)]
+        if user_ids is not None:
+            wanted = {str(user_id) for user_id in user_ids}
+            found = [user_id for user_id in found if user_id in wanted]
+        return found
+
+    def analyses_for_urls(self, user_id: str, listing_urls: Sequence[str]) -> List[dict]:
+        listing_urls = list(listing_urls)
+        rows = []
+        for start in range(0, len(listing_urls), SQLITE_BATCH):
+            chunk = listing_urls[start:start + SQLITE_BATCH]
+            rows.extend(self._rows(
+                "SELECT id, listing_url, analysis_status, match_score, "
+                "json_extract(analysis_result, '$.criteria_hash') AS criteria_hash, "
+                "json_extract(analysis_result, '$.verdict') AS verdict, "
+                "json_extract(analysis_result, '$.structured.title') AS title "
+                f"FROM processed_emails WHERE user_id = ? AND listing_url IN ({','.join('?' * len(chunk))})",
+                [str(user_id)] + chunk,
+            ))
+        return rows
+
+    def completed_analysis_keys(self, user_id: str) -> List[dict]:
+        rows = self._rows(
+            "SELECT id, listing_url, json_extract(analysis_result, '$.criteria_hash') AS criteria_hash, "
+            "json_extract(analysis_result, '$.duplicate_of') AS duplicate_of "
+            "FROM processed_emails WHERE user_id = ? AND analysis_status = 'completed'",
+            (str(user_id),),
+        )
+        for row in rows:
+            if row["duplicate_of"]:
+                row["duplicate_of"] = json.loads(row["duplicate_of"])
+        return rows
+
+    def ranked_analyses(self, user_id: str, limit: int, after: Optional[Tuple[int, str, str]] = None) -> List[dict]:
+        sql = f"SELECT {ANALYSIS_SUMMARY_COLUMNS} FROM processed_emails WHERE user_id = ? AND analysis_status = 'completed'"
+        params: List[Any] = [str(user_id)]
+        if after:
+            sql += " AND (score_rank, processed_at, id) < (?, ?, ?)"
+            params.extend(after)
+        sql += " ORDER BY score_rank DESC, processed_at DESC, id DESC LIMIT ?"
+        return self._rows(sql, params + [limit])
+
+    def pending_analyses(self, user_id: str, statuses: Sequence[str] = ("pending",), limit: int = 100) -> List[dict]:
+        statuses = list(statuses)
+        return self._rows(
+            f"SELECT {ANALYSIS_SUMMARY_COLUMNS} FROM processed_emails WHERE user_id = ? "
+            f"AND analysis_status IN ({','.join('?' * len(statuses))}) ORDER BY processed_at DESC LIMIT ?",
+            [str(user_id)] + statuses + [limit],
+        )
+
+    def analysis_changes(self, user_id: str, after: Tuple[str, str], until: str, limit: int = 100) -> List[dict]:
+        return self._rows(
+            f"SELECT {ANALYSIS_SUMMARY_COLUMNS}, updated_at FROM processed_emails WHERE user_id = ? "
+            "AND (updated_at, id) > (?, ?) AND updated_at <= ? ORDER BY updated_at, id LIMIT ?",
+            (str(user_id), after[0], after[1], until, limit),
+        )
+
+    # Listing facts
+    def get_listing_facts(self, listing_url: str) -> Optional[dict]:
+        rows = self._rows(
+            "SELECT listing_url, title, content, metadata, facts, image_analysis, computed_at FROM listing_facts WHERE listing_url = ?",
+            (listing_url,),
+        )
+        return rows[0] if rows else None
+
+    def listing_facts_for(self, listing_urls: Sequence[str]) -> List[dict]:
+        listing_urls = list(listing_urls)
+        rows = []
+        for start in range(0, len(listing_urls), SQLITE_BATCH):
+            chunk = listing_urls[start:start + SQLITE_BATCH]
+            rows.extend(self._rows(
+                f"SELECT listing_url, title, facts, image_analysis FROM listing_facts WHERE listing_url IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return rows
+
+    def listing_facts_since(self, since: str) -> List[dict]:
+        return self._rows("SELECT listing_url, facts, image_analysis FROM listing_facts WHERE created_at >= ?", (since,))
+
+    def save_listing_facts(self, row: dict) -> None:
+        columns = [column for column in LISTING_FACTS_COLUMNS if column in row]
+        now = _now()
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "listing_url")
+        self._db().execute(
+            f"INSERT INTO listing_facts ({', '.join(columns)}, created_at, updated_at) VALUES ({', '.join('?' * len(columns))}, ?, ?) "
+            f"ON CONFLICT(listing_url) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+            [self._encode(column, row[column]) for column in columns] + [now, now],
+        )
+
+    def search_listings(self, user_id, filters, features, query, sort, limit, offset) -> List[dict]:
+        select = ", ".join(f"{SQLITE_SEARCH_COLUMNS[column]} AS {column}" for column in USER_LISTINGS_COLUMNS.split(", "))
+        conditions = ["pe.user_id = ?"]
+        params: List[Any] = [str(user_id)]
+        for column, operator, value in filters:
+            expression = SQLITE_SEARCH_COLUMNS[column]
+            conditions.append({
+                "eq": f"{expression} = ?", "ieq": f"casefold({expression}) = casefold(?)", "gte": f"{expression} >= ?", "lte": f"{expression} <= ?",
+            }[operator])
+            params.append(value)
+        for feature in features:
+            conditions.append("EXISTS (SELECT 1 FROM json_each(lf.features) WHERE value = ?)")
+            params.append(feature)
+        match = _fts5_query(query) if query else None
+        if match:
+            # Either the listing or the user's report may contain the words
+            conditions.append(
+                "(lf.rowid IN (SELECT rowid FROM listing_facts_fts WHERE listing_facts_fts MATCH ?) "
+                "OR pe.rowid IN (SELECT rowid FROM processed_emails_fts WHERE processed_emails_fts MATCH ?))"
+            )
+            params.extend([match, match])
+        column, descending = sort
+        order = f"{SQLITE_SEARCH_COLUMNS[column]} {'DESC' if descending else 'ASC'} NULLS LAST, pe.id DESC"
+        return self._rows(
+            f"SELECT {select} FROM processed_emails pe JOIN listing_facts lf ON lf.listing_url = pe.listing_url "
+            f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+
+
+def create_storage(backend: str, supabase_client=None, sqlite_path: str = "repa.db") -> Optional[Storage]:
+    """Storage for the configured backend; None if it is Supabase and Supabase is not configured"""
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path)
+    if backend != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected supabase or sqlite)")
+    return SupabaseStorage(supabase_client) if supabase_client else None
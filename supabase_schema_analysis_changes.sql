@@ -0,0 +1,35 @@
+-- Migration: Change feed support for processed_emails
+-- Run this in Supabase SQL Editor after supabase_schema_analysis_summary.sql (safe to re-run).
+-- GET /api/user/analyses/changes?since=<cursor> returns rows whose (updated_at, id) moved past the cursor.
+
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT clock_timestamp();
+
+-- NOW() is the transaction start time; clock_timestamp() is when the row is actually written,
+-- which keeps updated_at close to the commit order the change feed cursor relies on
+ALTER TABLE processed_emails ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+
+-- Backfill existing rows
+UPDATE processed_emails SET updated_at = COALESCE(processed_at, NOW()) WHERE updated_at IS NULL;
+
+-- Add comment
+COMMENT ON COLUMN processed_emails.updated_at IS 'Last change to the row; change feed cursor (with id)';
+
+CREATE OR REPLACE FUNCTION update_processed_emails_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS update_processed_emails_updated_at ON processed_emails;
+CREATE TRIGGER update_processed_emails_updated_at
+    BEFORE UPDATE ON processed_emails
+    FOR EACH ROW
+    EXECUTE FUNCTION update_processed_emails_updated_at();
+
+-- Change feed lookups: WHERE user_id = ? AND (updated_at, id) > (?, ?) ORDER BY updated_at, id
+DROP INDEX IF EXISTS idx_processed_emails_user_updated;
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_changes
+ON processed_emails(user_id, updated_at, id);
@@ -0,0 +1,44 @@
+-- Migration: Persist analysis summary columns on processed_emails
+-- Run this in Supabase SQL Editor after supabase_schema_email.sql.
+-- The analyses list endpoint projects these columns instead of downloading every
+-- full report in analysis_result and re-parsing the match score on each request.
+
+-- Match score (0-100) extracted once when the analysis is written
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS match_score INTEGER CHECK (match_score IS NULL OR (match_score >= 0 AND match_score <= 100));
+
+-- Analysis status: "pending" (no result yet), "completed" (report stored) or "error"
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS analysis_status TEXT DEFAULT 'pending' CHECK (analysis_status IN ('pending', 'completed', 'error'));
+
+-- Sort key for keyset pagination: completed analyses without a parsable score sort last
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS score_rank INTEGER GENERATED ALWAYS AS (COALESCE(match_score, -1)) STORED;
+
+-- Short error message for failed analyses (so the list never needs analysis_result)
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS analysis_error TEXT;
+
+-- Add comments
+COMMENT ON COLUMN processed_emails.match_score IS 'Match score (0-100) extracted from the report at write time';
+COMMENT ON COLUMN processed_emails.analysis_status IS 'Analysis status: "pending", "completed" or "error"';
+COMMENT ON COLUMN processed_emails.score_rank IS 'COALESCE(match_score, -1); keyset pagination sort key';
+
+-- Backfill existing rows
+UPDATE processed_emails
+SET analysis_status = CASE
+        WHEN analysis_result IS NULL THEN 'pending'
+        WHEN analysis_result ? 'error' THEN 'error'
+        ELSE 'completed'
+    END,
+    analysis_error = analysis_result->>'error',
+    match_score = LEAST(100, (substring(analysis_result->>'report' from '(?i)Match\s*Score\s*:\s*\[?\s*(\d{1,3})\s*\]?\s*%'))::INTEGER);
+
+-- Ranked listing of completed analyses: ORDER BY score_rank DESC, processed_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_ranked
+ON processed_emails(user_id, score_rank DESC, processed_at DESC, id DESC)
+WHERE analysis_status = 'completed';
+
+-- Pending/error listing ordered by recency
+CREATE INDEX IF NOT EXISTS idx_processed_emails_user_status
+ON processed_emails(user_id, analysis_status, processed_at DESC);
@@ -0,0 +1,39 @@
+-- Migration: Change detection for analysed listings
+-- Run this in Supabase SQL Editor after supabase_schema_listing_facts.sql.
+-- The listing refresher re-fetches analysed listings with conditional requests and keeps what it needs to
+-- detect changes here; listings are re-analysed only when a meaningful fact (price, rooms, ...) changed.
+
+CREATE TABLE IF NOT EXISTS listing_refresh_state (
+    listing_url TEXT PRIMARY KEY,
+    etag TEXT,                  -- Validators of the last direct fetch (If-None-Match / If-Modified-Since)
+    last_modified TEXT,
+    content_hash TEXT,          -- Hash of the page's visible text ("direct:..." or "firecrawl:...")
+    facts_hash TEXT,            -- Hash of the normalized meaningful facts
+    checked_at TIMESTAMP WITH TIME ZONE,
+    changed_at TIMESTAMP WITH TIME ZONE,
+    removed_at TIMESTAMP WITH TIME ZONE, -- Set when the portal answered 404/410; no longer checked
+    direct_blocked_at TIMESTAMP WITH TIME ZONE  -- Set while the portal blocks direct requests (checked less often)
+);
+
+-- For tables created before direct_blocked_at existed
+ALTER TABLE listing_refresh_state
+ADD COLUMN IF NOT EXISTS direct_blocked_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS listing_price_history (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    listing_url TEXT NOT NULL,
+    price_chf NUMERIC,
+    additional_costs_chf NUMERIC,
+    available_from TEXT,
+    observed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_listing_price_history_url ON listing_price_history(listing_url, observed_at);
+
+-- Add comments
+COMMENT ON TABLE listing_refresh_state IS 'Per-listing change detection state for the listing refresher';
+COMMENT ON TABLE listing_price_history IS 'Price and availability of a listing each time it changed (first row: when it was analysed)';
+
+-- Enable Row Level Security (no policies: only the service role reads/writes these tables)
+ALTER TABLE listing_refresh_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE listing_price_history ENABLE ROW LEVEL SECURITY;
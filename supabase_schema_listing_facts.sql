@@ -0,0 +1,32 @@
+-- Migration: Listing facts table (stage 1 of the analysis pipeline)
+-- Run this in Supabase SQL Editor.
+-- Facts are user-independent (scraped content, structured fields, image summaries, highlights/concerns)
+-- and are computed once per listing; each user's match report is generated from them.
+
+CREATE TABLE IF NOT EXISTS listing_facts (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    listing_url TEXT NOT NULL UNIQUE,
+    title TEXT,
+    content TEXT,
+    metadata JSONB,
+    facts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    image_analysis TEXT,
+    computed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Add comments
+COMMENT ON TABLE listing_facts IS 'User-independent listing facts, computed once per listing URL';
+COMMENT ON COLUMN listing_facts.facts IS 'Structured fields (price_chf, rooms, living_space_m2, postal_code, ...), features, highlights, concerns';
+COMMENT ON COLUMN listing_facts.image_analysis IS 'Per-image vision summaries (markdown, includes image URLs)';
+
+-- Enable Row Level Security (no policies: only the service role reads/writes listing facts)
+ALTER TABLE listing_facts ENABLE ROW LEVEL SECURITY;
+
+-- Keep updated_at current (update_updated_at_column() is defined in supabase_schema.sql)
+DROP TRIGGER IF EXISTS update_listing_facts_updated_at ON listing_facts;
+CREATE TRIGGER update_listing_facts_updated_at
+    BEFORE UPDATE ON listing_facts
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
@@ -0,0 +1,28 @@
+-- Migration: Cross-portal listing fingerprints
+-- Run this in Supabase SQL Editor after supabase_schema_listing_facts.sql.
+-- The same apartment is often advertised on Homegate, ImmoScout24 and Flatfox under different URLs.
+-- Each analysed listing is fingerprinted (normalized address, rooms, living space, price); a new URL whose
+-- fingerprint matches an earlier listing reuses that listing's analysis instead of running the report stages.
+
+CREATE TABLE IF NOT EXISTS listing_fingerprints (
+    listing_url TEXT PRIMARY KEY,
+    address_key TEXT NOT NULL,          -- "<postal code or city>:<street+number>", e.g. "8002:seestr12"
+    listing_type TEXT,                  -- "rent" / "buy"
+    rooms NUMERIC,
+    living_space_m2 NUMERIC,
+    price_chf NUMERIC,
+    additional_costs_chf NUMERIC,
+    canonical_url TEXT,                 -- First listing seen with a matching fingerprint; NULL if this is it
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Add comments
+COMMENT ON TABLE listing_fingerprints IS 'Listing fingerprints for cross-portal duplicate detection';
+COMMENT ON COLUMN listing_fingerprints.canonical_url IS 'Listing URL this one duplicates (NULL for the first listing with this fingerprint)';
+
+-- Candidate lookup: all listings at the same normalized address, oldest first
+CREATE INDEX IF NOT EXISTS idx_listing_fingerprints_address
+ON listing_fingerprints(address_key, created_at);
+
+-- Enable Row Level Security (no policies: only the service role reads/writes fingerprints)
+ALTER TABLE listing_fingerprints ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,88 @@
+-- Migration: Searchable analysed listings (GET /api/user/listings)
+-- Run this in Supabase SQL Editor after supabase_schema_listing_facts.sql and supabase_schema_analysis_summary.sql.
+-- Listing facts are stored in typed, indexed columns next to the facts JSON (written by the app together with
+-- the facts), and listing text and reports get full-text indexes, so users can filter and search what has
+-- already been analysed without downloading any reports.
+
+-- Typed facts columns (NULL when the listing does not state the value)
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS listing_type TEXT;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS price_chf NUMERIC;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS additional_costs_chf NUMERIC;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS rooms NUMERIC;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS living_space_m2 NUMERIC;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS postal_code TEXT;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS city TEXT;
+ALTER TABLE listing_facts ADD COLUMN IF NOT EXISTS features TEXT[] NOT NULL DEFAULT '{}';  -- lowercased
+
+-- Full-text search over the listing: title and summary rank above features and the scraped page text
+ALTER TABLE listing_facts
+ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', COALESCE(title, '') || ' ' || COALESCE(facts->>'title', '')), 'A') ||
+    setweight(to_tsvector('simple', COALESCE(facts->>'summary', '') || ' ' || COALESCE(facts->>'address', '') || ' ' || COALESCE(facts->>'city', '')), 'B') ||
+    setweight(to_tsvector('simple', COALESCE((facts->'features')::TEXT, '') || ' ' || COALESCE((facts->'highlights')::TEXT, '')), 'C') ||
+    setweight(to_tsvector('simple', COALESCE(content, '')), 'D')
+) STORED;
+
+-- Full-text search over each user's report
+ALTER TABLE processed_emails
+ADD COLUMN IF NOT EXISTS report_search TSVECTOR GENERATED ALWAYS AS (
+    to_tsvector('simple', COALESCE(analysis_result->>'report', ''))
+) STORED;
+
+-- Add comments
+COMMENT ON COLUMN listing_facts.features IS 'Lowercased amenities from facts.features (balcony, elevator, ...)';
+COMMENT ON COLUMN listing_facts.search_vector IS 'Full-text index over title, summary, address, features, highlights and page text';
+COMMENT ON COLUMN processed_emails.report_search IS 'Full-text index over the rendered match report';
+
+-- Backfill typed columns from the facts JSON (values that are not plain numbers stay NULL)
+UPDATE listing_facts
+SET listing_type = facts->>'listing_type',
+    price_chf = CASE WHEN facts->>'price_chf' ~ '^\d+(\.\d+)?$' THEN (facts->>'price_chf')::NUMERIC END,
+    additional_costs_chf = CASE WHEN facts->>'additional_costs_chf' ~ '^\d+(\.\d+)?$' THEN (facts->>'additional_costs_chf')::NUMERIC END,
+    rooms = CASE WHEN facts->>'rooms' ~ '^\d+(\.\d+)?$' THEN (facts->>'rooms')::NUMERIC END,
+    living_space_m2 = CASE WHEN facts->>'living_space_m2' ~ '^\d+(\.\d+)?$' THEN (facts->>'living_space_m2')::NUMERIC END,
+    postal_code = facts->>'postal_code',
+    city = facts->>'city',
+    features = COALESCE(
+        (SELECT array_agg(lower(trim(feature))) FROM jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(facts->'features') = 'array' THEN facts->'features' ELSE '[]'::jsonb END
+        ) AS feature),
+        '{}'
+    );
+
+-- Indexes for the filters and search
+CREATE INDEX IF NOT EXISTS idx_listing_facts_price ON listing_facts(price_chf);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_rooms ON listing_facts(rooms);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_space ON listing_facts(living_space_m2);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_features ON listing_facts USING GIN(features);
+CREATE INDEX IF NOT EXISTS idx_listing_facts_search ON listing_facts USING GIN(search_vector);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_report_search ON processed_emails USING GIN(report_search);
+CREATE INDEX IF NOT EXISTS idx_processed_emails_listing_url ON processed_emails(listing_url);
+
+-- One row per analysis with the listing's typed facts; queried with user_id = the requesting user.
+-- security_invoker: the view applies the caller's RLS policies (the app queries it with the service role).
+CREATE OR REPLACE VIEW user_listings WITH (security_invoker = true) AS
+SELECT
+    pe.id,
+    pe.user_id,
+    pe.listing_url,
+    pe.analysis_status,
+    pe.match_score,
+    pe.score_rank,
+    pe.processed_at,
+    pe.report_search,
+    COALESCE(lf.facts->>'title', lf.title) AS title,
+    lf.listing_type,
+    lf.price_chf,
+    lf.additional_costs_chf,
+    lf.rooms,
+    lf.living_space_m2,
+    lf.postal_code,
+    lf.city,
+    lf.features,
+    lf.facts->>'listing_image_url' AS listing_image_url,
+    lf.search_vector AS listing_search
+FROM processed_emails pe
+JOIN listing_facts lf ON lf.listing_url = pe.listing_url;
+
+COMMENT ON VIEW user_listings IS 'Analysed listings with typed facts, for GET /api/user/listings';
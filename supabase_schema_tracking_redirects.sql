@@ -0,0 +1,18 @@
+-- Migration: Resolved click-tracking links (SendGrid) from alert emails
+-- Run this in Supabase SQL Editor.
+-- Alert emails that only contain tracking links are resolved to listing URLs once; re-sent alerts and
+-- retries read the result from here instead of following the redirect again.
+
+CREATE TABLE IF NOT EXISTS tracking_redirects (
+    url_hash TEXT PRIMARY KEY,  -- SHA-256 of tracking_url (tracking links can exceed index size limits)
+    tracking_url TEXT NOT NULL,
+    listing_url TEXT,           -- NULL: the link does not lead to a listing page (guide, alert settings, ...)
+    resolved_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Add comments
+COMMENT ON TABLE tracking_redirects IS 'Click-tracking URL -> listing URL cache for email URL extraction';
+COMMENT ON COLUMN tracking_redirects.listing_url IS 'Listing URL the tracking link redirects to, NULL if it is not a listing page';
+
+-- Enable Row Level Security (no policies: only the service role reads/writes the cache)
+ALTER TABLE tracking_redirects ENABLE ROW LEVEL SECURITY;
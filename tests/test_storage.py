@@ -0,0 +1,138 @@
+"""SQLiteStorage against a temporary database file (no Supabase or API keys needed)."""
+
+import sqlite3
+import time
+
+import pytest
+
+from storage import SQLiteStorage, _fts5_query
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+OTHER_USER_ID = "00000000-0000-0000-0000-000000000002"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStorage(str(tmp_path / "repa.db"))
+
+
+def _insert_analysis(store, listing_url, match_score=None, user_id=USER_ID):
+    return store.insert_processed_email({
+        "user_id": user_id,
+        "email_message_id": f"msg:{listing_url}",
+        "email_subject": "New listing",
+        "listing_url": listing_url,
+        "analysis_status": "completed" if match_score is not None else "pending",
+        "match_score": match_score,
+    })
+
+
+def test_criteria_round_trip(store):
+    inserted = store.insert_criteria({
+        "user_id": USER_ID, "location": "Zürich", "min_rooms": 3.5, "max_rent": 3000,
+        "user_additional_requirements": ["balcony"], "email_monitoring_enabled": True, "monitor_email": "u1@example.com",
+    })
+    assert inserted["location"] == "Zürich"
+    assert inserted["min_rooms"] == 3.5
+    assert inserted["user_additional_requirements"] == ["balcony"]
+    assert inserted["email_monitoring_enabled"] is True
+
+    updated = store.update_criteria(USER_ID, {"max_rent": 3200})
+    assert updated["id"] == inserted["id"]
+    assert updated["created_at"] == inserted["created_at"]
+    assert updated["max_rent"] == 3200 and updated["location"] == "Zürich"
+    assert store.get_criteria(USER_ID) == updated
+    assert [row["user_id"] for row in store.criteria_by_monitor_email(["u1@example.com"])] == [USER_ID]
+    assert store.update_criteria(OTHER_USER_ID, {"max_rent": 1}) is None
+    assert store.get_criteria(OTHER_USER_ID) is None
+
+
+def test_update_analysis_sets_summary_columns(store):
+    inserted = _insert_analysis(store, "https://www.homegate.ch/rent/1")
+    _insert_analysis(store, "https://www.homegate.ch/rent/1", user_id=OTHER_USER_ID)
+
+    updated = store.update_analysis(USER_ID, "https://www.homegate.ch/rent/1", {
+        "analysis_result": {"match_score": 82, "verdict": "good"},
+        "analysis_status": "completed",
+        "match_score": 82,
+        "analysis_error": None,
+    })
+    assert updated == [{"id": inserted["id"]}]
+    row = store.get_analysis(USER_ID, inserted["id"])
+    assert row["analysis_status"] == "completed"
+    assert row["match_score"] == 82
+    assert row["score_rank"] == 82
+    assert row["analysis_result"] == {"match_score": 82, "verdict": "good"}
+    assert store.find_analysis(OTHER_USER_ID, "https://www.homegate.ch/rent/1")["analysis_status"] == "pending"
+    assert store.update_analysis(USER_ID, "https://www.homegate.ch/rent/unknown", {"match_score": 1}) == []
+
+
+def test_ranked_analyses_keyset_pages(store):
+    for index, score in enumerate([70, 90, 70, None, 50]):
+        _insert_analysis(store, f"https://www.homegate.ch/rent/{index}", score)
+    _insert_analysis(store, "https://www.homegate.ch/rent/other", 99, user_id=OTHER_USER_ID)
+
+    seen, after = [], None
+    while True:
+        page = store.ranked_analyses(USER_ID, 2, after)
+        if not page:
+            break
+        seen.extend(page)
+        last = page[-1]
+        after = (last["score_rank"], last["processed_at"], last["id"])
+
+    assert [row["match_score"] for row in seen] == [90, 70, 70, 50]
+    assert len({row["id"] for row in seen}) == 4
+    ties = [row for row in seen if row["match_score"] == 70]
+    assert [(row["processed_at"], row["id"]) for row in ties] == sorted(((row["processed_at"], row["id"]) for row in ties), reverse=True)
+
+
+def test_analysis_changes_after_cursor(store):
+    first = _insert_analysis(store, "https://www.homegate.ch/rent/1")
+    second = _insert_analysis(store, "https://www.homegate.ch/rent/2")
+    _insert_analysis(store, "https://www.homegate.ch/rent/3", user_id=OTHER_USER_ID)
+    until = "9999-12-31T00:00:00+00:00"
+
+    changes = store.analysis_changes(USER_ID, ("", ""), until)
+    assert {row["id"] for row in changes} == {first["id"], second["id"]}
+    assert [(row["updated_at"], row["id"]) for row in changes] == sorted((row["updated_at"], row["id"]) for row in changes)
+    cursor = (changes[-1]["updated_at"], changes[-1]["id"])
+    assert store.analysis_changes(USER_ID, cursor, until) == []
+
+    time.sleep(0.01)
+    store.update_analysis(USER_ID, "https://www.homegate.ch/rent/1", {"analysis_status": "completed", "match_score": 60})
+    changed = store.analysis_changes(USER_ID, cursor, until)
+    assert [(row["id"], row["match_score"]) for row in changed] == [(first["id"], 60)]
+    # Rows written after `until` wait for a later poll
+    assert store.analysis_changes(USER_ID, cursor, cursor[0]) == []
+
+
+def test_search_listings_ieq_folds_unicode_case(store):
+    _insert_analysis(store, "https://www.homegate.ch/rent/1", 80)
+    store.save_listing_facts({
+        "listing_url": "https://www.homegate.ch/rent/1", "title": "Altbau", "content": "", "facts": {},
+        "city": "Zürich", "rooms": 3.5, "features": [],
+    })
+    found = store.search_listings(USER_ID, [("city", "ieq", "ZÜRICH")], [], None, ("processed_at", True), 10, 0)
+    assert [row["listing_url"] for row in found] == ["https://www.homegate.ch/rent/1"]
+    assert store.search_listings(USER_ID, [("city", "ieq", "Zür%")], [], None, ("processed_at", True), 10, 0) == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("balcony", '"balcony"'),
+    ("balcony lake", '"balcony" AND "lake"'),
+    ('"lake view" -ground', '"lake view" NOT "ground"'),
+    ("balcony or terrace", '("balcony" OR "terrace")'),
+    ('NEAR(a b) col:x "un"closed', '"NEAR(a" AND "b)" AND "col:x" AND "un" AND "closed"'),
+    ('say "hi""', '"say" AND "hi" AND """"'),
+    ("-only", None),
+    ("or", None),
+])
+def test_fts5_query_quotes_every_term(query, expected):
+    assert _fts5_query(query) == expected
+    if expected:
+        # FTS5 accepts it: operators and stray quotes in the input are literal text
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE VIRTUAL TABLE documents USING fts5(body)")
+        connection.execute("INSERT INTO documents VALUES ('balcony with lake view, terrace')")
+        connection.execute("SELECT count(*) FROM documents WHERE documents MATCH ?", (expected,)).fetchone()